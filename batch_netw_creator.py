@@ -1,5 +1,8 @@
 import os
+import random
 import logging
+import multiprocessing
+import numpy as np
 import netw_creator as nc
 import shared_functions as sf
 
@@ -10,6 +13,8 @@ except ImportError:
 
 __author__ = 'Agostino Sturaro'
 
+logger = logging.getLogger(__name__)
+
 
 def write_conf(instance_dir, conf_fpath, a_options, b_options, inter_options, misc_options):
     config = ConfigParser()
@@ -37,10 +42,95 @@ def write_conf(instance_dir, conf_fpath, a_options, b_options, inter_options, mi
         config.write(configfile)
 
 
-this_dir = os.path.normpath(os.path.dirname(__file__))
-os.chdir(this_dir)
-sf.setup_logging('logging_base_conf.json')
-logger = logging.getLogger(__name__)
+# user defined graphs shared by all the instances created by this process, parsed only once
+_user_graphs = None
+
+
+def _init_creator_worker(user_graphs):
+    global _user_graphs
+    _user_graphs = user_graphs
+    sf.setup_logging('logging_base_conf.json')
+
+
+# create an instance, task is a tuple (configuration file path, instance directory, seed)
+# the global random generators are seeded too, so that the instance does not depend on the process that creates it
+# when the instance is complete, netw_creator lists its files in a manifest, along with the hash of the instance
+def create_instance(task):
+    conf_fpath, instance_dir, seed = task
+    random.seed(seed)
+    np.random.seed(seed)
+    nc.run(conf_fpath, False, _user_graphs)
+    return instance_dir
+
+
+# options of netw_creator that make it start its own pool of processes, (section, option name)
+nested_pool_opts = [('build_a', 'processes'), ('misc', 'centrality_processes')]
+
+
+# the options of a configuration file that make netw_creator start a pool of processes, as strings "section.option"
+def find_nested_pool_opts(conf_fpath):
+    config = ConfigParser()
+    config.read(conf_fpath)
+    found_opts = []
+    for section, opt_name in nested_pool_opts:
+        if config.has_option(section, opt_name) and config.getint(section, opt_name) != 1:
+            found_opts.append('{}.{}'.format(section, opt_name))
+    return found_opts
+
+
+# create the instances that are missing or incomplete, in a pool of processes, 0 means one for each CPU
+# an instance is complete if its manifest matches its files and its configuration, complete instances are skipped
+# user_graph_fpaths are the user defined graphs used by the instances, they are read before starting the processes,
+# that share them (on systems that fork processes, they are not even copied)
+# the processes of the pool are daemonic, and daemonic processes can't start processes of their own, so instances can
+# only be created in a pool if their configuration does not ask netw_creator for a pool (see nested_pool_opts), either
+# use a single process here, or set those options to 1 (the instances created are the same for any number of processes)
+def create_instances(tasks, processes=0, user_graph_fpaths=()):
+    global _user_graphs
+    if processes < 0:
+        raise ValueError('processes is not a positive number')
+    elif processes == 0:
+        processes = multiprocessing.cpu_count()
+
+    pending_tasks = []
+    for task in tasks:
+        conf_fpath, instance_dir = task[0], task[1]
+        if sf.check_manifest(instance_dir, {'instance_hash': nc.read_instance_hash(conf_fpath)}):
+            logger.info('Instance {} is complete, skipping it'.format(instance_dir))
+        else:
+            pending_tasks.append(task)
+    logger.info('Creating {} instances, {} were already complete'.format(len(pending_tasks),
+                                                                       len(tasks) - len(pending_tasks)))
+
+    if processes > 1 and len(pending_tasks) > 1:
+        for task in pending_tasks:
+            found_opts = find_nested_pool_opts(task[0])
+            if len(found_opts) > 0:
+                raise ValueError('Instances can\'t be created in a pool of processes if they use one themselves, set '
+                                 '{} to 1 in {}, or create the instances in a single process'.format(
+                                     ' and '.join(found_opts), task[0]))
+
+    user_graphs = nc.UserGraphCache()
+    if len(pending_tasks) > 0:
+        for fpath in user_graph_fpaths:
+            user_graphs.read_graphml(fpath)
+
+    if processes == 1 or len(pending_tasks) <= 1:
+        _user_graphs = user_graphs
+        try:
+            for task in pending_tasks:
+                create_instance(task)
+        finally:
+            _user_graphs = None
+    else:
+        pool = multiprocessing.Pool(processes, _init_creator_worker, (user_graphs,))
+        try:
+            pool.map(create_instance, pending_tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+
 base_dir = os.path.normpath('../Simulations/test_mp/MN')
 
 # remember to increase d_0 for bigger networks
@@ -182,36 +272,50 @@ misc_options = [{
 
 instances_per_type = 60
 first_seed = 0
+processes = 0  # number of instances created at the same time, 0 means one for each CPU
 
 # in older versions this list was generated randomly, now it's a simple range
 seeds = range(first_seed, first_seed + instances_per_type)
-print('seeds = {}'.format(seeds))
-
-# create directory if it does not exist, clean it if it already exists
-# TODO: this is not asking for confirmation!
-sf.makedirs_clean(base_dir, True)
-
-# outer cycle sets different network structure parameters, mixing build options for the 2 networks
-instance_num = 0
-first_group = True
-# TODO: simplify this and take a json without zipping
-for a_opts, b_opts, inter_opts, misc_opts in zip(build_a_options, build_b_options, build_inter_options, misc_options):
-
-    # inner cycle creates a number of instances with the same structure
-    created_for_type = 0
-    while created_for_type < instances_per_type:
-        a_opts['preassigned_roles_fpath'] = '../Simulations/MN_data_new/MN_pow_roles_{}.json'.format(instance_num)
-        if first_group is True:
-            seed = seeds[created_for_type]
-        else:
-            seed = seeds[instance_num % instances_per_type]
-        print('Current seed: {}'.format(seed))
-        misc_opts['seed'] = seed
-        instance_dir = os.path.join(base_dir, 'instance_{}'.format(instance_num))
-        conf_fpath = os.path.join(base_dir, 'config_{}.ini'.format(instance_num))
-        write_conf(instance_dir, conf_fpath, a_opts, b_opts, inter_opts, misc_opts)
-        nc.run(conf_fpath)
-        created_for_type += 1
-        instance_num += 1
-
-    first_group = False
+
+if __name__ == '__main__':
+    this_dir = os.path.normpath(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(this_dir)
+    sf.setup_logging('logging_base_conf.json')
+    print('seeds = {}'.format(seeds))
+
+    # create directory if it does not exist, instances that were already created are kept and checked
+    sf.ensure_dir_exists(base_dir)
+
+    # outer cycle sets different network structure parameters, mixing build options for the 2 networks
+    instance_tasks = []
+    instance_num = 0
+    first_group = True
+    # TODO: simplify this and take a json without zipping
+    for a_opts, b_opts, inter_opts, misc_opts in zip(build_a_options, build_b_options, build_inter_options,
+                                                     misc_options):
+
+        # inner cycle prepares a number of instances with the same structure
+        created_for_type = 0
+        while created_for_type < instances_per_type:
+            a_opts['preassigned_roles_fpath'] = '../Simulations/MN_data_new/MN_pow_roles_{}.json'.format(instance_num)
+            if first_group is True:
+                seed = seeds[created_for_type]
+            else:
+                seed = seeds[instance_num % instances_per_type]
+            misc_opts['seed'] = seed
+            instance_dir = os.path.join(base_dir, 'instance_{}'.format(instance_num))
+            conf_fpath = os.path.join(base_dir, 'config_{}.ini'.format(instance_num))
+            write_conf(instance_dir, conf_fpath, a_opts, b_opts, inter_opts, misc_opts)
+            instance_tasks.append((conf_fpath, instance_dir, seed))
+            created_for_type += 1
+            instance_num += 1
+
+        first_group = False
+
+    # the base graphs of the instances are read only once
+    base_graph_fpaths = set()
+    for opts in build_a_options + build_b_options:
+        if opts['model'] == 'user_defined_graph':
+            base_graph_fpaths.add(opts['user_graph_fpath'])
+
+    create_instances(instance_tasks, processes, sorted(base_graph_fpaths))
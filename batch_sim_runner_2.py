@@ -6,6 +6,8 @@ import logging
 import file_loader as fl
 import shared_functions as sf
 import cascades_sim as sim
+import run_metrics as rm
+import sim_profiler as sp
 from collections import OrderedDict
 
 try:
@@ -42,24 +44,6 @@ def write_conf(conf_fpath, paths, run_options, misc, safe_nodes_opts):
         config.write(conf_file)
 
 
-def pick_conf_values(config, opt_name):
-    values = None
-    if config[opt_name]['pick'] == 'range':
-        start = config[opt_name]['start']
-        stop = config[opt_name]['stop']
-        if 'step' in config[opt_name]:
-            step = config[opt_name]['step']
-        else:
-            step = 1
-        values = range(start, stop, step)
-    elif config[opt_name]['pick'] == 'specified':
-        if 'single_value' in config[opt_name]:
-            values = [config[opt_name]['single_value']]
-        elif 'list_of_values' in config[opt_name]:
-            values = config[opt_name]['list_of_values']
-    return values
-
-
 # An "instance" is a set of graphs forming an interdependent network (power, telecom and inter), indicated by a number
 # A "group" of simulations (sim_group) is intended to gather simulations executed using similar parameters. For example,
 # a group can contain simulations on the same instances executed changing only the random seed and the value of another
@@ -118,17 +102,37 @@ indep_var_name = batch_conf['indep_var_name']
 logger.info('indep_var_name = {}'.format(indep_var_name))
 
 # values of the independent value of the simulation
-indep_var_vals = pick_conf_values(batch_conf, 'indep_var_vals')
+indep_var_vals = sf.pick_conf_values(batch_conf, 'indep_var_vals')
 logger.info('indep_var_vals = {}'.format(indep_var_vals))
 
 # seeds used to execute multiple tests on the same network instance
-seeds = pick_conf_values(batch_conf, 'seeds')
+seeds = sf.pick_conf_values(batch_conf, 'seeds')
 logger.info('seeds = {}'.format(seeds))
 
+# if true, each simulation appends the wall time of its sections to a metrics file of its group
+if 'record_metrics' in batch_conf:
+    record_metrics = batch_conf['record_metrics']
+else:
+    record_metrics = False
+logger.info('record_metrics = {}'.format(record_metrics))
+
+# if specified, some simulations are profiled, see sim_profiler for the available options
+profiler = None
+if 'profile' in batch_conf:
+    profiler = sp.SimProfiler(batch_conf['profile'], 'batch_{}'.format(batch_no))
+    logger.info('profile = {}'.format(batch_conf['profile']))
+
 sim_cnt = len(base_configs) * len(indep_var_vals) * (last_instance - first_instance) * len(seeds)
 cur_sim_num = 0
 
-floader = fl.FileLoader()
+# if true, graphml files are read streaming them, it takes much less memory on large instances
+if 'stream_graphml' in batch_conf:
+    stream_graphml = batch_conf['stream_graphml']
+else:
+    stream_graphml = False
+logger.info('stream_graphml = {}'.format(stream_graphml))
+
+floader = fl.FileLoader(stream_graphml=stream_graphml)
 
 for sim_group in range(0, len(base_configs)):
     run_num_by_inst = {}  # number of simulations we ran for each instance i
@@ -150,11 +154,20 @@ for sim_group in range(0, len(base_configs)):
         group_index = csv.writer(group_index_file, delimiter='\t', quoting=csv.QUOTE_MINIMAL)
         group_index.writerow(['instance', 'instance_conf_fpath'])
 
+    # simulations append their metrics to this file, remove the one left by a previous execution of this batch
+    if record_metrics is True:
+        metrics_fpath = os.path.join(group_results_dir,
+                                     'batch_no_{}_sim_group_{}_metrics.tsv'.format(batch_no, sim_group))
+        if os.path.isfile(metrics_fpath):
+            os.remove(metrics_fpath)
+
     # outer cycle ranging over values of the independent variable
     for var_value in indep_var_vals:
         changing_options[indep_var_name] = var_value
         paths['end_stats_fpath'] = os.path.join(group_results_dir,
                                                 'batch_no_{}_sim_group_{}_stats.tsv'.format(batch_no, sim_group))
+        if record_metrics is True:
+            paths['metrics_fpath'] = metrics_fpath
 
         # inner cycle ranging over different network instances
         for instance_num in range(first_instance, last_instance, 1):
@@ -183,6 +196,23 @@ for sim_group in range(0, len(base_configs)):
 
                 logger.warning('Batch {}) Running simulation {} of {}\nsim group {}, value {}, instance {}, seed {}'
                                .format(batch_no, cur_sim_num, sim_cnt, sim_group, var_value, instance_num, seed))
-                sim.run(conf_fpath, floader)  # run the simulation
+                if profiler is None:
+                    sim.run(conf_fpath, floader)  # run the simulation
+                else:
+                    profiler.run('sim_{}'.format(cur_sim_num), cur_sim_num, sim.run, conf_fpath, floader)
                 run_num_by_inst[instance_num] += 1  # next simulation for this instance will be number + 1
                 cur_sim_num += 1
+
+# aggregate the metrics of the whole batch, so that hot spots and regressions are easy to spot
+if record_metrics is True:
+    metrics_fpaths = rm.list_batch_metrics_fpaths(batch_conf, batch_no)
+    summary_fpath = os.path.join(os.path.dirname(metrics_fpaths[0]), 'batch_no_{}_metrics_summary.tsv'.format(batch_no))
+    summary = rm.write_metrics_summary(metrics_fpaths, summary_fpath)
+    if 'total_time' in summary:
+        logger.warning('Batch {}) {} simulations, mean time {:.3f}s, max time {:.3f}s, metrics summary in {}'.format(
+            batch_no, summary['total_time']['count'], summary['total_time']['mean'], summary['total_time']['max'],
+            summary_fpath))
+
+if profiler is not None:
+    profile_report_fpath = profiler.merge()
+    logger.warning('Batch {}) Profile report saved here\n{}'.format(batch_no, profile_report_fpath))
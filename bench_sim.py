@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import multiprocessing
+import platform
+import datetime
+import networkx as nx
+import file_loader as fl
+import netw_creator as nc
+import cascades_sim as sim
+import run_metrics as rm
+import shared_functions as sf
+from collections import OrderedDict
+from timeit import default_timer
+
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import ConfigParser  # ver. < 3.0
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+__author__ = 'Agostino Sturaro'
+
+# This script measures how the simulator scales with the size of the networks.
+# For each size, it creates synthetic instances with netw_creator, then runs simulations for each combination of
+# support model and attack tactic, measuring simulations per second, peak memory usage and the time spent in each
+# section of a simulation (see run_metrics). Results are saved to a json file, to compare different versions.
+# The peak memory usage of a process only grows, so the instance is created, and each combination is simulated, in a
+# new process, and the peak of that process is reported (this includes the memory taken by the interpreter).
+# Usage: python bench_sim.py output.json [size ...]
+
+logger = logging.getLogger(__name__)
+
+sizes = [1000, 10000, 100000, 1000000]  # number of nodes of network A
+runs_per_case = 3  # simulations executed for each combination of instance, support model and attack tactic
+attacked_fraction = 0.01  # fraction of the nodes of the attacked network hit by the initial attack
+centrality_max_nodes = 10000  # centrality metrics are too slow to precalculate on larger instances
+work_dir = os.path.normpath('../Simulations/bench')
+keep_instances = False
+
+# the support models, as pairs of values for the options intra_support_type and inter_support_type
+support_models = OrderedDict([
+    ('realistic', ('realistic', 'realistic')),
+    ('cluster_size', ('cluster_size', 'node_interlink')),
+    ('giant_component', ('giant_component', 'node_interlink')),
+    ('node_interlink', ('realistic', 'node_interlink'))
+])
+min_cluster_size = 21
+
+attack_tactics = ['random', 'most_inter_used', 'most_intra_used']
+centr_attack_tactics = ['centrality_rank_from_top']
+
+
+# build options mirroring the ones used for the production instances, scaled to the requested size
+# a power grid made of subnets of 50 nodes, a telecom network with a controller every 1000 nodes, and k-to-n links
+def make_instance_opts(node_cnt, prefer_nearest):
+    subnet_cnt = max(1, node_cnt // 50)
+    controller_cnt = max(1, node_cnt // 1000)
+    a_opts = OrderedDict([
+        ('name', 'A'), ('model', 'rt_nested_smallworld'), ('nodes', node_cnt), ('subnets', subnet_cnt),
+        ('beta', 0.2), ('alpha', 0.2), ('d_0', max(1, int(round(subnet_cnt * 0.35)))), ('avg_k', 4), ('q_rw', 0.5),
+        ('roles', 'subnet_gen_transm_distr'), ('generators', node_cnt // 10),
+        ('transmission_substations', int(node_cnt * 0.135)), ('distribution_substations', int(node_cnt * 0.63)),
+        ('layout', 'uar')
+    ])
+    b_opts = OrderedDict([
+        ('name', 'B'), ('model', 'barabasi_albert'), ('m', 3), ('roles', 'relay_attached_controllers'),
+        ('controllers', controller_cnt), ('relays', node_cnt - controller_cnt), ('layout', 'uar'),
+        ('controller_placement', 'random'), ('controller_attachment', 'prefer_nearest')
+    ])
+    inter_opts = OrderedDict([
+        ('name', 'Inter'), ('dependency_model', 'k-to-n'), ('k', 1), ('n', node_cnt), ('com_access_points', 1),
+        ('prefer_nearest', prefer_nearest)
+    ])
+    misc_opts = OrderedDict([
+        ('calc_node_centrality', node_cnt <= centrality_max_nodes),
+        ('draw_graphs', False)
+    ])
+    return a_opts, b_opts, inter_opts, misc_opts
+
+
+def write_netw_conf(conf_fpath, instance_dir, seed, a_opts, b_opts, inter_opts, misc_opts):
+    config = ConfigParser()
+    config.add_section('paths')
+    config.set('paths', 'netw_dir', instance_dir)
+    for section, opts in [('build_a', a_opts), ('build_b', b_opts), ('build_inter', inter_opts), ('misc', misc_opts)]:
+        config.add_section(section)
+        for opt_name in opts:
+            config.set(section, opt_name, str(opts[opt_name]))
+    config.set('misc', 'seed', str(seed))
+    with open(conf_fpath, 'w') as conf_file:
+        config.write(conf_file)
+
+
+def write_sim_conf(conf_fpath, instance_dir, results_dir, metrics_fpath, support_model, attack_tactic, attacks, seed):
+    intra_support_type, inter_support_type = support_models[support_model]
+    config = ConfigParser()
+    config.add_section('paths')
+    config.set('paths', 'netw_dir', instance_dir)
+    config.set('paths', 'netw_a_fname', 'A.graphml')
+    config.set('paths', 'netw_b_fname', 'B.graphml')
+    config.set('paths', 'netw_inter_fname', 'Inter.graphml')
+    config.set('paths', 'results_dir', results_dir)
+    config.set('paths', 'metrics_fpath', metrics_fpath)
+    config.add_section('run_opts')
+    config.set('run_opts', 'attacked_netw', 'A')
+    config.set('run_opts', 'attack_tactic', attack_tactic)
+    config.set('run_opts', 'attacks', str(attacks))
+    config.set('run_opts', 'intra_support_type', intra_support_type)
+    config.set('run_opts', 'inter_support_type', inter_support_type)
+    if intra_support_type == 'cluster_size':
+        config.set('run_opts', 'min_cluster_size', str(min_cluster_size))
+    if attack_tactic in centr_attack_tactics:
+        config.set('run_opts', 'centrality_fname', 'node_centrality_A.json')
+        config.set('run_opts', 'centrality_name', 'betweenness')
+    config.set('run_opts', 'seed', str(seed))
+    config.add_section('misc')
+    config.set('misc', 'instance', '0')
+    config.set('misc', 'sim_group', '0')
+    with open(conf_fpath, 'w') as conf_file:
+        config.write(conf_file)
+
+
+# peak resident set size of this process so far, in kilobytes, or None if it can't be measured
+# it is the highest value reached since the process started, so it's only meaningful in a process doing a single job
+def get_peak_rss_kb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss //= 1024  # reported in bytes on macOS
+    return peak_rss
+
+
+# call func(*args) in a new process, returns the result and the peak resident set size of that process
+def run_in_new_process(func, *args):
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        return pool.apply(_call_and_measure, (func,) + args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _call_and_measure(func, *args):
+    result = func(*args)
+    return result, get_peak_rss_kb()
+
+
+def build_instance(netw_conf_fpath):
+    build_start = default_timer()
+    nc.run(netw_conf_fpath)
+    return default_timer() - build_start
+
+
+# run the simulations of a combination of support model and attack tactic, returns the time taken by each one
+def bench_case(instance_dir, case_name, support_model, attack_tactic, attacks, seed):
+    results_dir = os.path.join(instance_dir, 'res_' + case_name)
+    metrics_fpath = os.path.join(instance_dir, 'metrics_' + case_name + '.tsv')
+    floader = fl.FileLoader()  # a new loader, so that the first run includes reading the graphs from disk
+    sim_times = []
+    for run_num in range(0, runs_per_case):
+        sim_conf_fpath = os.path.join(instance_dir, 'run_{}_{}.ini'.format(case_name, run_num))
+        write_sim_conf(sim_conf_fpath, instance_dir, results_dir, metrics_fpath, support_model, attack_tactic,
+                       attacks, seed + run_num)
+        sim_start = default_timer()
+        sim.run(sim_conf_fpath, floader)
+        sim_times.append(default_timer() - sim_start)
+    return sim_times
+
+
+def bench_size(node_cnt, prefer_nearest, seed=0):
+    instance_name = 'n_{}_{}'.format(node_cnt, 'nearest' if prefer_nearest else 'random')
+    instance_dir = os.path.abspath(os.path.join(work_dir, instance_name))
+    sf.makedirs_clean(instance_dir, True, False)
+    netw_conf_fpath = os.path.join(work_dir, instance_name + '.ini')
+    a_opts, b_opts, inter_opts, misc_opts = make_instance_opts(node_cnt, prefer_nearest)
+    write_netw_conf(netw_conf_fpath, instance_dir, seed, a_opts, b_opts, inter_opts, misc_opts)
+
+    logger.warning('Creating instance {}'.format(instance_name))
+    build_time, build_peak_rss_kb = run_in_new_process(build_instance, netw_conf_fpath)
+
+    tactics = list(attack_tactics)
+    if misc_opts['calc_node_centrality'] is True:
+        tactics.extend(centr_attack_tactics)
+    attacks = max(1, int(node_cnt * attacked_fraction))
+
+    cases = []
+    for support_model in support_models:
+        for attack_tactic in tactics:
+            case_name = '{}_{}'.format(support_model, attack_tactic)
+            sim_times, peak_rss_kb = run_in_new_process(bench_case, instance_dir, case_name, support_model,
+                                                        attack_tactic, attacks, seed)
+
+            metrics_fpath = os.path.join(instance_dir, 'metrics_' + case_name + '.tsv')
+            summary = rm.summarize_metrics([metrics_fpath])
+            phase_times = OrderedDict()
+            for section in rm.run_sections:
+                phase_times[section] = summary['t_' + section]['mean']
+            case = OrderedDict([
+                ('instance', instance_name), ('nodes', node_cnt), ('prefer_nearest', prefer_nearest),
+                ('build_time', build_time), ('build_peak_rss_kb', build_peak_rss_kb), ('support_model', support_model),
+                ('attack_tactic', attack_tactic),
+                ('runs', runs_per_case), ('sims_per_sec', runs_per_case / sum(sim_times)),
+                ('mean_sim_time', sum(sim_times) / runs_per_case), ('first_sim_time', sim_times[0]),
+                ('mean_iterations', summary['iterations']['mean']), ('peak_rss_kb', peak_rss_kb),
+                ('phase_times', phase_times)
+            ])
+            logger.warning('{} {}: {:.2f} sims/s'.format(instance_name, case_name, case['sims_per_sec']))
+            cases.append(case)
+
+    if keep_instances is False:
+        shutil.rmtree(instance_dir)
+        os.remove(netw_conf_fpath)
+
+    return cases
+
+
+def run_benchmarks(out_fpath, bench_sizes):
+    sf.ensure_dir_exists(work_dir)
+    results = OrderedDict([
+        ('created', datetime.datetime.now().isoformat()),
+        ('python', platform.python_version()),
+        ('networkx', nx.__version__),
+        ('platform', platform.platform()),
+        ('runs_per_case', runs_per_case),
+        ('attacked_fraction', attacked_fraction),
+        ('cases', [])
+    ])
+    for node_cnt in bench_sizes:
+        for prefer_nearest in [False, True]:
+            results['cases'].extend(bench_size(node_cnt, prefer_nearest))
+            # save partial results, large sizes can take a long time
+            with open(out_fpath, 'w') as out_file:
+                json.dump(results, out_file, indent=4)
+    return results
+
+
+if __name__ == '__main__':
+    this_dir = os.path.normpath(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(this_dir)
+    logging.basicConfig(level=logging.WARNING)  # logging at lower levels would distort the measurements
+
+    if len(sys.argv) < 2:
+        raise ValueError('Usage: python bench_sim.py output.json [size ...]')
+    bench_out_fpath = os.path.abspath(sys.argv[1])
+    if len(sys.argv) > 2:
+        sizes = [int(arg) for arg in sys.argv[2:]]
+    run_benchmarks(bench_out_fpath, sizes)
@@ -0,0 +1,160 @@
+import os
+import csv
+import sys
+import ast
+import json
+import logging
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+import graphml_stream as gs
+import layout_cache as lc
+import netw_renderer as nr
+from matplotlib import animation
+from matplotlib.backends.backend_pdf import PdfPages
+
+__author__ = 'Agostino Sturaro'
+
+# Draws the steps of a cascade of failures on the networks of an instance, without the snapshots of the graphs at
+# each step used by plot_sim_steps.
+# The instance is drawn once, with netw_renderer, then the time each node died is read from the trace of the
+# simulation (the events file written by cascades_sim if paths.events_fname is set, or its run stats file), and each
+# step is drawn by changing the colors of the items already drawn, dead nodes and their edges become gray.
+# Steps are saved as the pages of a single PDF file, or as the frames of a video, if the output file is not a PDF.
+# Usage: python cascade_renderer.py netw_dir netw_a_name netw_b_name netw_inter_name trace_fpath output_fpath
+
+logger = logging.getLogger(__name__)
+
+dead_col = 'gray'
+
+
+# read the time each node died from the trace of a simulation, as a dictionary {node: time}
+# the trace is either a file of events (JSON lines) or a run stats file (tab separated, with a header)
+def read_death_times(trace_fpath):
+    death_times = {}
+    with open(trace_fpath, 'rb') as trace_file:
+        first_line = trace_file.readline()
+        trace_file.seek(0)
+        if first_line.lstrip().startswith(b'{'):
+            for line in trace_file:
+                if line.strip():
+                    event = json.loads(line.decode('utf-8'))
+                    for node in event['nodes']:
+                        death_times[node] = event['time']
+        else:
+            for row in csv.DictReader(trace_file, delimiter='\t'):
+                time = int(row['time'])
+                for node in ast.literal_eval(row['dead']):
+                    death_times[str(node)] = time
+    return death_times
+
+
+# the times at which the state of the networks changed, starting with 0, the time before the attack
+def list_steps(death_times):
+    return [0] + sorted(set(death_times.values()))
+
+
+# prepare the colors of a layer of items, returns 2 arrays, the time each item dies (inf if it never does) and the
+# RGBA colors of the items while they are alive
+def _layer_state(items, colors, death_times_of_item):
+    item_cnt = len(items)
+    item_death_times = np.fromiter((death_times_of_item(item) for item in items), dtype=np.float64, count=item_cnt)
+    if mcolors.is_color_like(colors):
+        colors = [colors] * item_cnt
+    alive_colors = mcolors.to_rgba_array(colors) if item_cnt > 0 else np.empty((0, 4))
+    return item_death_times, alive_colors
+
+
+class CascadePlot(object):
+    # draw the instance on the current figure, death_times is the result of read_death_times
+    # if rasterize is True, all edges and nodes are drawn as a single image, saving many PDF pages of vector graphics
+    # takes long, since each item is written on its own when colors vary, and so does saving an image for each layer
+    # render_kwargs are passed to netw_renderer.render_netw_graphs
+    def __init__(self, A, B, I, death_times, node_col_by_role=None, edges_a_col='r', edges_b_col='b', rasterize=True,
+                 **render_kwargs):
+        if node_col_by_role is None:
+            node_col_by_role = nr.default_node_col_by_role
+        edge_layers, node_layers = nr.render_netw_graphs(A, B, I, node_col_by_role, edges_a_col, edges_b_col,
+                                                         **render_kwargs)
+        nr.fit_plot()
+        if rasterize is True:
+            plt.gca().set_rasterization_zorder(3)  # edges and nodes are drawn with zorder 1 and 2
+
+        def node_death_time(node):
+            return death_times.get(node, np.inf)
+
+        def edge_death_time(edge):
+            return min(node_death_time(edge[0]), node_death_time(edge[1]))
+
+        self.layers = []
+        for edge_collection, edges, edge_col in edge_layers:
+            self.layers.append((edge_collection, 'edge') + _layer_state(edges, edge_col, edge_death_time))
+        for node_collection, nodes, node_cols in node_layers:
+            self.layers.append((node_collection, 'node') + _layer_state(nodes, node_cols, node_death_time))
+
+        self.dead_rgba = mcolors.to_rgba(dead_col)
+        self.time_text = plt.gcf().text(0.01, 0.99, '', va='top')
+
+    # color the items drawn to show the state of the networks at the given time
+    def show_step(self, time):
+        for collection, kind, item_death_times, alive_colors in self.layers:
+            colors = alive_colors.copy()
+            colors[item_death_times <= time] = self.dead_rgba
+            if kind == 'edge':
+                collection.set_color(colors)
+            else:
+                collection.set_facecolors(colors)
+        self.time_text.set_text('Time {}'.format(time))
+
+
+# save the steps as the pages of a PDF file, or the frames of a video (this needs ffmpeg)
+def save_steps(cascade_plot, steps, fpath, dpi=150, fps=2):
+    fig = plt.gcf()
+    if os.path.splitext(fpath)[1].lower() == '.pdf':
+        with PdfPages(fpath) as pdf:
+            for time in steps:
+                cascade_plot.show_step(time)
+                pdf.savefig(fig, dpi=dpi)
+    else:
+        if not animation.writers.is_available('ffmpeg'):
+            raise RuntimeError('ffmpeg is needed to save the steps as a video, save them as a PDF file instead')
+        writer = animation.writers['ffmpeg'](fps=fps)
+        with writer.saving(fig, fpath, dpi):
+            for time in steps:
+                cascade_plot.show_step(time)
+                writer.grab_frame()
+
+
+# draw the steps of the cascade traced in trace_fpath, on the instance saved in netw_dir, and save them in fpath
+def render_cascade(netw_dir, netw_a_name, netw_b_name, netw_inter_name, trace_fpath, fpath, dpi=150, fps=2,
+                   **render_kwargs):
+    A = gs.read_graphml(os.path.join(netw_dir, netw_a_name + '.graphml'))
+    B = gs.read_graphml(os.path.join(netw_dir, netw_b_name + '.graphml'))
+    I = gs.read_graphml(os.path.join(netw_dir, netw_inter_name + '.graphml'))
+    # graphs without positions are arranged with a spring layout, saved in the instance to be reused
+    for G in [A, B]:
+        lc.ensure_positions(G, cache_dir=os.path.join(netw_dir, lc.layouts_dirname))
+    death_times = read_death_times(trace_fpath)
+    steps = list_steps(death_times)
+
+    plt.figure()
+    try:
+        cascade_plot = CascadePlot(A, B, I, death_times, **render_kwargs)
+        save_steps(cascade_plot, steps, fpath, dpi, fps)
+    finally:
+        plt.close()  # free memory
+    logger.info('{} steps of the cascade saved here\n{}'.format(len(steps), fpath))
+    return fpath
+
+
+def main(argv):
+    if len(argv) != 7:
+        print('Usage: python cascade_renderer.py netw_dir netw_a_name netw_b_name netw_inter_name trace_fpath '
+              'output_fpath')
+        return 1
+    print(render_cascade(*argv[1:]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,11 +1,16 @@
 import os
+import json
 import logging
 import networkx as nx
 import random
 import csv
 import sys
 import shared_functions as sf
+import run_metrics as rm
+import union_view as uv
+import centrality_planner as cp
 from numpy import percentile
+from timeit import default_timer
 
 try:
     from configparser import ConfigParser
@@ -18,6 +23,45 @@ __author__ = 'Agostino Sturaro'
 logger = logging.getLogger(__name__)
 time = None
 
+# custom logging level, finer than DEBUG, used to trace every phase check of a simulation
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+
+# engines that can execute the phase checks of a simulation, selected with the run option "engine"
+# scalar is the reference implementation, any other engine must reproduce its results exactly (see engine_harness)
+sim_engines = ['scalar']
+
+# descriptions of the causes of failure, used to compose log messages
+fail_cause_descrs = {'attack': 'because of initial attack', 'inter': 'for lack of inter support',
+                     'intra': 'for lack of intra support'}
+
+
+# wraps a collection of nodes that only gets sorted if the log message containing it is actually formatted,
+# so that messages dropped because of their level do not pay for the sorting
+class LazySortedNodes(object):
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def __str__(self):
+        return str(sorted(self.nodes, key=sf.natural_sort_key))
+
+
+# report the failure of a group of nodes of network netw_name, happened at the given time for the given cause
+# cause is one of the keys of fail_cause_descrs
+# event_file is an optional file opened in binary mode, each failure is written to it as a line of JSON
+def log_failure_event(time, netw_name, cause, nodes, event_file=None):
+    if len(nodes) > 0:
+        logger.info('Time %s) %s nodes of network %s failed %s: %s', time, len(nodes), netw_name,
+                    fail_cause_descrs[cause], LazySortedNodes(nodes))
+        if event_file is not None:
+            event = {'time': time, 'network': netw_name, 'cause': cause,
+                     'nodes': sorted(nodes, key=sf.natural_sort_key)}
+            event_file.write((json.dumps(event, sort_keys=True) + '\n').encode('utf-8'))
+
+    if logger.isEnabledFor(TRACE):
+        logger.log(TRACE, 'Time %s) %s check on network %s, %s nodes failed: %s', time, cause, netw_name,
+                   len(nodes), LazySortedNodes(nodes))
+
 
 # choose node_cnt random nodes
 def choose_random_nodes(G, node_cnt, seed=None):
@@ -419,21 +463,24 @@ def calc_atk_centrality_stats(attacked_nodes, centrality_name, result_key_suffix
     return centr_stats
 
 
-def calc_atk_centr_stats(name_A, name_B, name_I, name_AB, attacked_nodes_a, attacked_nodes_b, floader, netw_dir):
+# graphs is optional, it's used to calculate the centralities that were not precalculated (see centrality_planner)
+def calc_atk_centr_stats(name_A, name_B, name_I, name_AB, attacked_nodes_a, attacked_nodes_b, floader, netw_dir,
+                         graphs=None):
     attacked_nodes = attacked_nodes_a + attacked_nodes_b
     centr_stats = {}
 
     # load files with precalculated centrality metrics
-    centr_fpath_a = os.path.join(netw_dir, 'node_centrality_{}.json'.format(name_A))
-    centr_info_a = floader.fetch_json(centr_fpath_a)
-    centr_fpath_b = os.path.join(netw_dir, 'node_centrality_{}.json'.format(name_B))
-    centr_info_b = floader.fetch_json(centr_fpath_b)
-    centr_fpath_ab = os.path.join(netw_dir, 'node_centrality_{}.json'.format(name_AB))
-    centr_info_ab = floader.fetch_json(centr_fpath_ab)
-    centr_fpath_i = os.path.join(netw_dir, 'node_centrality_{}.json'.format(name_I))
-    centr_info_i = floader.fetch_json(centr_fpath_i)
-    centr_fpath_gen = os.path.join(netw_dir, 'node_centrality_misc.json')
-    centr_info_misc = floader.fetch_json(centr_fpath_gen)
+    centr_info_a = cp.fetch_centrality_info(floader, netw_dir, cp.centrality_fname(name_A), cp.ml_stats_metrics['A'],
+                                            graphs)
+    centr_info_b = cp.fetch_centrality_info(floader, netw_dir, cp.centrality_fname(name_B), cp.ml_stats_metrics['B'],
+                                            graphs)
+    centr_info_ab = cp.fetch_centrality_info(floader, netw_dir, cp.centrality_fname(name_AB),
+                                             cp.ml_stats_metrics['AB'], graphs)
+    centr_info_i = cp.fetch_centrality_info(floader, netw_dir, cp.centrality_fname(name_I), cp.ml_stats_metrics['I'],
+                                            graphs)
+    centr_info_misc = cp.fetch_centrality_info(floader, netw_dir, cp.misc_centrality_fname, [], graphs)
+    if centr_info_misc is None:
+        centr_info_misc = {}
 
     node_cnt_a = centr_info_a['node_count']
     centr_stats['p_atkd_a'] = sf.percent_of_part(len(attacked_nodes_a), node_cnt_a)
@@ -482,7 +529,8 @@ def calc_atk_centr_stats(name_A, name_B, name_I, name_AB, attacked_nodes_a, atta
     return centr_stats
 
 
-def get_ranked_nodes(config, section, floader, netw_dir):
+# graphs is optional, it's used to calculate the centrality if it was not precalculated (see centrality_planner)
+def get_ranked_nodes(config, section, floader, netw_dir, graphs=None):
     bottom_skips = 0
     if config.has_option(section, 'bottom_ranks_to_skip'):
         bottom_skips = config.getint(section, 'bottom_ranks_to_skip')
@@ -493,13 +541,12 @@ def get_ranked_nodes(config, section, floader, netw_dir):
 
     # the name of the network file to pick centrality measures from
     centr_fname = config.get(section, 'centrality_fname')
+    centrality_name = config.get(section, 'centrality_name')
 
     # load file with precalculated centrality metrics
-    centr_fpath = os.path.join(netw_dir, centr_fname)
-    centrality_info = floader.fetch_json(centr_fpath)
+    centrality_info = cp.fetch_centrality_info(floader, netw_dir, centr_fname, [centrality_name], graphs)
 
     # load the list of ranked nodes
-    centrality_name = config.get(section, 'centrality_name')
     ranked_nodes = centrality_info[centrality_name + '_centrality_rank']
 
     return ranked_nodes, bottom_skips, top_skips
@@ -528,21 +575,20 @@ def choose_nodes_by_config(config, section, target_netw, method, A, B, I, ab_uni
         target_G = B
     elif target_netw.lower() == 'both':
         if ab_union is None:
-            raise ValueError('A union graph is needed, specify "netw_union_fname" and make sure the file exists')
+            raise ValueError('A union graph is needed, specify "netw_union_fname" and make sure the file exists, '
+                             'or specify "netw_union_name" to use a virtual union graph')
         target_G = ab_union
     else:
         raise ValueError('Invalid value for parameter "target_netw": ' + target_netw)
 
-    centr_atk_tactics = ['centrality_rank_from_bottom', 'centrality_rank_from_top', 'random_in_centrality_rank_range']
-
     if config.has_option(section, 'attacks'):
         node_cnt = config.getint(section, 'attacks')
     elif config.has_option(section, 'node_count'):
         node_cnt = config.getint(section, 'node_count')
 
-    if method in centr_atk_tactics:
+    if method in cp.centrality_tactics:
         ranked_nodes, bottom_skips, top_skips = \
-            get_ranked_nodes(config, section, floader, netw_dir)
+            get_ranked_nodes(config, section, floader, netw_dir, cp.graphs_by_name(A, B, I, ab_union))
 
     if method == 'random':
         chosen_nodes = choose_random_nodes(target_G, node_cnt, seed)
@@ -584,6 +630,7 @@ def choose_nodes_by_config(config, section, target_netw, method, A, B, I, ab_uni
 def run(conf_fpath, floader):
     global logger
     logger.info('conf_fpath = {}'.format(conf_fpath))
+    parse_start = default_timer()
 
     conf_fpath = os.path.normpath(conf_fpath)
     if os.path.isabs(conf_fpath) is False:
@@ -593,6 +640,16 @@ def run(conf_fpath, floader):
     config = ConfigParser()
     config.read(conf_fpath)
 
+    # metrics is a file where the wall time of each section of the simulation is saved, along with some counters
+    metrics_fpath = ''
+    if config.has_option('paths', 'metrics_fpath'):
+        metrics_fpath = os.path.normpath(config.get('paths', 'metrics_fpath'))
+        if os.path.isabs(metrics_fpath) is False:
+            metrics_fpath = os.path.abspath(metrics_fpath)
+        sf.ensure_dir_exists(os.path.dirname(metrics_fpath))
+    metrics = rm.RunMetrics(enabled=bool(metrics_fpath))
+    metrics.add_time('parse_conf', default_timer() - parse_start)
+
     global time
     time = 0
 
@@ -600,6 +657,14 @@ def run(conf_fpath, floader):
 
     seed = config.getint('run_opts', 'seed')
 
+    if config.has_option('run_opts', 'engine'):
+        engine = config.get('run_opts', 'engine')
+    else:
+        engine = 'scalar'
+    if engine not in sim_engines:
+        raise ValueError('Invalid value for parameter "engine": {}, available engines are {}'.format(
+            engine, sim_engines))
+
     if config.has_option('run_opts', 'save_death_cause'):
         save_death_cause = config.getboolean('run_opts', 'save_death_cause')
     else:
@@ -609,6 +674,7 @@ def run(conf_fpath, floader):
     netw_dir = os.path.normpath(config.get('paths', 'netw_dir'))
     if os.path.isabs(netw_dir) is False:
         netw_dir = os.path.abspath(netw_dir)
+    metrics.start('fetch_graphs')
     netw_a_fname = config.get('paths', 'netw_a_fname')
     netw_a_fpath_in = os.path.join(netw_dir, netw_a_fname)
     A = floader.fetch_graphml(netw_a_fpath_in, str)
@@ -626,11 +692,17 @@ def run(conf_fpath, floader):
         netw_union_fname = config.get('paths', 'netw_union_fname')
         netw_union_fpath_in = os.path.join(netw_dir, netw_union_fname)
         ab_union = floader.fetch_graphml(netw_union_fpath_in, str)
+    # otherwise, a virtual union graph can be used, it just needs the name used for its centrality file
+    # its nodes are in a different order, so random choices on both networks differ from the ones made on the file
+    elif config.has_option('paths', 'netw_union_name'):
+        ab_union = uv.UnionView(A, B, I, config.get('paths', 'netw_union_name'))
     else:
         ab_union = None
+    metrics.stop('fetch_graphs')
 
     # read run options
 
+    metrics.start('choose_safe_nodes')
     # nodes that must remain alive no matter what
     safe_nodes = []
     safe_nodes_a = set()
@@ -652,11 +724,14 @@ def run(conf_fpath, floader):
     if len(safe_nodes) > 0 and config.has_option('run_opts', 'attacks'):
         logger.info('Nodes marked as safe will not be attacked, so if they get selected to be attacked, the number '
                     'of attacked nodes will be lower than specified!')
+    metrics.stop('choose_safe_nodes')
 
+    metrics.start('choose_attacks')
     attacked_netw = config.get('run_opts', 'attacked_netw')
     attack_tactic = config.get('run_opts', 'attack_tactic')
     attacked_nodes = choose_nodes_by_config(config, 'run_opts', attacked_netw, attack_tactic, A, B, I, ab_union,
                                             floader, netw_dir, seed)
+    metrics.stop('choose_attacks')
 
     intra_support_type = config.get('run_opts', 'intra_support_type')
     if intra_support_type == 'cluster_size':
@@ -678,6 +753,13 @@ def run(conf_fpath, floader):
         run_stats_fname = config.get('paths', 'run_stats_fname')
         run_stats_fpath = os.path.join(results_dir, run_stats_fname)
 
+    # events is a binary file of JSON lines, one for each group of nodes that failed in the same phase
+    events_fpath = ''
+    events_file = None
+    if config.has_option('paths', 'events_fname'):
+        events_fname = config.get('paths', 'events_fname')
+        events_fpath = os.path.join(results_dir, events_fname)
+
     # end_stats is a file used to save a single line (row) of statistics at the end of the simulation
     end_stats_fpath = ''
     if config.has_option('paths', 'end_stats_fpath'):
@@ -712,6 +794,7 @@ def run(conf_fpath, floader):
                 'run': run_num, 'seed': seed}
 
     # stability check
+    metrics.start('stability_check')
     unstable_nodes = set()
     if inter_support_type == 'node_interlink':
         unstable_nodes.update(find_nodes_without_inter_links(A, I))
@@ -749,10 +832,11 @@ def run(conf_fpath, floader):
     # remove nodes that can't fail
     if len(safe_nodes_a) > 0 or len(safe_nodes_b) > 0:
         unstable_nodes -= safe_nodes_a.union(safe_nodes_b)
+    metrics.stop('stability_check')
 
     if len(unstable_nodes) > 0:
-        logger.debug('Time {}) {} nodes unstable before the initial attack: {}'.format(
-            time, len(unstable_nodes), sorted(unstable_nodes, key=sf.natural_sort_key)))
+        logger.debug('Time %s) %s nodes unstable before the initial attack: %s', time, len(unstable_nodes),
+                     LazySortedNodes(unstable_nodes))
 
     total_dead_a = 0
     total_dead_b = 0
@@ -777,6 +861,9 @@ def run(conf_fpath, floader):
             run_stats = csv.DictWriter(run_stats_file, run_stats_header, delimiter='\t', quoting=csv.QUOTE_MINIMAL)
             run_stats.writeheader()
 
+        if events_fpath:
+            events_file = open(events_fpath, 'wb')
+
         time += 1
 
         # perform initial attack
@@ -799,9 +886,12 @@ def run(conf_fpath, floader):
             ml_stats.update({'#atkd': len(attacked_nodes_a) + len(attacked_nodes_b), '#atkd_a': len(attacked_nodes_a),
                              '#atkd_b': len(attacked_nodes_b)})
             ml_stats.update({'atkd_nodes_a': attacked_nodes_a, 'atkd_nodes_b': attacked_nodes_b})
+            metrics.start('centr_stats')
             ml_stats.update(
                 calc_atk_centr_stats(A.graph['name'], B.graph['name'], I.graph['name'], ab_union.graph['name'],
-                                     attacked_nodes_a, attacked_nodes_b, floader, netw_dir))
+                                     attacked_nodes_a, attacked_nodes_b, floader, netw_dir,
+                                     cp.graphs_by_name(A, B, I, ab_union)))
+            metrics.stop('centr_stats')
 
             result_key_by_role = {'generator': 'p_atkd_gen', 'transmission_substation': 'p_atkd_ts',
                                   'distribution_substation': 'p_atkd_ds'}
@@ -810,22 +900,23 @@ def run(conf_fpath, floader):
             result_key_by_role = {'relay': 'p_atkd_rel', 'controller': 'p_atkd_cc'}
             ml_stats.update(calc_atkd_percent_by_role(B, attacked_nodes_b, result_key_by_role))
 
+        metrics.count('dead_atk_a', len(attacked_nodes_a))
+        metrics.count('dead_atk_b', len(attacked_nodes_b))
+
         total_dead_a = len(attacked_nodes_a)
         if total_dead_a > 0:
             dead_nodes_a.extend(attacked_nodes_a)
             A.remove_nodes_from(attacked_nodes_a)
-            logger.info('Time {}) {} nodes of network {} failed because of initial attack: {}'.format(
-                time, total_dead_a, A.graph['name'], sorted(attacked_nodes_a, key=sf.natural_sort_key)))
+            log_failure_event(time, A.graph['name'], 'attack', attacked_nodes_a, events_file)
 
         total_dead_b = len(attacked_nodes_b)
         if total_dead_b > 0:
             dead_nodes_b.extend(attacked_nodes_b)
             B.remove_nodes_from(attacked_nodes_b)
-            logger.info('Time {}) {} nodes of network {} failed because of initial attack: {}'.format(
-                time, total_dead_b, B.graph['name'], sorted(attacked_nodes_b, key=sf.natural_sort_key)))
+            log_failure_event(time, B.graph['name'], 'attack', attacked_nodes_b, events_file)
 
         if total_dead_a == total_dead_b == 0:
-            logger.info('Time {}) No nodes were attacked'.format(time))
+            logger.info('Time %s) No nodes were attacked', time)
 
         I.remove_nodes_from(attacked_nodes)
 
@@ -840,8 +931,10 @@ def run(conf_fpath, floader):
 
         while updated is True:
             updated = False
+            metrics.count('iterations')
 
             # inter checks for network A
+            metrics.start('inter_a')
             if inter_support_type == 'node_interlink':
                 unsupported_nodes_a = find_nodes_without_inter_links(A, I)
             # elif inter_support_type == 'cluster_interlink':
@@ -862,9 +955,8 @@ def run(conf_fpath, floader):
                 unsupported_nodes_a = temp_list
 
             failed_cnt_a = len(unsupported_nodes_a)
+            log_failure_event(time, A.graph['name'], 'inter', unsupported_nodes_a, events_file)
             if failed_cnt_a > 0:
-                logger.info('Time {}) {} nodes of network {} failed for lack of inter support: {}'.format(
-                    time, failed_cnt_a, A.graph['name'], sorted(unsupported_nodes_a, key=sf.natural_sort_key)))
                 total_dead_a += failed_cnt_a
                 inter_sup_deaths_a += failed_cnt_a
                 dead_nodes_a.extend(unsupported_nodes_a)
@@ -874,9 +966,12 @@ def run(conf_fpath, floader):
                 # save_state(time, A, B, I, results_dir)
                 if run_stats is not None:
                     run_stats.writerow({'time': time, 'dead': unsupported_nodes_a})
+            metrics.stop('inter_a')
+            metrics.count('dead_inter_a', failed_cnt_a)
             time += 1
 
             # intra checks for network A
+            metrics.start('intra_a')
             if intra_support_type == 'giant_component':
                 unsupported_nodes_a = find_nodes_not_in_giant_component(A)
             elif intra_support_type == 'cluster_size':
@@ -886,9 +981,8 @@ def run(conf_fpath, floader):
 
             unsupported_nodes_a = remove_list_items(unsupported_nodes_a, safe_nodes_a)
             failed_cnt_a = len(unsupported_nodes_a)
+            log_failure_event(time, A.graph['name'], 'intra', unsupported_nodes_a, events_file)
             if failed_cnt_a > 0:
-                logger.info('Time {}) {} nodes of network {} failed for lack of intra support: {}'.format(
-                    time, failed_cnt_a, A.graph['name'], sorted(unsupported_nodes_a, key=sf.natural_sort_key)))
                 total_dead_a += failed_cnt_a
                 intra_sup_deaths_a += failed_cnt_a
                 dead_nodes_a.extend(unsupported_nodes_a)
@@ -898,9 +992,12 @@ def run(conf_fpath, floader):
                 # save_state(time, A, B, I, results_dir)
                 if run_stats is not None:
                     run_stats.writerow({'time': time, 'dead': unsupported_nodes_a})
+            metrics.stop('intra_a')
+            metrics.count('dead_intra_a', failed_cnt_a)
             time += 1
 
             # inter checks for network B
+            metrics.start('inter_b')
             if inter_support_type == 'node_interlink':
                 unsupported_nodes_b = find_nodes_without_inter_links(B, I)
             # elif inter_support_type == 'cluster_interlink':
@@ -910,9 +1007,8 @@ def run(conf_fpath, floader):
 
             unsupported_nodes_b = remove_list_items(unsupported_nodes_b, safe_nodes_b)
             failed_cnt_b = len(unsupported_nodes_b)
+            log_failure_event(time, B.graph['name'], 'inter', unsupported_nodes_b, events_file)
             if failed_cnt_b > 0:
-                logger.info('Time {}) {} nodes of network {} failed for lack of inter support: {}'.format(
-                    time, failed_cnt_b, B.graph['name'], sorted(unsupported_nodes_b, key=sf.natural_sort_key)))
                 total_dead_b += failed_cnt_b
                 inter_sup_deaths_b += failed_cnt_b
                 dead_nodes_b.extend(unsupported_nodes_b)
@@ -922,9 +1018,12 @@ def run(conf_fpath, floader):
                 # save_state(time, A, B, I, results_dir)
                 if run_stats is not None:
                     run_stats.writerow({'time': time, 'dead': unsupported_nodes_b})
+            metrics.stop('inter_b')
+            metrics.count('dead_inter_b', failed_cnt_b)
             time += 1
 
             # intra checks for network B
+            metrics.start('intra_b')
             if intra_support_type == 'giant_component':
                 unsupported_nodes_b = find_nodes_not_in_giant_component(B)
             elif intra_support_type == 'cluster_size':
@@ -935,9 +1034,8 @@ def run(conf_fpath, floader):
 
             unsupported_nodes_b = remove_list_items(unsupported_nodes_b, safe_nodes_b)
             failed_cnt_b = len(unsupported_nodes_b)
+            log_failure_event(time, B.graph['name'], 'intra', unsupported_nodes_b, events_file)
             if failed_cnt_b > 0:
-                logger.info('Time {}) {} nodes of network {} failed for lack of intra support: {}'.format(
-                    time, failed_cnt_b, B.graph['name'], sorted(unsupported_nodes_b, key=sf.natural_sort_key)))
                 total_dead_b += failed_cnt_b
                 intra_sup_deaths_b += failed_cnt_b
                 dead_nodes_b.extend(unsupported_nodes_b)
@@ -947,12 +1045,20 @@ def run(conf_fpath, floader):
                 # save_state(time, A, B, I, results_dir)
                 if run_stats is not None:
                     run_stats.writerow({'time': time, 'dead': unsupported_nodes_b})
+            metrics.stop('intra_b')
+            metrics.count('dead_intra_b', failed_cnt_b)
             time += 1
     except:
         if run_stats_file is not None:
             run_stats_file.close()
+        if events_file is not None:
+            events_file.close()
         raise
 
+    if events_file is not None:
+        events_file.close()
+
+    metrics.start('write_results')
     # save_state('final', A, B, I, results_dir)
 
     # write statistics about the final result
@@ -1011,3 +1117,8 @@ def run(conf_fpath, floader):
                 ml_stats_writer.writeheader()
 
             ml_stats_writer.writerow(ml_stats)
+    metrics.stop('write_results')
+
+    if metrics_fpath:  # if this string is not empty
+        metrics.write_row(metrics_fpath, {'batch_conf_fpath': batch_conf_fpath, 'sim_group': sim_group,
+                                          'instance': instance, 'run': run_num})
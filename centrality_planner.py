@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import logging
+import netw_creator as nc
+import shared_functions as sf
+from collections import OrderedDict
+
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import ConfigParser  # ver. < 3.0
+
+__author__ = 'Agostino Sturaro'
+
+# Calculating every centrality metric on every graph of an instance is often the slowest part of creating it, but a
+# simulation campaign may only need a few of them, e.g. the betweenness ranking of the union graph to attack the most
+# central nodes, or none at all for random attacks.
+# A plan lists the centrality metrics each centrality file needs to contain, as a dictionary
+# {centrality file name: [metric, ...]}, e.g. {"node_centrality_UnionAB.json": ["betweenness"]}, metric names are the
+# ones of netw_creator (graph_centrality_metrics and misc_centrality_metrics).
+# Plans are made reading the configurations of the simulations, and are followed by netw_creator when the misc option
+# "centrality_plan_fpath" is set. Simulations calculate any missing metric the first time they need it, and save it
+# in the centrality file, so that other simulations on the same instance can reuse it.
+# Usage: python centrality_planner.py plan.json batch_conf.json [batch_conf.json ...]
+
+logger = logging.getLogger(__name__)
+
+# attack and selection tactics that pick nodes by their centrality rank
+centrality_tactics = ['centrality_rank_from_bottom', 'centrality_rank_from_top', 'random_in_centrality_rank_range']
+
+misc_centrality_fname = 'node_centrality_misc.json'
+
+# the metrics used by calc_atk_centr_stats to calculate the statistics for machine learning, for each graph
+# the optional ones are only used if they were calculated, so they are planned, but not calculated by simulations
+ml_stats_metrics = {'A': ['betweenness', 'closeness', 'degree'], 'B': ['betweenness', 'closeness', 'degree'],
+                    'I': ['betweenness', 'closeness'], 'AB': ['betweenness', 'closeness']}
+ml_stats_optional_metrics = {'A': [], 'B': [], 'I': ['indegree', 'katz'], 'AB': ['indegree', 'katz'],
+                             'misc': nc.misc_centrality_metrics}
+
+
+def centrality_fname(graph_name):
+    return 'node_centrality_{}.json'.format(graph_name)
+
+
+def add_to_plan(plan, fname, metrics):
+    planned = plan.setdefault(fname, [])
+    for metric in metrics:
+        if metric not in planned:
+            planned.append(metric)
+
+
+# graphs are saved by netw_creator in files named after the graph, so the name of the graph is the name of its file
+def graph_name_from_fname(graph_fname):
+    return os.path.splitext(graph_fname)[0]
+
+
+# add to the plan the centralities needed by a simulation, described by a dictionary {section: {option: value}}
+def plan_sim_centralities(sim_opts, plan=None):
+    if plan is None:
+        plan = OrderedDict()
+
+    for section, tactic_opt in [('run_opts', 'attack_tactic'), ('safe_nodes_opts', 'selection_tactic')]:
+        if section in sim_opts and sim_opts[section] is not None:
+            opts = sim_opts[section]
+            if opts.get(tactic_opt) in centrality_tactics:
+                add_to_plan(plan, opts['centrality_fname'], [opts['centrality_name']])
+
+    paths = sim_opts['paths']
+    if paths.get('ml_stats_fpath'):
+        names = {'A': graph_name_from_fname(paths['netw_a_fname']), 'B': graph_name_from_fname(paths['netw_b_fname']),
+                 'I': graph_name_from_fname(paths['netw_inter_fname'])}
+        if 'netw_union_fname' in paths:
+            names['AB'] = graph_name_from_fname(paths['netw_union_fname'])
+        elif 'netw_union_name' in paths:
+            names['AB'] = paths['netw_union_name']
+        for graph_key in sorted(names):
+            add_to_plan(plan, centrality_fname(names[graph_key]),
+                        ml_stats_metrics[graph_key] + ml_stats_optional_metrics[graph_key])
+        add_to_plan(plan, misc_centrality_fname, ml_stats_optional_metrics['misc'])
+
+    return plan
+
+
+# add to the plan the centralities needed by the simulations of a batch configuration, as used by batch_sim_runner_2
+# every value of the independent variable is considered, since it may be the centrality used to pick nodes
+def plan_batch_centralities(batch_conf, plan=None):
+    if plan is None:
+        plan = OrderedDict()
+    if 'opts_section_of_indep_var' in batch_conf:
+        indep_var_section = batch_conf['opts_section_of_indep_var']
+    else:
+        indep_var_section = 'run_opts'
+    indep_var_name = batch_conf['indep_var_name']
+    indep_var_vals = sf.pick_conf_values(batch_conf, 'indep_var_vals')
+
+    for base_config in batch_conf['base_configs']:
+        for var_value in indep_var_vals:
+            sim_opts = {section: dict(opts) for section, opts in base_config.items() if isinstance(opts, dict)}
+            sim_opts.setdefault(indep_var_section, {})[indep_var_name] = var_value
+            plan_sim_centralities(sim_opts, plan)
+    return plan
+
+
+# add to the plan the centralities needed by the simulation configured by an ini file, as used by cascades_sim
+def plan_conf_centralities(conf_fpath, plan=None):
+    config = ConfigParser()
+    config.read(conf_fpath)
+    sim_opts = {section: dict(config.items(section)) for section in config.sections()}
+    return plan_sim_centralities(sim_opts, plan)
+
+
+def write_plan(plan, fpath):
+    with open(fpath, 'w') as plan_file:
+        json.dump(plan, plan_file, indent=4)
+
+
+def read_plan(fpath):
+    with open(fpath, 'r') as plan_file:
+        return json.load(plan_file, object_pairs_hook=OrderedDict)
+
+
+# the graphs a simulation can calculate centralities on, by name, plus the 3 graphs needed by misc centralities
+def graphs_by_name(A, B, I, ab_union=None):
+    graphs = {A.graph['name']: A, B.graph['name']: B, I.graph['name']: I, 'misc': (A, B, I)}
+    if ab_union is not None:
+        graphs[ab_union.graph['name']] = ab_union
+    return graphs
+
+
+# replace a json file at once, so that simulations running in parallel never read it half written, and files
+# hard-linked from the cache of instances are not changed
+def _replace_json(centrality_info, fpath):
+    tmp_fpath = '{}.{}.tmp'.format(fpath, os.getpid())
+    with open(tmp_fpath, 'wb') as tmp_file:
+        json.dump(centrality_info, tmp_file)
+    if os.name == 'nt' and os.path.exists(fpath):
+        os.remove(fpath)
+    os.rename(tmp_fpath, fpath)
+
+
+# fetch the centrality file fname of netw_dir, making sure it contains the given metrics
+# graphs is the result of graphs_by_name, the missing metrics (or the whole file) are calculated on the graph the file
+# is named after and saved, if graphs is None nothing is calculated, and the file is returned as it is (or None)
+# betweenness is sampled with the number of pivots saved in the file, if it was sampled when the instance was created
+# metrics are calculated with the seed and katz_method saved in the file, seed and katz_method are only used for files
+# that don't have them (missing files, and files written before they were saved)
+def fetch_centrality_info(floader, netw_dir, fname, metrics, graphs=None, seed=None, katz_method='numpy'):
+    fpath = os.path.join(netw_dir, fname)
+    centrality_info = floader.fetch_json(fpath)
+    if graphs is None:
+        return centrality_info
+    missing = [metric for metric in metrics
+               if centrality_info is None or metric + '_centrality' not in centrality_info]
+    if len(missing) == 0:
+        return centrality_info
+
+    if fname == misc_centrality_fname:
+        A, B, I = graphs['misc']
+        if centrality_info is None:
+            centrality_info = nc.build_misc_centrality_info(A, B, {})
+        for metric in missing:
+            logger.info('Calculating {} centrality for file {}'.format(metric, fname))
+            nc.add_centrality_info(centrality_info, metric + '_centrality', nc.calc_misc_centrality(A, B, I, metric))
+    else:
+        graph_name = fname[len('node_centrality_'):-len('.json')]
+        if not fname.startswith('node_centrality_') or graph_name not in graphs:
+            raise ValueError('Cannot calculate centralities for file {}, no graph named "{}"'.format(fname, graph_name))
+        G = graphs[graph_name]
+        if centrality_info is None:
+            centrality_info = nc.build_graph_centrality_info(G, {}, None, seed, katz_method)
+        betweenness_samples = None
+        if centrality_info.get('betweenness_centrality_mode', 'exact') == 'sampled':
+            betweenness_samples = centrality_info['betweenness_centrality_samples']
+        seed = centrality_info.get('seed', seed)
+        katz_method = centrality_info.get('katz_method', katz_method)
+        for metric in missing:
+            logger.info('Calculating {} centrality for file {}'.format(metric, fname))
+            nc.add_centrality_info(centrality_info, metric + '_centrality',
+                                   nc.calc_graph_centrality(G, metric, betweenness_samples, seed,
+                                                            katz_method=katz_method))
+
+    _replace_json(centrality_info, fpath)
+    sf.update_manifest(netw_dir, [fname])
+    floader.discard(fpath)
+    return floader.fetch_json(fpath)
+
+
+def main(argv):
+    if len(argv) < 3:
+        print('Usage: python centrality_planner.py plan.json batch_conf.json [batch_conf.json ...]')
+        return 1
+    plan = OrderedDict()
+    for batch_conf_fpath in argv[2:]:
+        with open(batch_conf_fpath) as batch_conf_file:
+            batch_conf = json.load(batch_conf_file, object_pairs_hook=OrderedDict)
+        plan_batch_centralities(batch_conf, plan)
+    write_plan(plan, argv[1])
+    for fname in plan:
+        print('{}: {}'.format(fname, ', '.join(plan[fname])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
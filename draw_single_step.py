@@ -4,6 +4,7 @@ import os
 import networkx as nx
 import matplotlib.pyplot as plt
 import shared_functions as sf
+import layout_cache as lc
 
 def arrange_nodes(G, pos_by_node):
     for node, (x, y) in pos_by_node.items():
@@ -11,6 +12,7 @@ def arrange_nodes(G, pos_by_node):
         G.node[node]['y'] = float(y)
 
 output_dir = 'C:/Users/Agostino/Documents/Simulations/MN/rnd_atk/uniform/instance_0/run_1/'
+layout_cache_dir = os.path.join('C:/Users/Agostino/Documents/Simulations/MN/instance_0/', lc.layouts_dirname)
 
 original_A = nx.read_graphml('C:/Users/Agostino/Documents/Simulations/MN/instance_0/A.graphml',
                              node_type=str)
@@ -25,11 +27,14 @@ B = nx.read_graphml('C:/Users/Agostino/Documents/Simulations/MN/rnd_atk/uniform/
 
 # hack, use only if nodes do not have x,y
 # hack, assuming a lot of values are the same
+# layouts are calculated on the original graphs, so that they are the same for every step, and reused from the cache
 span = 1.0
-pos_by_node = nx.spring_layout(A, dim=2, scale=span)
-arrange_nodes(A, pos_by_node)
-pos_by_node = nx.spring_layout(B, dim=2, scale=span)
-arrange_nodes(B, pos_by_node)
+pos_by_node = lc.get_layout(original_A, 'spring', layout_cache_dir, span)
+arrange_nodes(original_A, pos_by_node)
+arrange_nodes(A, {node: pos_by_node[node] for node in A.nodes()})
+pos_by_node = lc.get_layout(original_B, 'spring', layout_cache_dir, span)
+arrange_nodes(original_B, pos_by_node)
+arrange_nodes(B, {node: pos_by_node[node] for node in B.nodes()})
 
 netw_a_name = A.graph['name']
 netw_b_name = B.graph['name']
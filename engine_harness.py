@@ -0,0 +1,198 @@
+import os
+import sys
+import csv
+import glob
+import json
+import shutil
+import logging
+import tempfile
+import file_loader as fl
+import cascades_sim as sim
+from collections import OrderedDict
+from timeit import default_timer
+
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import ConfigParser  # ver. < 3.0
+
+__author__ = 'Agostino Sturaro'
+
+# This module runs the scenarios in test_sets with every available simulation engine and checks that they all
+# produce the same log, the same nodes dying at the same time and the same final statistics. The outputs of the
+# reference engine are also checked against the expected outputs saved in test_sets. Execution times are recorded.
+# Usage: python engine_harness.py [report.json]
+
+logger = logging.getLogger(__name__)
+
+reference_engine = 'scalar'
+
+
+# collects the messages logged by the simulation, so they can be compared with the expected logs
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+# find the scenarios in test_sets, a scenario is a run_<name>.ini file with a matching exp_log_<name>.txt file
+# returns a list of dictionaries with the paths of the files of each scenario
+def find_scenarios(test_sets_dir):
+    scenarios = []
+    for conf_fpath in sorted(glob.glob(os.path.join(test_sets_dir, '*', 'run_*.ini'))):
+        scenario_dir, conf_fname = os.path.split(conf_fpath)
+        suffix = conf_fname[len('run_'):-len('.ini')]
+        exp_log_fpath = os.path.join(scenario_dir, 'exp_log_{}.txt'.format(suffix))
+        if not os.path.isfile(exp_log_fpath):
+            continue
+        exp_end_stats_fpath = os.path.join(scenario_dir, 'exp_end_stats_{}.tsv'.format(suffix))
+        if not os.path.isfile(exp_end_stats_fpath):
+            exp_end_stats_fpath = None
+        scenarios.append({'name': '{}/{}'.format(os.path.basename(scenario_dir), suffix), 'conf_fpath': conf_fpath,
+                          'exp_log_fpath': exp_log_fpath, 'exp_end_stats_fpath': exp_end_stats_fpath})
+    return scenarios
+
+
+# write a copy of the configuration of a scenario, redirecting its outputs to work_dir and selecting an engine
+def write_engine_conf(conf_fpath, base_dir, work_dir, engine):
+    config = ConfigParser()
+    config.read(conf_fpath)
+    netw_dir = config.get('paths', 'netw_dir')
+    if os.path.isabs(netw_dir) is False:
+        config.set('paths', 'netw_dir', os.path.join(base_dir, netw_dir))
+    config.set('paths', 'results_dir', os.path.join(work_dir, 'results'))
+    config.set('paths', 'end_stats_fpath', os.path.join(work_dir, 'end_stats.tsv'))
+    config.set('paths', 'run_stats_fname', 'run_stats.tsv')
+    config.set('paths', 'events_fname', 'events.jsonl')
+    config.set('run_opts', 'engine', engine)
+
+    engine_conf_fpath = os.path.join(work_dir, 'run.ini')
+    with open(engine_conf_fpath, 'w') as engine_conf_file:
+        config.write(engine_conf_file)
+    return engine_conf_fpath
+
+
+def read_lines(fpath):
+    with open(fpath, 'r') as in_file:
+        return [line.rstrip('\r\n') for line in in_file]
+
+
+# run a simulation and collect its outputs, the log messages are collected only if capture_log is True
+def run_and_collect(conf_fpath, work_dir, capture_log):
+    results_dir = os.path.join(work_dir, 'results')
+    end_stats_fpath = os.path.join(work_dir, 'end_stats.tsv')
+    if os.path.exists(results_dir):
+        shutil.rmtree(results_dir)
+    if os.path.exists(end_stats_fpath):
+        os.remove(end_stats_fpath)
+
+    # while running, simulation messages go only to our handler, and only if they are needed
+    handler = ListHandler()
+    old_level = sim.logger.level
+    old_propagate = sim.logger.propagate
+    sim.logger.propagate = False
+    if capture_log is True:
+        sim.logger.setLevel(logging.DEBUG)
+        sim.logger.addHandler(handler)
+    else:
+        sim.logger.setLevel(logging.WARNING)
+
+    try:
+        floader = fl.FileLoader()
+        start = default_timer()
+        sim.run(conf_fpath, floader)
+        elapsed = default_timer() - start
+    finally:
+        sim.logger.removeHandler(handler)
+        sim.logger.setLevel(old_level)
+        sim.logger.propagate = old_propagate
+
+    with open(os.path.join(results_dir, 'events.jsonl'), 'rb') as events_file:
+        events = [json.loads(line.decode('utf-8')) for line in events_file]
+    with open(end_stats_fpath, 'r') as end_stats_file:
+        end_stats = list(csv.DictReader(end_stats_file, delimiter='\t'))
+
+    outputs = {'log': handler.messages, 'events': events, 'end_stats': end_stats,
+               'run_stats': read_lines(os.path.join(results_dir, 'run_stats.tsv'))}
+    return outputs, elapsed
+
+
+# compare two sets of outputs, returns a list of descriptions of the differences (empty if they are the same)
+# the first line of the log reports the path of the configuration file, so it's not compared
+def diff_outputs(outputs, ref_outputs):
+    diffs = []
+    for key in ['events', 'end_stats', 'run_stats']:
+        if outputs[key] != ref_outputs[key]:
+            diffs.append('{} differ'.format(key))
+    if outputs['log'][1:] != ref_outputs['log'][1:]:
+        diffs.append('log differs')
+    return diffs
+
+
+# check the outputs of the reference engine against the expected files of a scenario
+def diff_expected(scenario, outputs, work_dir):
+    diffs = []
+    exp_log = read_lines(scenario['exp_log_fpath'])
+    if outputs['log'][1:] != exp_log[1:]:
+        diffs.append('log differs from {}'.format(scenario['exp_log_fpath']))
+    if scenario['exp_end_stats_fpath'] is not None:
+        if read_lines(os.path.join(work_dir, 'end_stats.tsv')) != read_lines(scenario['exp_end_stats_fpath']):
+            diffs.append('end stats differ from {}'.format(scenario['exp_end_stats_fpath']))
+    return diffs
+
+
+# run each scenario with each engine, the reference engine is always run first
+# timing_runs is the number of additional runs, without log collection, used to measure execution time
+# returns a report with an entry for each scenario and engine, entries with a non empty "diffs" list are failures
+def run_harness(test_sets_dir, engines=None, timing_runs=3):
+    if engines is None:
+        engines = sim.sim_engines
+    engines = [reference_engine] + [engine for engine in engines if engine != reference_engine]
+    base_dir = os.path.dirname(os.path.abspath(test_sets_dir))
+
+    report = []
+    work_dir = tempfile.mkdtemp(prefix='engine_harness_')
+    try:
+        for scenario in find_scenarios(test_sets_dir):
+            ref_outputs = None
+            for engine in engines:
+                conf_fpath = write_engine_conf(scenario['conf_fpath'], base_dir, work_dir, engine)
+                outputs, elapsed = run_and_collect(conf_fpath, work_dir, True)
+                if engine == reference_engine:
+                    ref_outputs = outputs
+                    diffs = diff_expected(scenario, outputs, work_dir)
+                else:
+                    diffs = diff_outputs(outputs, ref_outputs)
+
+                times = [elapsed]
+                for i in range(0, timing_runs):
+                    times.append(run_and_collect(conf_fpath, work_dir, False)[1])
+
+                entry = OrderedDict([('scenario', scenario['name']), ('engine', engine), ('diffs', diffs),
+                                     ('min_time', min(times)), ('times', times)])
+                if len(diffs) > 0:
+                    logger.error('{} with engine {}: {}'.format(scenario['name'], engine, ', '.join(diffs)))
+                report.append(entry)
+    finally:
+        shutil.rmtree(work_dir)
+
+    return report
+
+
+if __name__ == '__main__':
+    this_dir = os.path.normpath(os.path.dirname(os.path.abspath(__file__)))
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    harness_report = run_harness(os.path.join(this_dir, 'test_sets'))
+    for report_entry in harness_report:
+        logger.info('{:<28} {:<10} {:>9.4f}s {}'.format(report_entry['scenario'], report_entry['engine'],
+                                                       report_entry['min_time'],
+                                                       'OK' if len(report_entry['diffs']) == 0 else 'FAILED'))
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'w') as report_file:
+            json.dump(harness_report, report_file, indent=4)
+    if any(len(report_entry['diffs']) > 0 for report_entry in harness_report):
+        sys.exit(1)
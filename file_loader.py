@@ -3,16 +3,20 @@ import json
 import time
 import copy
 import networkx as nx
+import graphml_stream as gs
 
 __author__ = 'Agostino Sturaro'
 
 
+# if stream_graphml is True, graphml files are read with the streaming reader of graphml_stream, same graphs, but
+# much less memory needed to read large files
 class FileLoader:
-    def __init__(self, return_copy=True, cache_size=100):
+    def __init__(self, return_copy=True, cache_size=100, stream_graphml=False):
         self.loaded = {}
         self.last_hit = {}
         self.return_copy = return_copy
         self.cache_size = cache_size
+        self.stream_graphml = stream_graphml
 
     def fetch_graphml(self, fpath, node_type):
         fpath = os.path.abspath(fpath)
@@ -26,7 +30,10 @@ class FileLoader:
                 stalest = min(self.last_hit.iterkeys(), key=(lambda key: self.last_hit[key]))
                 del self.loaded[stalest]
                 del self.last_hit[stalest]
-            graph = nx.read_graphml(fpath, node_type=node_type)
+            if self.stream_graphml is True:
+                graph = gs.read_graphml(fpath, node_type=node_type)
+            else:
+                graph = nx.read_graphml(fpath, node_type=node_type)
             self.loaded[fpath] = graph
         self.last_hit[fpath] = time.clock()
         if self.return_copy:
@@ -52,3 +59,10 @@ class FileLoader:
         if self.return_copy:
             json_dict = copy.deepcopy(json_dict)
         return json_dict
+
+    # forget a cached file, so that it is read again the next time it's fetched, needed when the file changes
+    def discard(self, fpath):
+        fpath = os.path.abspath(fpath)
+        if fpath in self.loaded:
+            del self.loaded[fpath]
+            del self.last_hit[fpath]
@@ -0,0 +1,467 @@
+import math
+import numpy as np
+import networkx as nx
+from array import array
+from xml.sax.saxutils import escape, quoteattr
+from networkx.utils import make_str
+from networkx.readwrite.graphml import GraphML
+
+try:
+    from xml.etree.cElementTree import iterparse, Element, SubElement, tostring
+except ImportError:
+    from xml.etree.ElementTree import iterparse, Element, SubElement, tostring  # ver. >= 3.3, C used by default
+
+__author__ = 'Agostino Sturaro'
+
+# GraphML files read and written in a single pass, without building the whole XML document in memory.
+# nx.read_graphml parses the whole file into an element tree before creating the graph, and nx.write_graphml builds
+# the whole element tree before writing it, both take several times the memory of the graph on large inputs.
+# Here, elements are parsed with iterparse and dropped as soon as the node or edge they describe is read.
+# read_graphml returns the same graph as nx.read_graphml (same attribute types, defaults, multigraph detection, order
+# of nodes and edges), for files with a single graph and without yfiles extensions. write_graphml writes the same file
+# as nx.write_graphml, one element at a time. read_graphml_arrays only keeps the positions and roles of the nodes, and
+# the edges as arrays of node indices, and write_graphml_arrays writes them back.
+
+NS_GRAPHML = '{' + GraphML.NS_GRAPHML + '}'
+
+_key_tag = NS_GRAPHML + 'key'
+_default_tag = NS_GRAPHML + 'default'
+_graph_tag = NS_GRAPHML + 'graph'
+_node_tag = NS_GRAPHML + 'node'
+_edge_tag = NS_GRAPHML + 'edge'
+_data_tag = NS_GRAPHML + 'data'
+_hyperedge_tag = NS_GRAPHML + 'hyperedge'
+
+
+def _decode_key(key_elem):
+    attr_type = key_elem.get('attr.type', 'string')
+    attr_name = key_elem.get('attr.name')
+    if key_elem.get('yfiles.type') is not None:
+        raise nx.NetworkXError('yfiles extensions are not supported by the streaming GraphML reader')
+    if attr_name is None:
+        raise nx.NetworkXError('Unknown key for id {} in file.'.format(key_elem.get('id')))
+    return {'name': attr_name, 'type': GraphML.python_type[attr_type], 'for': key_elem.get('for')}
+
+
+def _decode_value(key, text):
+    if key['type'] == bool:
+        return GraphML.convert_bool[text]
+    return key['type'](text)
+
+
+def _decode_data(keys, data_elems):
+    data = {}
+    for data_elem in data_elems:
+        key_id = data_elem.get('key')
+        if key_id not in keys:
+            raise nx.NetworkXError('Bad GraphML data: no key {}'.format(key_id))
+        if len(data_elem) > 0:
+            raise nx.NetworkXError('yfiles extensions are not supported by the streaming GraphML reader')
+        if data_elem.text is not None:
+            key = keys[key_id]
+            data[key['name']] = _decode_value(key, data_elem.text)
+    return data
+
+
+# parse a GraphML file, yielding its contents in the order they are found
+# ('graph', directed, node_default, edge_default) when the graph starts
+# ('node', node, data) for each node, ('edge', source, target, edge id, data, directed attribute) for each edge
+# ('graph_data', data) for the attributes of the graph
+def iter_graphml(fpath, node_type=str):
+    keys = {}
+    defaults = {}
+    graph_elem = None
+    depth = 0  # depth of the current element inside the graph element
+    for event, elem in iterparse(fpath, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == _graph_tag:
+                if graph_elem is not None:
+                    raise nx.NetworkXError('Nested graphs and files with multiple graphs are not supported by the '
+                                           'streaming GraphML reader')
+                graph_elem = elem
+                node_default = {}
+                edge_default = {}
+                for key_id, text in defaults.items():
+                    key = keys[key_id]
+                    if key['for'] == 'node':
+                        node_default[key['name']] = key['type'](text)
+                    elif key['for'] == 'edge':
+                        edge_default[key['name']] = key['type'](text)
+                yield 'graph', elem.get('edgedefault') == 'directed', node_default, edge_default
+            elif graph_elem is not None:
+                depth += 1
+            continue
+
+        if graph_elem is None:
+            if elem.tag == _key_tag:
+                keys[elem.get('id')] = _decode_key(elem)
+                default_elem = elem.find(_default_tag)
+                if default_elem is not None:
+                    defaults[elem.get('id')] = default_elem.text
+            continue
+
+        if elem.tag == _graph_tag:
+            graph_elem.clear()
+            graph_elem = None
+            continue
+
+        depth -= 1
+        if depth > 0:  # an element inside a node or an edge, read when the node or edge ends
+            continue
+        if elem.tag == _node_tag:
+            yield 'node', node_type(elem.get('id')), _decode_data(keys, elem.findall(_data_tag))
+        elif elem.tag == _edge_tag:
+            directed = elem.get('directed')
+            yield 'edge', node_type(elem.get('source')), node_type(elem.get('target')), elem.get('id'), \
+                _decode_data(keys, elem.findall(_data_tag)), directed
+        elif elem.tag == _data_tag:
+            yield 'graph_data', _decode_data(keys, [elem])
+        elif elem.tag == _hyperedge_tag:
+            raise nx.NetworkXError('GraphML reader does not support hyperedges')
+        # drop the elements attached to the graph, the parser may have already attached the next ones, but they are
+        # still referenced by the events that will be read next
+        del graph_elem[:]
+
+
+class MultigraphFound(Exception):
+    pass
+
+
+def _build_graph(fpath, node_type, multigraph):
+    G = None
+    for item in iter_graphml(fpath, node_type):
+        kind = item[0]
+        if kind == 'node':
+            G.add_node(item[1], item[2])
+        elif kind == 'edge':
+            kind, source, target, edge_id, data, directed = item
+            if G.is_directed() and directed == 'false':
+                raise nx.NetworkXError('directed=false edge found in directed graph.')
+            if not G.is_directed() and directed == 'true':
+                raise nx.NetworkXError('directed=true edge found in undirected graph.')
+            if edge_id:
+                data['id'] = edge_id
+            if edge_id is None:
+                edge_id = data.pop('key', None)
+            if multigraph:
+                G.add_edge(source, target, key=edge_id, **data)
+            elif G.has_edge(source, target):
+                raise MultigraphFound()
+            else:
+                G.add_edge(source, target, **data)
+        elif kind == 'graph_data':
+            G.graph.update(item[1])
+        else:
+            kind, directed, node_default, edge_default = item
+            if multigraph:
+                G = nx.MultiDiGraph() if directed else nx.MultiGraph()
+            else:
+                G = nx.DiGraph() if directed else nx.Graph()
+            G.graph['node_default'] = node_default
+            G.graph['edge_default'] = edge_default
+    if G is None:
+        raise nx.NetworkXError('No graph found in file {}'.format(fpath))
+    return G
+
+
+# copy the graph like nx.Graph(G) or nx.DiGraph(G) do, nx.read_graphml reads a multigraph and copies it like this
+# when it has no parallel edges, G was built adding nodes and edges in the same order as that multigraph, so their
+# dictionaries have the same order, and the copy has the same order of nodes and edges as the one of networkx
+# the adjacency of G is dropped while it's copied, so the two graphs are not both held in memory
+def _copy_like_networkx(G):
+    H = nx.DiGraph() if G.is_directed() else nx.Graph()
+    H.add_nodes_from(G.adj)
+    if G.is_directed():
+        G.pred.clear()  # only the successors are copied
+    for u in G.adj:
+        nbrs = G.adj[u]
+        G.adj[u] = None
+        if H.is_directed():
+            H.add_edges_from((u, v, data) for v, data in nbrs.items())
+        else:
+            # edges are added in both directions, skip the ones already added from their other end
+            H.add_edges_from((u, v, data) for v, data in nbrs.items() if v == u or G.adj[v] is not None)
+    H.graph = G.graph.copy()
+    H.node = dict((node, data.copy()) for node, data in G.node.items())
+    return H
+
+
+# same as nx.read_graphml, but the file is streamed
+# graphs are read as simple graphs, if a parallel edge is found, the file is read again as a multigraph
+# the order of nodes and edges is the same as with nx.read_graphml, or random choices made on the graph (e.g. the
+# nodes picked by random attacks) would change
+def read_graphml(fpath, node_type=str):
+    try:
+        G = _build_graph(fpath, node_type, False)
+    except MultigraphFound:
+        return _build_graph(fpath, node_type, True)
+    return _copy_like_networkx(G)
+
+
+# add the attributes in data to the GraphML element elem, as data elements, like the GraphMLWriter of networkx
+# keys maps (attribute name, type, scope) to (key id, default value), new attributes are added to it
+# if elem is None, only keys is updated
+def _add_attributes(keys, scope, elem, data, default):
+    for name, value in data.items():
+        if type(value) not in GraphML.xml_type:
+            raise nx.NetworkXError('GraphML writer does not support {} as data values.'.format(type(value)))
+        key = (make_str(name), GraphML.xml_type[type(value)], scope)
+        if key not in keys:
+            keys[key] = ('d{}'.format(len(keys)), default.get(name))
+        if elem is not None:
+            data_elem = SubElement(elem, 'data', key=keys[key][0])
+            data_elem.text = make_str(make_str(value))
+
+
+# the elements inside the graph element, in the order networkx writes them, the attributes of the graph, the nodes
+# and the edges, if keys_only is True, no element is created, only keys is updated
+def _iter_graph_children(G, keys, keys_only=False):
+    graph_data = dict((name, value) for name, value in G.graph.items()
+                      if name not in ['node_default', 'edge_default', 'id'])
+    graph_elem = None if keys_only else Element('graph')
+    _add_attributes(keys, 'graph', graph_elem, graph_data, {})
+    if graph_elem is not None:
+        for data_elem in graph_elem:
+            yield data_elem
+
+    node_default = G.graph.get('node_default', {})
+    for node, data in G.nodes_iter(data=True):
+        node_elem = None if keys_only else Element('node', id=make_str(node))
+        _add_attributes(keys, 'node', node_elem, data, node_default)
+        yield node_elem
+
+    edge_default = G.graph.get('edge_default', {})
+    if G.is_multigraph():
+        for u, v, key, data in G.edges_iter(data=True, keys=True):
+            edge_elem = None if keys_only else Element('edge', source=make_str(u), target=make_str(v))
+            _add_attributes(keys, 'edge', edge_elem, data, edge_default)
+            _add_attributes(keys, 'edge', edge_elem, {'key': key}, edge_default)
+            yield edge_elem
+    else:
+        for u, v, data in G.edges_iter(data=True):
+            edge_elem = None if keys_only else Element('edge', source=make_str(u), target=make_str(v))
+            _add_attributes(keys, 'edge', edge_elem, data, edge_default)
+            yield edge_elem
+
+
+# the indentation networkx adds to elements, level is the depth of the element, its tail is set by the caller
+def _indent_children(elem, level):
+    if len(elem) > 0:
+        elem.text = '\n' + (level + 1) * '  '
+        for child in elem:
+            _indent_children(child, level + 1)
+            child.tail = '\n' + (level + 1) * '  '
+        child.tail = '\n' + level * '  '
+
+
+# the start tag of an element, and the text that follows it
+def _start_tag(elem, encoding):
+    text = tostring(elem, encoding)
+    return text[:text.rindex(b'</')]
+
+
+# same as nx.write_graphml, the file written is the same, but it's written one node or edge at a time, instead of
+# building the whole element tree first (unlike networkx, the "id" attribute of the graph is not removed from G)
+# the keys of the attributes come before the graph in the file, so they are collected by a first pass on the graph
+def write_graphml(G, fpath, encoding='utf-8'):
+    keys = {}
+    for _ in _iter_graph_children(G, keys, keys_only=True):
+        pass
+
+    graph_attrs = {'edgedefault': 'directed' if G.is_directed() else 'undirected'}
+    if G.graph.get('id') is not None:
+        graph_attrs['id'] = G.graph['id']
+    graph_elem = Element('graph', graph_attrs)
+    has_children = len(G.graph) > len(set(G.graph) & {'node_default', 'edge_default', 'id'}) or len(G) > 0
+
+    with open(fpath, 'wb') as out_file:
+        out_file.write("<?xml version='1.0' encoding='{}'?>\n".format(encoding).encode(encoding))
+        root_elem = Element('graphml', {'xmlns': GraphML.NS_GRAPHML, 'xmlns:xsi': GraphML.NS_XSI,
+                                        'xsi:schemaLocation': GraphML.SCHEMALOCATION})
+        root_elem.text = '\n  '
+        out_file.write(_start_tag(root_elem, encoding))
+
+        # networkx puts each new key before the others
+        for (name, attr_type, scope), (key_id, default) in sorted(keys.items(), key=lambda item: -int(item[1][0][1:])):
+            key_elem = Element('key', {'id': key_id, 'for': scope, 'attr.name': name, 'attr.type': attr_type})
+            if default is not None:
+                default_elem = SubElement(key_elem, 'default')
+                default_elem.text = make_str(default)
+            _indent_children(key_elem, 1)
+            key_elem.tail = '\n  '
+            out_file.write(tostring(key_elem, encoding))
+
+        if has_children is False:
+            graph_elem.tail = '\n'
+            out_file.write(tostring(graph_elem, encoding))
+        else:
+            graph_elem.text = '\n    '
+            out_file.write(_start_tag(graph_elem, encoding))
+            # the last element is followed by less indentation, so each one is written when the next one is found
+            prev_elem = None
+            for elem in _iter_graph_children(G, keys):
+                if prev_elem is not None:
+                    prev_elem.tail = '\n    '
+                    out_file.write(tostring(prev_elem, encoding))
+                _indent_children(elem, 2)
+                prev_elem = elem
+            prev_elem.tail = '\n  '
+            out_file.write(tostring(prev_elem, encoding))
+            out_file.write(b'</graph>\n')
+        out_file.write(b'</graphml>\n')
+
+
+# the nodes of a graph with their positions and roles, and its edges as pairs of node indices
+# xs and ys are NaN and roles are None for nodes without them
+class GraphArrays(object):
+    def __init__(self, name, directed, nodes, xs, ys, roles, sources, targets):
+        if not len(nodes) == len(xs) == len(ys) == len(roles):
+            raise ValueError('nodes, xs, ys and roles must have the same length')
+        if len(sources) != len(targets):
+            raise ValueError('sources and targets must have the same length')
+        self.name = name
+        self.directed = directed
+        self.nodes = list(nodes)
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        self.roles = list(roles)
+        self.sources = np.asarray(sources, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int64)
+
+    @classmethod
+    def from_graph(cls, G):
+        nodes = G.nodes()
+        index_of = {node: i for i, node in enumerate(nodes)}
+        xs = [G.node[node].get('x', np.nan) for node in nodes]
+        ys = [G.node[node].get('y', np.nan) for node in nodes]
+        roles = [G.node[node].get('role') for node in nodes]
+        sources = np.fromiter((index_of[u] for u, v in G.edges_iter()), dtype=np.int64)
+        targets = np.fromiter((index_of[v] for u, v in G.edges_iter()), dtype=np.int64)
+        return cls(G.graph.get('name'), G.is_directed(), nodes, xs, ys, roles, sources, targets)
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.sources)
+
+    def to_networkx(self):
+        G = nx.DiGraph() if self.directed else nx.Graph()
+        if self.name is not None:
+            G.graph['name'] = self.name
+        for node, x, y, role in zip(self.nodes, self.xs, self.ys, self.roles):
+            data = {}
+            if not math.isnan(x):
+                data['x'] = float(x)
+            if not math.isnan(y):
+                data['y'] = float(y)
+            if role is not None:
+                data['role'] = role
+            G.add_node(node, data)
+        nodes = self.nodes
+        G.add_edges_from((nodes[i], nodes[j]) for i, j in zip(self.sources.tolist(), self.targets.tolist()))
+        return G
+
+
+# read the nodes, their positions and roles, and the edges of a GraphML file, other attributes are ignored
+# edges found more than once are kept, nodes only found in edges are added without position and role
+def read_graphml_arrays(fpath, node_type=str):
+    name = None
+    directed = False
+    nodes = []
+    index_of = {}
+    xs = array('d')
+    ys = array('d')
+    roles = []
+    sources = array('l')
+    targets = array('l')
+    nan = float('nan')
+
+    def add_node(node):
+        index_of[node] = len(nodes)
+        nodes.append(node)
+        xs.append(nan)
+        ys.append(nan)
+        roles.append(None)
+        return index_of[node]
+
+    for item in iter_graphml(fpath, node_type):
+        kind = item[0]
+        if kind == 'node':
+            node, data = item[1], item[2]
+            i = index_of.get(node)
+            if i is None:
+                i = add_node(node)
+            xs[i] = data.get('x', nan)
+            ys[i] = data.get('y', nan)
+            roles[i] = data.get('role')
+        elif kind == 'edge':
+            for node, node_idxs in [(item[1], sources), (item[2], targets)]:
+                i = index_of.get(node)
+                if i is None:
+                    i = add_node(node)
+                node_idxs.append(i)
+        elif kind == 'graph_data':
+            name = item[1].get('name', name)
+        else:
+            directed = item[1]
+
+    return GraphArrays(name, directed, nodes, np.frombuffer(xs, dtype=np.float64),
+                       np.frombuffer(ys, dtype=np.float64), roles, np.frombuffer(sources, dtype=np.int_),
+                       np.frombuffer(targets, dtype=np.int_))
+
+
+# write the graph in arrays to a GraphML file that nx.read_graphml can read, nodes and edges are written one by one
+# positions are written with repr, so they are read back exactly
+def write_graphml_arrays(arrays, fpath, encoding='utf-8'):
+    has_xs = not np.isnan(arrays.xs).all()
+    has_ys = not np.isnan(arrays.ys).all()
+    has_roles = any(role is not None for role in arrays.roles)
+
+    with open(fpath, 'wb') as out_file:
+        def write(text):
+            out_file.write(text.encode(encoding))
+
+        write(u'<?xml version="1.0" encoding="{}"?>\n'.format(encoding))
+        write(u'<graphml xmlns="{}" xmlns:xsi="{}" xsi:schemaLocation="{}">\n'.format(
+            GraphML.NS_GRAPHML, GraphML.NS_XSI, GraphML.SCHEMALOCATION))
+        if arrays.name is not None:
+            write(u'  <key attr.name="name" attr.type="string" for="graph" id="d0" />\n')
+        if has_roles:
+            write(u'  <key attr.name="role" attr.type="string" for="node" id="d1" />\n')
+        if has_xs:
+            write(u'  <key attr.name="x" attr.type="double" for="node" id="d2" />\n')
+        if has_ys:
+            write(u'  <key attr.name="y" attr.type="double" for="node" id="d3" />\n')
+        write(u'  <graph edgedefault="{}">\n'.format('directed' if arrays.directed else 'undirected'))
+        if arrays.name is not None:
+            write(u'    <data key="d0">{}</data>\n'.format(escape(u'{}'.format(arrays.name))))
+
+        node_ids = [quoteattr(u'{}'.format(node)) for node in arrays.nodes]
+        for i, node_id in enumerate(node_ids):
+            x = arrays.xs[i]
+            y = arrays.ys[i]
+            role = arrays.roles[i]
+            if math.isnan(x) and math.isnan(y) and role is None:
+                write(u'    <node id={} />\n'.format(node_id))
+                continue
+            write(u'    <node id={}>\n'.format(node_id))
+            if role is not None:
+                write(u'      <data key="d1">{}</data>\n'.format(escape(u'{}'.format(role))))
+            if not math.isnan(x):
+                write(u'      <data key="d2">{!r}</data>\n'.format(float(x)))
+            if not math.isnan(y):
+                write(u'      <data key="d3">{!r}</data>\n'.format(float(y)))
+            write(u'    </node>\n')
+
+        # edges are written in blocks, to limit the number of calls without building the whole text
+        block_size = 4096
+        sources = arrays.sources
+        targets = arrays.targets
+        for start in range(0, len(sources), block_size):
+            write(u''.join(u'    <edge source={} target={} />\n'.format(node_ids[i], node_ids[j])
+                           for i, j in zip(sources[start:start + block_size].tolist(),
+                                           targets[start:start + block_size].tolist())))
+
+        write(u'  </graph>\n')
+        write(u'</graphml>\n')
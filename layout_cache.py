@@ -0,0 +1,220 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import networkx as nx
+
+__author__ = 'Agostino Sturaro'
+
+# Layouts assign a position to the nodes of graphs that don't have one, so that they can be drawn.
+# Force-directed layouts are slow to calculate, so they are saved as JSON files in a cache directory (e.g. the
+# layouts subdirectory of an instance), named after a hash of the structure of the graph (its nodes and edges) and of
+# the parameters of the layout, and read back whenever the same graph is drawn with the same parameters.
+# Layouts are deterministic, their initial positions are picked using a seed.
+# spring is the Fruchterman-Reingold layout of networkx, that compares every pair of nodes at each iteration.
+# fast_spring is the same algorithm, with the repulsive forces between far away nodes approximated like in the
+# Barnes-Hut algorithm, so each iteration takes O(n log n) time instead of O(n^2), use it for graphs with more than a
+# few thousand nodes.
+
+logger = logging.getLogger(__name__)
+
+layouts = ['spring', 'fast_spring']
+
+# name of the subdirectory of an instance where the layouts of its graphs are saved
+layouts_dirname = 'layouts'
+
+# graphs with more nodes than this are arranged with fast_spring, unless a layout is specified
+fast_layout_above = 2000
+
+
+# sha1 of the nodes and edges of a graph, as a hex string, it does not depend on the order of nodes and edges
+def hash_graph_structure(G):
+    sha1 = hashlib.sha1()
+    sha1.update('directed={}\n'.format(G.is_directed()).encode('utf-8'))
+    for node in sorted(str(node) for node in G.nodes_iter()):
+        sha1.update('n {}\n'.format(node).encode('utf-8'))
+    if G.is_directed():
+        edges = [(str(u), str(v)) for u, v in G.edges_iter()]
+    else:
+        edges = [tuple(sorted([str(u), str(v)])) for u, v in G.edges_iter()]
+    for u, v in sorted(edges):
+        sha1.update('e {} {}\n'.format(u, v).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def layout_fname(G, layout, params):
+    sha1 = hashlib.sha1()
+    sha1.update(hash_graph_structure(G).encode('utf-8'))
+    sha1.update(json.dumps(dict(params, layout=layout), sort_keys=True).encode('utf-8'))
+    return '{}_{}_{}.json'.format(G.graph.get('name', 'graph'), layout, sha1.hexdigest())
+
+
+# random initial positions in the unit square, nodes are sorted so that they don't depend on the order of the graph
+def _initial_positions(G, seed):
+    nodes = sorted(G.nodes(), key=str)
+    np_random = np.random.RandomState(seed)
+    return nodes, np_random.uniform(size=(len(nodes), 2))
+
+
+# like the private function of networkx, moves positions to start from 0 and scales them to fit [0, scale]
+def _rescale_layout(pos, scale=1.0):
+    pos -= pos.min(axis=0)
+    max_lim = pos.max()
+    if max_lim > 0:
+        pos *= scale / max_lim
+    return pos
+
+
+def spring_layout(G, span=1.0, seed=None, iterations=50):
+    nodes, init_pos = _initial_positions(G, seed)
+    pos_by_node = {node: init_pos[i] for i, node in enumerate(nodes)}
+    return nx.spring_layout(G, dim=2, pos=pos_by_node, iterations=iterations, scale=span)
+
+
+# repulsive forces between all the nodes, approximated like in the Barnes-Hut algorithm
+# nodes are put in a hierarchy of grids, where each level has twice the cells per side of the previous one, at each
+# level a node is pushed away by the cells that are not its neighbours, but are children of the neighbours of its
+# parent cell, as if all the nodes of a cell were in its center of mass, at the finest level (cells about k wide) a
+# node is pushed away by each node of its neighbour cells
+def _approx_repulsion(pos, k):
+    from scipy.spatial import cKDTree
+
+    node_cnt = len(pos)
+    disp = np.zeros((node_cnt, 2))
+    extent = max(np.ptp(pos, axis=0).max(), k)
+    unit_pos = (pos - pos.min(axis=0)) / extent
+    max_level = max(2, int(np.ceil(np.log2(extent / k))))
+    # offsets of the children of the neighbours of a parent cell, from its first child
+    offsets_x = np.repeat(np.arange(-2, 4), 6)[np.newaxis, :]
+    offsets_y = np.tile(np.arange(-2, 4), 6)[np.newaxis, :]
+    pos_x = pos[:, 0][:, np.newaxis]
+    pos_y = pos[:, 1][:, np.newaxis]
+
+    for level in range(2, max_level + 1):
+        side = 2 ** level
+        cells = np.minimum((unit_pos * side).astype(np.int64), side - 1)
+        cell_ids = cells[:, 0] * side + cells[:, 1]
+        masses = np.bincount(cell_ids, minlength=side * side).astype(np.float64)
+        occupied = masses > 0
+        centers_x = np.zeros(side * side)
+        centers_x[occupied] = np.bincount(cell_ids, pos[:, 0], side * side)[occupied] / masses[occupied]
+        centers_y = np.zeros(side * side)
+        centers_y[occupied] = np.bincount(cell_ids, pos[:, 1], side * side)[occupied] / masses[occupied]
+
+        # cells interacting with each node, as matrices (node, offset)
+        cell_x = cells[:, 0][:, np.newaxis]
+        cell_y = cells[:, 1][:, np.newaxis]
+        far_x = cell_x // 2 * 2 + offsets_x
+        far_y = cell_y // 2 * 2 + offsets_y
+        valid = (far_x >= 0) & (far_x < side) & (far_y >= 0) & (far_y < side)
+        valid &= (np.abs(far_x - cell_x) > 1) | (np.abs(far_y - cell_y) > 1)
+        far_ids = np.where(valid, far_x * side + far_y, 0)
+        delta_x = pos_x - centers_x[far_ids]
+        delta_y = pos_y - centers_y[far_ids]
+        dist_sq = np.maximum(delta_x * delta_x + delta_y * delta_y, 0.0001 * k * k)
+        force = masses[far_ids] * valid * (k * k) / dist_sq
+        disp[:, 0] += (delta_x * force).sum(axis=1)
+        disp[:, 1] += (delta_y * force).sum(axis=1)
+
+    # nodes in neighbour cells of the finest level are at most 2 * sqrt(2) cells away
+    pairs = cKDTree(pos).query_pairs(2.0 * np.sqrt(2.0) * extent / side, output_type='ndarray')
+    if len(pairs) > 0:
+        pairs = pairs[np.all(np.abs(cells[pairs[:, 0]] - cells[pairs[:, 1]]) <= 1, axis=1)]
+        delta = pos[pairs[:, 0]] - pos[pairs[:, 1]]
+        dist_sq = np.maximum((delta ** 2).sum(axis=1), 0.0001 * k * k)
+        force = delta * (k * k / dist_sq)[:, np.newaxis]
+        for dim in range(2):
+            disp[:, dim] += np.bincount(pairs[:, 0], force[:, dim], node_cnt)
+            disp[:, dim] -= np.bincount(pairs[:, 1], force[:, dim], node_cnt)
+    return disp
+
+
+# Fruchterman-Reingold layout, with repulsive forces approximated by _approx_repulsion, like in networkx, nodes start
+# in the unit square, and each iteration moves them by no more than a temperature that decreases linearly
+def fast_spring_layout(G, span=1.0, seed=None, iterations=50):
+    nodes, pos = _initial_positions(G, seed)
+    node_cnt = len(nodes)
+    if node_cnt == 0:
+        return {}
+    index_of = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index_of[u], index_of[v]) for u, v in G.edges_iter() if u != v], dtype=np.int64).reshape(-1, 2)
+
+    k = np.sqrt(1.0 / node_cnt)  # the optimal distance between nodes
+    temperature = 0.1
+    cooling = temperature / float(iterations + 1)
+    for _ in range(iterations):
+        disp = _approx_repulsion(pos, k)
+
+        # attractive forces, between the ends of each edge
+        if len(edges) > 0:
+            delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+            dist = np.sqrt((delta ** 2).sum(axis=1))
+            force = delta * (dist / k)[:, np.newaxis]
+            for dim in range(2):
+                disp[:, dim] -= np.bincount(edges[:, 0], force[:, dim], node_cnt)
+                disp[:, dim] += np.bincount(edges[:, 1], force[:, dim], node_cnt)
+
+        length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 0.01)
+        pos += disp * (np.minimum(length, temperature) / length)[:, np.newaxis]
+        temperature -= cooling
+
+    pos = _rescale_layout(pos, span)
+    return {node: pos[i] for i, node in enumerate(nodes)}
+
+
+def calc_layout(G, layout, span=1.0, seed=None, iterations=50):
+    if layout == 'spring':
+        return spring_layout(G, span, seed, iterations)
+    elif layout == 'fast_spring':
+        return fast_spring_layout(G, span, seed, iterations)
+    else:
+        raise ValueError('Invalid value for parameter "layout": {}, valid values are {}'.format(layout, layouts))
+
+
+# the positions of the nodes of G, as a dictionary {node: numpy array [x, y]}, x and y are in [0, span]
+# if cache_dir is not None, the layout is read from it if it was saved there, otherwise it's calculated and saved
+def get_layout(G, layout='spring', cache_dir=None, span=1.0, seed=0, iterations=50):
+    if cache_dir is None:
+        return calc_layout(G, layout, span, seed, iterations)
+
+    params = {'span': span, 'seed': seed, 'iterations': iterations}
+    fpath = os.path.join(cache_dir, layout_fname(G, layout, params))
+    if os.path.isfile(fpath):
+        logger.debug('Reading layout of graph {} from file {}'.format(G.graph.get('name'), fpath))
+        with open(fpath, 'r') as layout_file:
+            pos_by_name = json.load(layout_file)['positions']
+        return {node: np.array(pos_by_name[str(node)]) for node in G.nodes_iter()}
+
+    pos_by_node = calc_layout(G, layout, span, seed, iterations)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # write a temporary file and rename it, so that layouts are never read half written
+    tmp_fpath = '{}.{}.tmp'.format(fpath, os.getpid())
+    with open(tmp_fpath, 'w') as layout_file:
+        json.dump({'layout': layout, 'params': params,
+                   'positions': {str(node): [float(x), float(y)] for node, (x, y) in pos_by_node.items()}},
+                  layout_file)
+    if os.name == 'nt' and os.path.exists(fpath):
+        os.remove(fpath)
+    os.rename(tmp_fpath, fpath)
+    logger.info('Layout of graph {} saved here\n{}'.format(G.graph.get('name'), fpath))
+    return pos_by_node
+
+
+def apply_layout(G, pos_by_node):
+    for node, (x, y) in pos_by_node.items():
+        G.node[node]['x'] = float(x)
+        G.node[node]['y'] = float(y)
+
+
+# give a position to the nodes of G using a layout, unless they all have one, returns True if positions were assigned
+# if layout is None, it's spring or fast_spring, depending on the size of the graph
+def ensure_positions(G, layout=None, cache_dir=None, **layout_kwargs):
+    if layout is None:
+        layout = 'fast_spring' if G.number_of_nodes() > fast_layout_above else 'spring'
+    for node_data in G.node.values():
+        if 'x' not in node_data or 'y' not in node_data:
+            apply_layout(G, get_layout(G, layout, cache_dir, **layout_kwargs))
+            return True
+    return False
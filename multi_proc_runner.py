@@ -2,12 +2,15 @@ import os
 import sys
 import json
 import subprocess
+import run_metrics as rm
+import sim_profiler as sp
 
 __author__ = 'Agostino Sturaro'
 
 
 def run_batches(batches):
     # check that all configuration files exist and are valid json
+    batch_confs = {}
     # for batch_no in range(concurrent_procs):
     for batch_no in batches:
         batch_conf_fpath = os.path.normpath('../Simulations/test_mp/batch_{}.json'.format(batch_no))
@@ -15,6 +18,7 @@ def run_batches(batches):
             try:
                 with open(batch_conf_fpath, 'rt') as f:
                     config = json.load(f)
+                batch_confs[batch_no] = config
             except Exception:
                 raise ValueError('The batch configuration file {} is not a valid json file'.format(batch_conf_fpath))
         else:
@@ -32,6 +36,24 @@ def run_batches(batches):
     for proc in procs:
         proc.wait()
 
+    # aggregate the metrics recorded by all the batches that were asked to record them
+    metrics_fpaths = []
+    for batch_no in batches:
+        if batch_confs[batch_no].get('record_metrics', False) is True:
+            metrics_fpaths.extend(rm.list_batch_metrics_fpaths(batch_confs[batch_no], batch_no))
+    if len(metrics_fpaths) > 0:
+        rm.write_metrics_summary(metrics_fpaths, os.path.normpath('../Simulations/test_mp/metrics_summary.tsv'))
+
+    # merge the profiles of the batches that were run, each directory used for profiles gets its own aggregate report
+    profile_fpaths_by_dir = {}
+    for batch_no in batches:
+        if 'profile' in batch_confs[batch_no]:
+            profile_dir = os.path.normpath(batch_confs[batch_no]['profile']['output_dir'])
+            profile_fpaths = profile_fpaths_by_dir.setdefault(profile_dir, [])
+            profile_fpaths.extend(sp.list_profiles(profile_dir, 'batch_{}_*'.format(batch_no)))
+    for profile_dir, profile_fpaths in profile_fpaths_by_dir.items():
+        sp.merge_profiles(profile_fpaths, os.path.join(profile_dir, 'merged_all_batches'))
+
 
 # TODO: ask before overwrite
 # each of these processes must have its own configuration file
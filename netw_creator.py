@@ -2,20 +2,23 @@ import os
 import sys
 import json
 import math
+import shutil
+import hashlib
 import random
 import logging
+import multiprocessing
 import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
 import shared_functions as sf
+import spatial_index as si
+import union_view as uv
+import graphml_stream as gs
+import netw_renderer as nr
+import layout_cache as lc
 from collections import OrderedDict
-from collections import defaultdict
 from pkg_resources import parse_version
-
-try:
-    import Queue as Q  # ver. < 3.0
-except ImportError:
-    import queue as Q
+from networkx.readwrite.graphml import GraphMLReader
 
 try:
     from configparser import ConfigParser
@@ -34,7 +37,8 @@ else:
 logger = logging.getLogger(__name__)
 
 
-def arrange_nodes(G, config, section_name):
+# layout_cache_dir is the directory where spring layouts are saved and reused, see layout_cache
+def arrange_nodes(G, config, section_name, seed=None, layout_cache_dir=None):
     layout = config.get(section_name, 'layout')
     layout = layout.lower()
 
@@ -55,8 +59,9 @@ def arrange_nodes(G, config, section_name):
     elif layout == 'circular':
         pos_by_node = nx.circular_layout(G, dim=2, scale=span)
     elif layout in ['spring', 'fruchterman_reingold']:
-        logger.info('This layout will produce a non-deterministic placement of nodes in {}'.format(G.graph['name']))
-        pos_by_node = nx.spring_layout(G, dim=2, scale=span)
+        pos_by_node = lc.get_layout(G, 'spring', layout_cache_dir, span, seed)
+    elif layout == 'fast_spring':
+        pos_by_node = lc.get_layout(G, 'fast_spring', layout_cache_dir, span, seed)
     else:
         raise ValueError('Invalid value for parameter "layout" of network {}: {}'.format(G.graph['name'], layout))
 
@@ -82,7 +87,73 @@ def uar_layout(G, span, center, seed=None):
     return pos_by_node
 
 
-def create_n_to_n_dep(G1, G2, n, max_tries=10, seed=None):
+# methods used to pick the random links of dependency graphs
+# sequential links one node at a time, choosing partners among the ones left, and restarts from scratch on failure
+# stub_matching pairs the link ends of all the nodes at once (like the configuration model), and repairs duplicate
+# links with random swaps, this takes linear time in the number of links, but gives different links than sequential
+sampling_methods = ['sequential', 'stub_matching']
+
+
+# randomly pair the stubs (link ends) of left and right nodes, so that each left node gets left_deg links and each
+# right node gets right_deg links, without linking the same 2 nodes twice
+# a duplicate link is repaired by swapping its right end with the one of a random link, if this creates no duplicates
+# returns a list of (left node, right node) pairs
+def match_stubs(left_nodes, left_deg, right_nodes, right_deg, my_random, max_tries=10, max_swaps=100):
+    stub_cnt = len(left_nodes) * left_deg
+    if stub_cnt != len(right_nodes) * right_deg:
+        raise ValueError('The number of link ends of left nodes and right nodes must be the same')
+    if left_deg > len(right_nodes) or right_deg > len(left_nodes):
+        raise ValueError('Nodes need more links than there are nodes to link to')
+
+    left_stubs = [node for node in left_nodes for i in range(0, left_deg)]
+    for tries in range(0, max_tries):
+        right_stubs = [node for node in right_nodes for i in range(0, right_deg)]
+        my_random.shuffle(right_stubs)
+
+        # count how many times each link appears, and remember where duplicates are
+        link_cnts = {}
+        duplicates = []
+        for pos in range(0, stub_cnt):
+            link = (left_stubs[pos], right_stubs[pos])
+            if link in link_cnts:
+                link_cnts[link] += 1
+                duplicates.append(pos)
+            else:
+                link_cnts[link] = 1
+
+        repaired = True
+        for pos in duplicates:
+            node_l, node_r = left_stubs[pos], right_stubs[pos]
+            if link_cnts[(node_l, node_r)] == 1:  # already fixed by an earlier swap
+                continue
+            swapped = False
+            for swap_num in range(0, max_swaps):
+                other_pos = my_random.randrange(stub_cnt)
+                other_l, other_r = left_stubs[other_pos], right_stubs[other_pos]
+                # this also rejects swaps between links with the same left or right node
+                if (node_l, other_r) in link_cnts or (other_l, node_r) in link_cnts:
+                    continue
+                for link in [(node_l, node_r), (other_l, other_r)]:
+                    link_cnts[link] -= 1
+                    if link_cnts[link] == 0:
+                        del link_cnts[link]
+                link_cnts[(node_l, other_r)] = 1
+                link_cnts[(other_l, node_r)] = 1
+                right_stubs[pos], right_stubs[other_pos] = other_r, node_r
+                swapped = True
+                break
+            if swapped is False:
+                repaired = False
+                break
+
+        if repaired is True:
+            return list(zip(left_stubs, right_stubs))
+
+    raise RuntimeError('Could not pair the links of {} and {} nodes in {} attempts'.format(
+        len(left_nodes), len(right_nodes), max_tries))
+
+
+def create_n_to_n_dep(G1, G2, n, max_tries=10, seed=None, sampling='sequential'):
     if not isinstance(n, integer_types):
         raise TypeError("n is not an integer")
     elif n <= 0:
@@ -95,6 +166,8 @@ def create_n_to_n_dep(G1, G2, n, max_tries=10, seed=None):
     elif G2.number_of_nodes() % n != 0:
         raise ValueError("The number of nodes in network B is not divisible by {}, "
                          "cannot create a symmetric {}-to-{} dependency".format(n, n, n))
+    elif sampling not in sampling_methods:
+        raise ValueError('Invalid value for parameter "sampling": {}'.format(sampling))
 
     my_random = random.Random(seed)
 
@@ -102,6 +175,10 @@ def create_n_to_n_dep(G1, G2, n, max_tries=10, seed=None):
     Inter_G.add_nodes_from(G1.nodes(data=True))
     Inter_G.add_nodes_from(G2.nodes(data=True))
 
+    if sampling == 'stub_matching':
+        Inter_G.add_edges_from(match_stubs(sorted(G1.nodes()), n, sorted(G2.nodes()), n, my_random, max_tries))
+        return Inter_G
+
     tries = 0
     done = False
     while tries < max_tries and done is False:
@@ -139,7 +216,7 @@ def create_n_to_n_dep(G1, G2, n, max_tries=10, seed=None):
 
 
 # TODO: remove the "dependeds_from" stupidity
-def create_m_to_n_dep(G1, G2, m, n, arc_dir='dependeds_from', max_tries=10, seed=None):
+def create_m_to_n_dep(G1, G2, m, n, arc_dir='dependeds_from', max_tries=10, seed=None, sampling='sequential'):
     if not isinstance(n, integer_types):
         raise TypeError('n is not an integer')
     elif n <= 0:
@@ -154,6 +231,8 @@ def create_m_to_n_dep(G1, G2, m, n, arc_dir='dependeds_from', max_tries=10, seed
     elif G2.number_of_nodes() % m != 0:
         raise ValueError("The number of nodes in network B is not divisible by {}, "
                          "cannot create a symmetric {}-to-{} dependency".format(m, m, n))
+    elif sampling not in sampling_methods:
+        raise ValueError('Invalid value for parameter "sampling": {}'.format(sampling))
 
     my_random = random.Random(seed)
 
@@ -161,8 +240,24 @@ def create_m_to_n_dep(G1, G2, m, n, arc_dir='dependeds_from', max_tries=10, seed
     Inter_G.add_nodes_from(G1.nodes(data=True))
     Inter_G.add_nodes_from(G2.nodes(data=True))
 
-    tries = 0
-    done = False
+    # the number of links of the supported nodes is not constrained, so links never need to be repaired,
+    # picking the partners of each node is enough
+    if sampling == 'stub_matching':
+        nodes_a = sorted(G1.nodes())
+        nodes_b = sorted(G2.nodes())
+        if n > len(nodes_a) or m > len(nodes_b):
+            raise ValueError("Cannot create a {}-to-{} dependency, there are not enough nodes".format(m, n))
+        for node_b in nodes_b:
+            for node_a in my_random.sample(nodes_a, n):
+                Inter_G.add_edge(node_b, node_a)  # node_b supports node_a
+        for node_a in nodes_a:
+            for node_b in my_random.sample(nodes_b, m):
+                Inter_G.add_edge(node_a, node_b)  # node_a powers node_b
+        tries = 0
+        done = True
+    else:
+        tries = 0
+        done = False
     while tries < max_tries and done is False:
         failed = False
 
@@ -219,7 +314,7 @@ def create_m_to_n_dep(G1, G2, m, n, arc_dir='dependeds_from', max_tries=10, seed
 # com_access_pts is the number of relays a power node uses to access the communication network
 # TODO: add an option com_roles, remove the "dependeds_from" stupidity
 def create_k_to_n_dep(G1, G2, k, n, arc_dir='dependeds_from', power_roles=False, prefer_nearest=False, com_access_pts=1,
-                      max_tries=100, seed=None):
+                      max_tries=100, seed=None, sampling='sequential'):
     if not isinstance(k, integer_types):
         raise TypeError('k is not an integer')
     elif k <= 0:
@@ -234,6 +329,8 @@ def create_k_to_n_dep(G1, G2, k, n, arc_dir='dependeds_from', power_roles=False,
         raise ValueError('prefer_nearest is not a boolean')
     elif com_access_pts < 0:
         raise ValueError('com_access_pts is not a positive number')
+    elif sampling not in sampling_methods:
+        raise ValueError('Invalid value for parameter "sampling": {}'.format(sampling))
 
     my_random = random.Random(seed)
     nodes_G1 = sorted(G1.nodes())
@@ -259,43 +356,51 @@ def create_k_to_n_dep(G1, G2, k, n, arc_dir='dependeds_from', power_roles=False,
 
     if k * G1.number_of_nodes() != n * len(control_nodes):
         raise ValueError('Make sure that k * (number of power nodes) equals n * (number of controllers)')
-
-    if prefer_nearest is True:
-        distances = defaultdict(dict)
-        for node_a in nodes_G1:
-            for node_b in nodes_G2:
-                distance = math.hypot(G1.node[node_a]['x'] - G2.node[node_b]['x'],
-                                      G1.node[node_a]['y'] - G2.node[node_b]['y'])
-                distances[node_a][node_b] = distance
-                distances[node_b][node_a] = distance
+    if com_access_pts > len(relay_nodes):
+        raise ValueError('com_access_pts is larger than the number of relay nodes')
 
     tries = 0
     done = False
+    if prefer_nearest is False and sampling == 'stub_matching':
+        # every control center supports n power nodes, every power node is supported by k control centers
+        Inter_G.add_edges_from(match_stubs(control_nodes, n, nodes_G1, k, my_random, max_tries))
+        done = True
+
     while tries < max_tries and done is False:
         failed = False
-        unsaturated_a = list(nodes_G1)  # list of power nodes with less than n control centers supporting them
+
+        if prefer_nearest is True:
+            # index of the power nodes with less than k control centers supporting them, saturated nodes are removed
+            # nodes are inserted in sorted order, so that ties are won by the node that comes first
+            unsaturated_index = si.GridIndex.from_graph(G1, nodes_G1)
+        else:
+            unsaturated_a = list(nodes_G1)  # list of power nodes with less than k control centers supporting them
 
         # every control center of the communication network supports n nodes of the power grid
         for controller in control_nodes:
             if failed is True:
                 break
 
-            # find available_am the list of power nodes this control center can be linked to
             if prefer_nearest is True:
-                # sort available nodes based on their distance from the controller
-                available_a = sorted(unsaturated_a, key=lambda x: distances[controller][x])
-            else:
-                available_a = list(unsaturated_a)
+                # link the control center to the n nearest power nodes that still need support
+                nearest_a = unsaturated_index.k_nearest(G2.node[controller]['x'], G2.node[controller]['y'], n)
+                for node_a, distance in nearest_a:
+                    Inter_G.add_edge(controller, node_a)  # controller monitors node_a
+                    if Inter_G.in_degree(node_a) == k:
+                        unsaturated_index.remove(node_a)
+                if len(nearest_a) < n:
+                    failed = True
+                continue
+
+            # find available_a the list of power nodes this control center can be linked to
+            available_a = list(unsaturated_a)
 
             while Inter_G.out_degree(controller) < n:
                 if len(available_a) == 0:
                     failed = True
                     break
 
-                if prefer_nearest is True:
-                    node_a = available_a[0]
-                else:
-                    node_a = my_random.choice(available_a)
+                node_a = my_random.choice(available_a)
                 Inter_G.add_edge(controller, node_a)  # controller monitors node_a
                 available_a.remove(node_a)  # we don't want to link 2 times the same 2 nodes
 
@@ -318,36 +423,22 @@ def create_k_to_n_dep(G1, G2, k, n, arc_dir='dependeds_from', power_roles=False,
             other_nodes = distribution_subs
         else:
             other_nodes = nodes_G1
+        if len(other_nodes) == 0:
+            raise ValueError('There are no power nodes that can provide power to communication nodes')
+        other_index = si.GridIndex.from_graph(G1, other_nodes)
         for node in nodes_G2:
-            nearest_other = other_nodes[0]  # pick the first element to initialize the search
-            min_distance = distances[node][nearest_other]
-            for other_node in other_nodes:  # search for the closest node
-                distance = distances[node][other_node]
-                if distance < min_distance:
-                    nearest_other = other_node
-                    min_distance = distance
+            nearest_other = other_index.nearest(G2.node[node]['x'], G2.node[node]['y'])
             Inter_G.add_edge(nearest_other, node)  # the nearest appropriate power node provides the service
 
         # every power node needs to access a relay node
-        other_nodes = relay_nodes
+        relay_index = si.GridIndex.from_graph(G2, relay_nodes)
         for node in nodes_G1:
             if com_access_pts == 1:  # if only the nearest needs to be selected (faster code)
-                nearest_other = other_nodes[0]  # pick the first element to initialize the search
-                min_distance = distances[node][nearest_other]
-                for other_node in other_nodes:
-                    distance = distances[node][other_node]
-                    if distance < min_distance:
-                        nearest_other = other_node
-                        min_distance = distance
+                nearest_other = relay_index.nearest(G1.node[node]['x'], G1.node[node]['y'])
                 Inter_G.add_edge(nearest_other, node)  # the nearest relay provides the service
             else:  # if the n nearest need to be selected
-                dist_from_others = list()
-                for other_node in other_nodes:
-                    distance = distances[node][other_node]
-                    dist_from_others.append((distance, other_node))
-                dist_from_others.sort()
-                for i in range(0, com_access_pts):
-                    other_node = dist_from_others[i][1]
+                nearest_others = relay_index.k_nearest(G1.node[node]['x'], G1.node[node]['y'], com_access_pts)
+                for other_node, distance in nearest_others:
                     Inter_G.add_edge(other_node, node)  # the nearest relays provide the service
     else:
         # every communication node receives power from a single power node
@@ -379,46 +470,39 @@ def create_ranged_dep(G1, G2, radius):
 
     if radius <= 0:
         raise ValueError('radius is not a number larger than 0')
+    if G1.number_of_nodes() == 0 or G2.number_of_nodes() == 0:
+        raise ValueError('Both graphs need to have at least one node')
 
     Inter_G = nx.Graph()
 
     Inter_G.add_nodes_from(G1.nodes(data=True))
     Inter_G.add_nodes_from(G2.nodes(data=True))
-    free_nodes = G2.nodes()
 
-    for node_a in G1.nodes():
+    # nodes are inserted in sorted order, so that ties in distance are won by the node with the lowest id
+    index_a = si.GridIndex.from_graph(G1, sorted(G1.nodes()))
+    index_b = si.GridIndex.from_graph(G2, sorted(G2.nodes()))
 
-        # calc distances to all free nodes in the other network
-        distances = Q.PriorityQueue()
-        link_cnt = 0
-        for node_b in free_nodes:
-            dist = math.hypot(G1.node[node_a]['x'] - G2.node[node_b]['x'],
-                              G1.node[node_a]['y'] - G2.node[node_b]['y'])
-            distances.put((dist, node_b))
+    for node_a in G1.nodes():
+        x = G1.node[node_a]['x']
+        y = G1.node[node_a]['y']
 
-            if dist < radius:
-                Inter_G.add_edge(node_a, node_b)
-                link_cnt += 1
-                logger.debug('r link ' + node_a + ' ' + node_b)
+        # link to all the nodes in the other network that are in range
+        nodes_in_range = index_b.within_radius(x, y, radius)
+        for node_b, dist in nodes_in_range:
+            Inter_G.add_edge(node_a, node_b)
+            logger.debug('r link %s %s', node_a, node_b)
 
-        if link_cnt == 0:
-            node_b = distances.get()[1]  # pick the node with the lowest distance
+        if len(nodes_in_range) == 0:
+            node_b = index_b.nearest(x, y)  # pick the node with the lowest distance
             Inter_G.add_edge(node_a, node_b)
-            logger.debug('n link ' + node_a + ' ' + node_b)
+            logger.debug('n link %s %s', node_a, node_b)
 
     for node_b in G2.nodes():
 
         if len(Inter_G.neighbors(node_b)) == 0:
-            # calc distances to all free nodes in the other network
-            distances = Q.PriorityQueue()
-            for node_a in G1.nodes():
-                dist = math.hypot(G1.node[node_a]['x'] - G2.node[node_b]['x'],
-                                  G1.node[node_a]['y'] - G2.node[node_b]['y'])
-                distances.put((dist, node_a))
-
-            node_a = distances.get()[1]  # pick the node with the lowest distance
+            node_a = index_a.nearest(G2.node[node_b]['x'], G2.node[node_b]['y'])  # the node with the lowest distance
             Inter_G.add_edge(node_b, node_a)
-            logger.debug('n2 link ' + node_b + ' ' + node_a)
+            logger.debug('n2 link %s %s', node_b, node_a)
 
     return Inter_G
 
@@ -794,8 +878,12 @@ def clusterSmallWorld(n, avg_k, d_0, alpha, beta, q_rw, max_tries=20, deg_diff_t
 # max_tries is the maximum number of attempts at performing each step that could produce an invalid network
 # deg_diff_thresh is the maximum acceptable difference from the expected average degree in a subnetwork
 # seed is the seed used to initialize the random number generator
+# vectorized chooses the numpy implementation, much faster on large networks (see RT_nested_Smallworld_links)
+# processes is the number of processes used to create the subnets, 0 means one for each CPU
+# when processes is set, the seed of each subnet is derived from seed before creating them, so the result is the same
+# for any number of processes, but different from the one obtained when processes is None (the original behavior)
 def RT_nested_Smallworld(n, avg_k, d_0, alpha, beta, q_rw, subnet_cnt=None, max_tries=400, deg_diff_thresh=45,
-                         seed=None):
+                         seed=None, vectorized=False, processes=None):
     global logger
     my_random = random.Random(seed)
 
@@ -853,25 +941,53 @@ def RT_nested_Smallworld(n, avg_k, d_0, alpha, beta, q_rw, subnet_cnt=None, max_
 
     logger.debug('subnet_sizes = {}'.format(subnet_sizes))
 
-    subnets = []
-    for subnet_size in subnet_sizes:
+    if vectorized is True:
+        np_random = np.random.RandomState(my_random.randint(0, 4294967295))
+        src, dst, subnet_of = RT_nested_Smallworld_links(subnet_sizes, avg_k, d_0, alpha, beta, q_rw, max_tries,
+                                                         deg_diff_thresh, np_random)
+        G = nx.Graph()
+        G.add_nodes_from((node, {'subnet': subnet}) for node, subnet in enumerate(subnet_of.tolist()))
+        G.add_edges_from(zip(src.tolist(), dst.tolist()))
+        logger.info('RT_nested_Smallworld network successfully created')
+        return G
+
+    if processes is not None:
+        if processes < 0:
+            raise ValueError('processes is not a positive number')
+        elif processes == 0:
+            processes = multiprocessing.cpu_count()
+        subnet_seeds = [my_random.randint(0, sys.maxsize) for i in range(0, len(subnet_sizes))]
+        tasks = [(subnet_size, avg_k, d_0, alpha, beta, q_rw, max_tries, deg_diff_thresh, subnet_seed)
+                 for subnet_size, subnet_seed in zip(subnet_sizes, subnet_seeds)]
+        if processes == 1:
+            subnets = [create_connected_subnet(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                subnets = pool.map(create_connected_subnet, tasks, chunksize=max(1, len(tasks) // (processes * 4)))
+            finally:
+                pool.close()
+                pool.join()
+    else:
+        subnets = []
+        for subnet_size in subnet_sizes:
 
-        # make sure the generated sub-networks are connected
-        tries = 0
-        done = False
-        while not done and tries < max_tries:
-            # nice trick to provide the function with a random seed
-            subnet = clusterSmallWorld(subnet_size, avg_k, d_0, alpha, beta, q_rw, max_tries, deg_diff_thresh,
-                                       seed=my_random.randint(0, sys.maxsize))
-            if nx.is_connected(subnet):
-                subnets.append(subnet)
-                done = True
-            else:
-                tries += 1
+            # make sure the generated sub-networks are connected
+            tries = 0
+            done = False
+            while not done and tries < max_tries:
+                # nice trick to provide the function with a random seed
+                subnet = clusterSmallWorld(subnet_size, avg_k, d_0, alpha, beta, q_rw, max_tries, deg_diff_thresh,
+                                           seed=my_random.randint(0, sys.maxsize))
+                if nx.is_connected(subnet):
+                    subnets.append(subnet)
+                    done = True
+                else:
+                    tries += 1
 
-        if tries == max_tries:
-            raise RuntimeError("Could not generate a connected sub-network of size {} "
-                               "in {} attempts.".format(subnet_size, max_tries))
+            if tries == max_tries:
+                raise RuntimeError("Could not generate a connected sub-network of size {} "
+                                   "in {} attempts.".format(subnet_size, max_tries))
 
     # relabel sub-networks so their node ids are distinct and copy them to a single graph
     G = nx.empty_graph()
@@ -930,6 +1046,319 @@ def RT_nested_Smallworld(n, avg_k, d_0, alpha, beta, q_rw, subnet_cnt=None, max_
     return G
 
 
+# create a connected subnet for RT_nested_Smallworld, task is a tuple with the arguments of clusterSmallWorld
+# the seeds of the attempts are drawn from a generator initialized with the seed of the subnet, so that subnets can be
+# created in any order, or in different processes, and still be the same
+def create_connected_subnet(task):
+    subnet_size, avg_k, d_0, alpha, beta, q_rw, max_tries, deg_diff_thresh, subnet_seed = task
+    subnet_random = random.Random(subnet_seed)
+    for tries in range(0, max_tries):
+        subnet = clusterSmallWorld(subnet_size, avg_k, d_0, alpha, beta, q_rw, max_tries, deg_diff_thresh,
+                                   seed=subnet_random.randint(0, sys.maxsize))
+        if nx.is_connected(subnet):
+            return subnet
+
+    raise RuntimeError("Could not generate a connected sub-network of size {} "
+                       "in {} attempts.".format(subnet_size, max_tries))
+
+
+# The functions below implement the same model as clusterSmallWorld and RT_nested_Smallworld, working on all the
+# subnets at once with numpy arrays instead of building one subnet at a time with networkx.
+# Nodes are numbered consecutively, subnet after subnet, and links are stored as arrays of node pairs.
+# The random choices are drawn in a different order, so the same seed gives a different network than the
+# networkx implementation, but the distribution of the generated networks is the same.
+
+
+# ids of the nodes of the subnets with the given first nodes and sizes, concatenated
+def _subnet_node_ids(starts, sizes):
+    offsets = np.cumsum(sizes) - sizes
+    return np.arange(sizes.sum()) - np.repeat(offsets, sizes) + np.repeat(starts, sizes)
+
+
+# a key identifying each undirected link, the same for (u, v) and (v, u)
+def _link_keys(src, dst, node_cnt):
+    return np.minimum(src, dst).astype(np.int64) * node_cnt + np.maximum(src, dst)
+
+
+# true for each key in keys that is also in sorted_keys
+def _keys_in(keys, sorted_keys):
+    pos = np.searchsorted(sorted_keys, keys)
+    pos[pos == len(sorted_keys)] = 0
+    return (len(sorted_keys) > 0) & (sorted_keys[pos] == keys)
+
+
+# add the sorted keys new_keys to sorted_keys, keeping them sorted (faster than sorting everything again)
+def _insert_keys(sorted_keys, new_keys):
+    return np.insert(sorted_keys, np.searchsorted(sorted_keys, new_keys), new_keys)
+
+
+# link selection of clusterSmallWorld, each node tries to reach the degree drawn from a geometric distribution by
+# linking with random nodes at a distance up to d_0 on the ring of its subnet
+# returns the array local_links, local_links[node, d + d_0] is True if the node is linked to the node at distance d
+def _select_local_links(starts, sizes, avg_k, d_0, max_tries, deg_diff_thresh, np_random):
+    node_cnt = sizes.sum()
+    span = 2 * d_0
+    local_links = np.zeros((node_cnt, span + 1), dtype=bool)
+    degrees = np.zeros(node_cnt, dtype=np.int64)
+    k_vals = np.zeros(node_cnt, dtype=np.int64)
+
+    todo = np.arange(len(sizes))  # subnets still needing a link selection
+    tries = 0
+    while len(todo) > 0 and tries < max_tries:
+        # build the geometric distribution of node degrees, making sure it's feasible
+        to_draw = todo
+        tries_b = 0
+        while len(to_draw) > 0 and tries_b < max_tries:
+            nodes = _subnet_node_ids(starts[to_draw], sizes[to_draw])
+            k_vals[nodes] = np_random.geometric(1.0 / avg_k, len(nodes))
+            max_k_vals = np.maximum.reduceat(k_vals[nodes], np.cumsum(sizes[to_draw]) - sizes[to_draw])
+            to_draw = to_draw[max_k_vals > span]
+            tries_b += 1
+        if len(to_draw) > 0:
+            raise RuntimeError('Could not find a proper geometric distribution in {} attempts. '
+                               'd_0 is probably too low'.format(max_tries))
+
+        # nodes are visited in order, in all the subnets at the same time
+        for pos in range(0, sizes[todo].max()):
+            subnets = todo[sizes[todo] > pos]
+            nodes = starts[subnets] + pos
+            subnet_sizes = sizes[subnets]
+            k = k_vals[nodes]
+
+            # if the node already has enough links, move on to the next
+            needy = k >= degrees[nodes]
+            nodes, subnet_sizes, k = nodes[needy], subnet_sizes[needy], k[needy]
+
+            # randomly select k of the 2 * d_0 nodes in the neighborhood, without repetitions
+            order = np.argsort(np_random.random_sample((len(nodes), span)), axis=1)
+            chosen = np.arange(span) < k[:, np.newaxis]
+            rows = np.nonzero(chosen)[0]
+            cols = order[chosen]
+            dists = cols - d_0 + (cols >= d_0)  # distances in [-d_0, -1] and [1, d_0]
+            src = nodes[rows]
+            dst = src - pos + (pos + dists) % subnet_sizes[rows]
+
+            new = ~local_links[src, dists + d_0]
+            rows, src, dst, dists = rows[new], src[new], dst[new], dists[new]
+            local_links[src, dists + d_0] = True
+            local_links[dst, d_0 - dists] = True
+            degrees[nodes] += np.bincount(rows, minlength=len(nodes))
+            degrees[dst] += 1  # the targets chosen in a step are all different
+
+        # subnets whose average degree deviates too much from the expected one are considered a failure
+        nodes = _subnet_node_ids(starts[todo], sizes[todo])
+        avg_degs = np.add.reduceat(degrees[nodes], np.cumsum(sizes[todo]) - sizes[todo]) / sizes[todo].astype(float)
+        failed = np.abs(100.0 * (avg_degs - avg_k) / avg_k) > deg_diff_thresh
+        failed_nodes = _subnet_node_ids(starts[todo[failed]], sizes[todo[failed]])
+        local_links[failed_nodes] = False
+        degrees[failed_nodes] = 0
+        todo = todo[failed]
+        tries += 1
+
+    if len(todo) > 0:
+        raise RuntimeError('Could not operate an effective link selection in {} attempts. '
+                           'It can be difficult to assign edges randomly in a neighborhood and '
+                           'match the outcome of a geometric degree distribution.'.format(max_tries))
+
+    return local_links
+
+
+# select the clusters of nodes to rewire in each subnet, running a 2 state Markov chain along the nodes of the ring
+# returns an array with the cluster of each node (a cluster id unique among all subnets), -1 for nodes not rewired
+def _select_clusters(starts, sizes, alpha, beta, max_tries, np_random):
+    node_cnt = sizes.sum()
+    subnet_of = np.repeat(np.arange(len(sizes)), sizes)
+    states = np.zeros(node_cnt, dtype=bool)
+    cluster_of = np.full(node_cnt, -1, dtype=np.int64)
+
+    todo = np.arange(len(sizes))
+    tries = 0
+    while len(todo) > 0 and tries < max_tries:
+        states[starts[todo]] = True  # the first node will be rewired
+        for pos in range(1, sizes[todo].max()):
+            subnets = todo[sizes[todo] > pos]
+            nodes = starts[subnets] + pos
+            rnd = np_random.random_sample(len(nodes))
+            prev_states = states[nodes - 1]
+            states[nodes] = np.where(prev_states, rnd >= beta, rnd < alpha)
+
+        # number the runs of nodes in state 1 of each subnet, every run is a cluster
+        nodes = _subnet_node_ids(starts[todo], sizes[todo])
+        run_starts = states[nodes].copy()
+        not_first = np.ones(len(nodes), dtype=bool)
+        not_first[np.cumsum(sizes[todo]) - sizes[todo]] = False
+        run_starts[not_first] &= ~states[nodes[not_first] - 1]
+        run_ids = np.cumsum(run_starts)
+        first_run_ids = run_ids[np.cumsum(sizes[todo]) - sizes[todo]]
+        run_cnts = np.add.reduceat(run_starts.astype(np.int64), np.cumsum(sizes[todo]) - sizes[todo])
+
+        # if the first and the last cluster cover the ends of the ring, they are unified
+        last_nodes = starts[todo] + sizes[todo] - 1
+        wrapped = states[last_nodes] & (run_cnts > 1)
+        cluster_cnts = run_cnts - wrapped
+        last_run_ids = run_ids[np.cumsum(sizes[todo]) - 1]
+        node_subnets = np.repeat(np.arange(len(todo)), sizes[todo])
+        merged = wrapped[node_subnets] & (run_ids == last_run_ids[node_subnets])
+        run_ids[merged] = first_run_ids[node_subnets[merged]]
+        cluster_of[nodes] = np.where(states[nodes], run_ids, -1)
+
+        todo = todo[cluster_cnts < 2]
+        tries += 1
+
+    if len(todo) > 0:
+        raise RuntimeError('Could not select 2 node clusters to be rewired in {} attempts.'.format(max_tries))
+
+    # make cluster ids unique among subnets
+    cluster_of[cluster_of >= 0] += subnet_of[cluster_of >= 0] * node_cnt
+    return cluster_of
+
+
+# rewire the links inside a cluster to nodes of other clusters of the same subnet with probability q_rw
+# each link inside a cluster is visited from both its ends, first from the end that comes first, and the end it's
+# visited from is the one that keeps it when it's rewired, nodes do not get links to nodes they are already linked to
+# returns the arrays of the rewired links (src, dst)
+def _rewire_links(src, dst, starts, sizes, cluster_of, q_rw, max_tries, np_random):
+    node_cnt = sizes.sum()
+    subnet_of = np.repeat(np.arange(len(sizes)), sizes)
+
+    in_cluster = (cluster_of[src] >= 0) & (cluster_of[src] == cluster_of[dst])
+    first_ends = np.minimum(src, dst)
+    second_ends = np.maximum(src, dst)
+    rnd = np_random.random_sample((len(src), 2))
+    kept_ends = np.where(rnd[:, 0] < q_rw, first_ends, np.where(rnd[:, 1] < q_rw, second_ends, -1))
+    kept_ends[~in_cluster] = -1
+
+    # the nodes of each subnet that are part of a cluster, new targets are picked among these
+    clustered = np.nonzero(cluster_of >= 0)[0]
+    clustered_starts = np.searchsorted(clustered, starts)
+    clustered_cnts = np.searchsorted(clustered, starts + sizes) - clustered_starts
+
+    link_keys = np.sort(_link_keys(src, dst, node_cnt))
+    new_dst = np.full(len(src), -1, dtype=np.int64)
+    pending = np.nonzero(kept_ends >= 0)[0]
+    for attempt in range(0, max_tries):
+        if len(pending) == 0:
+            break
+        ends = kept_ends[pending]
+        subnets = subnet_of[ends]
+        picks = clustered_starts[subnets] + (np_random.random_sample(len(ends)) * clustered_cnts[subnets]).astype(
+            np.int64)
+        targets = clustered[picks]
+        keys = _link_keys(ends, targets, node_cnt)
+        usable = np.nonzero((cluster_of[targets] != cluster_of[ends]) & ~_keys_in(keys, link_keys))[0]
+        usable = usable[np.unique(keys[usable], return_index=True)[1]]  # do not link the same 2 nodes twice
+        new_dst[pending[usable]] = targets[usable]
+        if len(usable) > 0:
+            link_keys = _insert_keys(link_keys, keys[usable])
+        pending = np.delete(pending, usable)
+    # links whose end could not find an available target are not rewired
+
+    rewired = new_dst >= 0
+    src = np.where(rewired, kept_ends, src)
+    dst = np.where(rewired, new_dst, dst)
+    return src, dst
+
+
+# create the subnets of a RT_nested_Smallworld network with the given sizes, with the clusterSmallWorld model
+# returns the arrays of the links (src, dst), nodes are numbered consecutively, subnet after subnet
+def _cluster_small_world_links(sizes, avg_k, d_0, alpha, beta, q_rw, max_tries, deg_diff_thresh, np_random):
+    starts = np.cumsum(sizes) - sizes
+    local_links = _select_local_links(starts, sizes, avg_k, d_0, max_tries, deg_diff_thresh, np_random)
+
+    # each link is found in the columns of positive distances of one of its ends
+    src, dists = np.nonzero(local_links[:, d_0 + 1:])
+    dists += 1
+    subnet_of = np.repeat(np.arange(len(sizes)), sizes)
+    positions = src - starts[subnet_of[src]]
+    dst = starts[subnet_of[src]] + (positions + dists) % sizes[subnet_of[src]]
+
+    cluster_of = _select_clusters(starts, sizes, alpha, beta, max_tries, np_random)
+    return _rewire_links(src, dst.astype(np.int64), starts, sizes, cluster_of, q_rw, max_tries, np_random)
+
+
+# vectorized version of the construction of RT_nested_Smallworld, for the given subnet sizes
+# subnets are regenerated until they are connected, then they are linked in a ring, like in RT_nested_Smallworld
+# returns the arrays of the links (src, dst) and the array with the subnet of each node
+def RT_nested_Smallworld_links(subnet_sizes, avg_k, d_0, alpha, beta, q_rw, max_tries=400, deg_diff_thresh=45,
+                               np_random=None):
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    if not 0 <= alpha <= 1:
+        raise ValueError("Make sure that alpha is a number in [0, 1]")
+    elif not 0 <= beta <= 1:
+        raise ValueError("Make sure that beta is a number in [0, 1]")
+    elif not 0 <= q_rw <= 1:
+        raise ValueError("Make sure that q_rw is a number in [0, 1]")
+    if np_random is None:
+        np_random = np.random.RandomState()
+
+    sizes = np.array(subnet_sizes, dtype=np.int64)
+    if np.any(d_0 >= sizes / 2.0):
+        raise ValueError("Make sure d_0 < n/2")
+    node_cnt = sizes.sum()
+    starts = np.cumsum(sizes) - sizes
+    subnet_of = np.repeat(np.arange(len(sizes)), sizes)
+
+    # make sure the generated sub-networks are connected
+    src_parts = []
+    dst_parts = []
+    todo = np.arange(len(sizes))
+    tries = 0
+    while len(todo) > 0 and tries < max_tries:
+        todo_sizes = sizes[todo]
+        todo_cnt = todo_sizes.sum()
+        src, dst = _cluster_small_world_links(todo_sizes, avg_k, d_0, alpha, beta, q_rw, max_tries, deg_diff_thresh,
+                                              np_random)
+
+        # components never span 2 subnets, so a subnet is connected if its nodes are part of a single component
+        adj_matrix = coo_matrix((np.ones(len(src)), (src, dst)), shape=(todo_cnt, todo_cnt))
+        labels = connected_components(adj_matrix, directed=False)[1]
+        todo_subnet_of = np.repeat(np.arange(len(todo)), todo_sizes)
+        first_nodes = np.unique(labels, return_index=True)[1]
+        connected = np.bincount(todo_subnet_of[first_nodes], minlength=len(todo)) == 1
+
+        # renumber the nodes of the connected subnets with their final ids
+        keep = connected[todo_subnet_of[src]]
+        shifts = starts[todo] - (np.cumsum(todo_sizes) - todo_sizes)
+        src_parts.append(src[keep] + shifts[todo_subnet_of[src[keep]]])
+        dst_parts.append(dst[keep] + shifts[todo_subnet_of[dst[keep]]])
+
+        todo = todo[~connected]
+        tries += 1
+
+    if len(todo) > 0:
+        raise RuntimeError("Could not generate a connected sub-network of size {} "
+                           "in {} attempts.".format(sizes[todo[0]], max_tries))
+
+    # build lattice connections, rounded k links between random nodes of each subnet and the previous one
+    links_between_subnets = int(round(avg_k))
+    link_keys = np.sort(np.concatenate([_link_keys(src, dst, node_cnt) for src, dst in zip(src_parts, dst_parts)]))
+    prev_subnets = np.repeat(np.arange(len(sizes)) - 1, links_between_subnets) % len(sizes)
+    subnets = np.repeat(np.arange(len(sizes)), links_between_subnets)
+    pending = np.arange(len(subnets))
+    for attempt in range(0, max_tries):
+        if len(pending) == 0:
+            break
+        nodes = starts[prev_subnets[pending]] + (np_random.random_sample(len(pending)) *
+                                                 sizes[prev_subnets[pending]]).astype(np.int64)
+        other_nodes = starts[subnets[pending]] + (np_random.random_sample(len(pending)) *
+                                                  sizes[subnets[pending]]).astype(np.int64)
+        keys = _link_keys(nodes, other_nodes, node_cnt)
+        usable = np.nonzero(~_keys_in(keys, link_keys))[0]
+        usable = usable[np.unique(keys[usable], return_index=True)[1]]  # make sure the same couple is not linked twice
+        src_parts.append(nodes[usable])
+        dst_parts.append(other_nodes[usable])
+        if len(usable) > 0:
+            link_keys = _insert_keys(link_keys, keys[usable])
+        pending = np.delete(pending, usable)
+    if len(pending) > 0:
+        raise RuntimeError("Could not create {} unique links between 2 sub-networks "
+                           "in {} attempts.".format(links_between_subnets, max_tries))
+
+    return np.concatenate(src_parts), np.concatenate(dst_parts), subnet_of
+
+
 # centrality_by_node is a dictionary {'node': centrality score}
 # this function is used to rank nodes in a deterministic way, that is, if 2 nodes have the same score,
 # their IDs are compared and the one with the lowest ID comes first
@@ -939,85 +1368,395 @@ def rank_nodes_by_score(centrality_by_node):
     return ranked_nodes
 
 
-def save_graph_centralities(G, file_dir):
-    centrality_info = {}
-    percentile_pos = [20, 40, 60, 80]
+# number of pivots needed to estimate the normalized betweenness of all the nodes within the given absolute error,
+# with the given probability (Hoeffding bound on the pivot averages plus union bound on the nodes, see Brandes and
+# Pich, "Centrality estimation in large networks")
+def betweenness_samples_for_error(node_cnt, error, confidence=0.9):
+    if not 0 < error < 1:
+        raise ValueError('error is not a number in (0, 1)')
+    sample_cnt = int(math.ceil(math.log(2.0 * node_cnt / (1.0 - confidence)) / (2.0 * error ** 2)))
+    return min(sample_cnt, node_cnt)
 
-    node_cnt = G.number_of_nodes()
-    centrality_info['node_count'] = node_cnt
 
-    centr_by_node = nx.betweenness_centrality(G)
-    centrality_info['betweenness_centrality'] = centr_by_node
-    tot_centr = sum(centr_by_node.values())
-    centrality_info['total_betweenness_centrality'] = tot_centr
-    centr_rank = rank_nodes_by_score(centr_by_node)
-    centrality_info['betweenness_centrality_rank'] = centr_rank
-    centr_quintiles = np.percentile(centr_by_node.values(), percentile_pos).tolist()
-    centrality_info['betweenness_centrality_quintiles'] = centr_quintiles
+# estimate betweenness centrality using only sample_cnt random nodes (pivots) as sources of shortest paths
+# networkx seeds the global random generator to pick the pivots, so its state is restored afterwards
+def sampled_betweenness_centrality(G, sample_cnt, seed=None):
+    random_state = random.getstate()
+    try:
+        return nx.betweenness_centrality(G, k=sample_cnt, seed=seed)
+    finally:
+        random.setstate(random_state)
 
-    centr_by_node = nx.closeness_centrality(G)
-    centrality_info['closeness_centrality'] = centr_by_node
-    tot_centr = sum(centr_by_node.values())
-    centrality_info['total_closeness_centrality'] = tot_centr
-    centr_rank = rank_nodes_by_score(centr_by_node)
-    centrality_info['closeness_centrality_rank'] = centr_rank
-    centr_quintiles = np.percentile(centr_by_node.values(), percentile_pos).tolist()
-    centrality_info['closeness_centrality_quintiles'] = centr_quintiles
 
-    centr_by_node = nx.degree_centrality(G)
-    centrality_info['degree_centrality'] = centr_by_node
+# names of the centrality metrics saved for each graph, in the order they are saved
+# indegree and katz are only calculated for directed graphs
+graph_centrality_metrics = ['betweenness', 'closeness', 'degree', 'indegree', 'katz']
+
+
+def list_graph_centrality_metrics(G):
+    if G.is_directed():
+        return list(graph_centrality_metrics)
+    else:
+        return [metric for metric in graph_centrality_metrics if metric not in ['indegree', 'katz']]
+
+
+# the metrics to calculate for a centrality file, all the given ones, or only the ones a plan lists for that file
+# plan is a dictionary {centrality file name: [metric, ...]}, see centrality_planner
+def select_planned_metrics(metrics, plan, fname):
+    if plan is None:
+        return list(metrics)
+    planned = plan.get(fname, [])
+    return [metric for metric in metrics if metric in planned]
+
+
+# katz centrality is calculated either solving a dense linear system with numpy (exact, but it needs O(n^2) memory), or
+# with an iterative solver working on a sparse matrix
+katz_methods = ['numpy', 'sparse']
+
+
+# same as nx.katz_centrality_numpy, but the system (I - alpha * A^T) x = beta is solved with BiCGSTAB, a Krylov subspace
+# method that only multiplies the sparse adjacency matrix by vectors, until the relative residual is smaller than tol
+# it converges quickly when alpha is smaller than the reciprocal of the largest eigenvalue of the adjacency matrix,
+# that is, when Katz centrality is well defined, otherwise it may fail and raise a RuntimeError
+def sparse_katz_centrality(G, alpha=0.1, beta=1.0, tol=1e-10, max_iter=1000, weight='weight'):
+    nodes = G.nodes()
+    if len(nodes) == 0:
+        return {}
+    A = nx.to_scipy_sparse_matrix(G, nodelist=nodes, weight=weight, format='csr')
+    return csr_katz_centrality(nodes, A, alpha, beta, tol, max_iter)
+
+
+# A is the adjacency matrix of the graph, in CSR format, nodes the list of the nodes of its rows (and columns)
+def csr_katz_centrality(nodes, A, alpha=0.1, beta=1.0, tol=1e-10, max_iter=1000):
+    from scipy.sparse import identity
+    from scipy.sparse.linalg import bicgstab
+
+    M = (identity(len(nodes), format='csr') - alpha * A.T).tocsr()
+    b = np.ones(len(nodes)) * beta
+    centrality, info = bicgstab(M, b, x0=b, tol=tol, maxiter=max_iter, atol=0.0)
+    if info > 0:
+        raise RuntimeError('Katz centrality did not converge in {} iterations, alpha {} may be too large for this '
+                           'graph'.format(max_iter, alpha))
+    elif info < 0:
+        raise RuntimeError('Katz centrality could not be calculated, the system is ill-conditioned')
+
+    # normalize like networkx does
+    norm = np.sign(sum(centrality)) * np.linalg.norm(centrality)
+    return dict(zip(nodes, map(float, centrality / norm)))
+
+
+# returns the number of pivots to use to estimate betweenness, or None if it must be calculated exactly
+def resolve_betweenness_samples(node_cnt, betweenness_samples=None, betweenness_error=None):
+    if betweenness_samples is not None and betweenness_error is not None:
+        raise ValueError('Specify either betweenness_samples or betweenness_error, not both')
+    if betweenness_error is not None:
+        betweenness_samples = betweenness_samples_for_error(node_cnt, betweenness_error)
+    if betweenness_samples is not None and betweenness_samples <= 0:
+        raise ValueError('betweenness_samples is not a number larger than 0')
+    if betweenness_samples is not None and betweenness_samples >= node_cnt:
+        betweenness_samples = None
+    return betweenness_samples
+
+
+# centralities of a virtual union graph are calculated on its adjacency, without a copy of the union graph
+# katz is always calculated with the sparse solver, whatever katz_method is, since the union graphs are large
+def calc_union_centrality(U, metric, betweenness_samples=None, seed=None, nodes=None, katz_method='sparse'):
+    if katz_method not in katz_methods:
+        raise ValueError('Invalid katz_method: {}, valid values are {}'.format(katz_method, katz_methods))
+
+    if metric == 'betweenness':
+        return U.betweenness_centrality(betweenness_samples, seed)
+    elif metric == 'closeness':
+        return U.closeness_centrality(nodes)
+    elif metric == 'degree':
+        return U.degree_centrality()
+    elif metric == 'indegree':
+        return U.in_degree_centrality()
+    elif metric == 'katz':
+        union_nodes, adj = U.to_csr()
+        return csr_katz_centrality(union_nodes, adj)
+    else:
+        raise ValueError('Invalid centrality metric: {}'.format(metric))
+
+
+# calculate a centrality metric for the nodes of G, as a dictionary node -> centrality score
+# nodes can be used to calculate closeness only for some nodes, since the score of each node is independent
+def calc_graph_centrality(G, metric, betweenness_samples=None, seed=None, nodes=None, katz_method='numpy'):
+    if isinstance(G, uv.UnionView):
+        return calc_union_centrality(G, metric, betweenness_samples, seed, nodes, katz_method)
+
+    if metric == 'betweenness':
+        if betweenness_samples is None:
+            return nx.betweenness_centrality(G)
+        else:
+            return sampled_betweenness_centrality(G, betweenness_samples, seed)
+    elif metric == 'closeness':
+        if nodes is None:
+            return nx.closeness_centrality(G)
+        else:
+            return {node: nx.closeness_centrality(G, u=node) for node in nodes}
+    elif metric == 'degree':
+        return nx.degree_centrality(G)
+    elif metric == 'indegree':
+        return nx.in_degree_centrality(G)
+    elif metric == 'katz':
+        if katz_method == 'numpy':
+            return nx.katz_centrality_numpy(G)
+        elif katz_method == 'sparse':
+            return sparse_katz_centrality(G)
+        else:
+            raise ValueError('Invalid katz_method: {}, valid values are {}'.format(katz_method, katz_methods))
+    else:
+        raise ValueError('Invalid centrality metric: {}'.format(metric))
+
+
+# add the score of each node, their total, the nodes ranked by score and the quintiles of the scores of a metric
+def add_centrality_info(centrality_info, centr_name, centr_by_node):
+    percentile_pos = [20, 40, 60, 80]
+    centrality_info[centr_name] = centr_by_node
     tot_centr = sum(centr_by_node.values())
-    centrality_info['total_degree_centrality'] = tot_centr
+    centrality_info['total_' + centr_name] = tot_centr
     centr_rank = rank_nodes_by_score(centr_by_node)
-    centrality_info['degree_centrality_rank'] = centr_rank
+    centrality_info[centr_name + '_rank'] = centr_rank
     centr_quintiles = np.percentile(centr_by_node.values(), percentile_pos).tolist()
-    centrality_info['degree_centrality_quintiles'] = centr_quintiles
+    centrality_info[centr_name + '_quintiles'] = centr_quintiles
 
-    if G.is_directed():
-        centr_by_node = nx.in_degree_centrality(G)
-        centrality_info['indegree_centrality'] = centr_by_node
-        tot_centr = sum(centr_by_node.values())
-        centrality_info['total_indegree_centrality'] = tot_centr
-        centr_rank = rank_nodes_by_score(centr_by_node)
-        centrality_info['indegree_centrality_rank'] = centr_rank
-        centr_quintiles = np.percentile(centr_by_node.values(), percentile_pos).tolist()
-        centrality_info['indegree_centrality_quintiles'] = centr_quintiles
-
-        centr_by_node = nx.katz_centrality_numpy(G)
-        centrality_info['katz_centrality'] = centr_by_node
-        tot_centr = sum(centr_by_node.values())
-        centrality_info['total_katz_centrality'] = tot_centr
-        centr_rank = rank_nodes_by_score(centr_by_node)
-        centrality_info['katz_centrality_rank'] = centr_rank
-        centr_quintiles = np.percentile(centr_by_node.values(), percentile_pos).tolist()
-        centrality_info['katz_centrality_quintiles'] = centr_quintiles
-
-    file_name = 'node_centrality_{}.json'.format(G.graph['name'])
+
+# centr_by_metric is a dictionary metric -> dictionary node -> centrality score, for the metrics of the graph
+# the seed and katz_method used are saved too, so that missing metrics can be calculated later in the same way
+# (katz centrality of a virtual union graph is always calculated with the sparse solver)
+def build_graph_centrality_info(G, centr_by_metric, betweenness_samples=None, seed=None, katz_method='numpy'):
+    if isinstance(G, uv.UnionView):
+        katz_method = 'sparse'
+    centrality_info = {}
+    node_cnt = G.number_of_nodes()
+    centrality_info['node_count'] = node_cnt
+    centrality_info['seed'] = seed
+    centrality_info['katz_method'] = katz_method
+    if betweenness_samples is None:
+        centrality_info['betweenness_centrality_mode'] = 'exact'
+        centrality_info['betweenness_centrality_samples'] = node_cnt
+    else:
+        centrality_info['betweenness_centrality_mode'] = 'sampled'
+        centrality_info['betweenness_centrality_samples'] = betweenness_samples
+    for metric in list_graph_centrality_metrics(G):
+        if metric in centr_by_metric:
+            add_centrality_info(centrality_info, metric + '_centrality', centr_by_metric[metric])
+    return centrality_info
+
+
+def write_centrality_info(centrality_info, file_dir, file_name):
     file_path = os.path.join(file_dir, file_name)
     with open(file_path, 'wb') as centr_file:
         json.dump(centrality_info, centr_file)
 
 
+# betweenness centrality is exact unless betweenness_samples (number of pivots) or betweenness_error (acceptable
+# absolute error, converted to a number of pivots) are specified, the mode and the number of pivots used are saved
+# katz_method is one of katz_methods, if plan is specified, only the metrics it lists for the graph are calculated
+def save_graph_centralities(G, file_dir, betweenness_samples=None, betweenness_error=None, seed=None,
+                            katz_method='numpy', plan=None):
+    betweenness_samples = resolve_betweenness_samples(G.number_of_nodes(), betweenness_samples, betweenness_error)
+    centr_fname = 'node_centrality_{}.json'.format(G.graph['name'])
+    centr_by_metric = {}
+    for metric in select_planned_metrics(list_graph_centrality_metrics(G), plan, centr_fname):
+        centr_by_metric[metric] = calc_graph_centrality(G, metric, betweenness_samples, seed, katz_method=katz_method)
+    centrality_info = build_graph_centrality_info(G, centr_by_metric, betweenness_samples, seed, katz_method)
+    write_centrality_info(centrality_info, file_dir, centr_fname)
+
+
+# counts the node-disjoint paths from a source node to other nodes of G, that is, the largest number of paths that have
+# no node in common, apart from their first and last node
+# this is the maximum flow in a network where each node, apart from the source, is split in an "in" and an "out" part,
+# linked by an arc with capacity 1, so that a node can be used by a single path, and each link is an arc with
+# capacity 1 from the "out" part of a node to the "in" part of the other
+# the network is built once, and reused to count the paths to each target
+class NodeDisjointPathCounter(object):
+    def __init__(self, G, source):
+        if not G.has_node(source):
+            raise ValueError('The source node {} is not in the graph'.format(source))
+        self.source = source
+        self.residual = {(source, 'out'): {}}  # residual capacity of each arc, residual[u][v]
+
+        for node in G.nodes():
+            if node != source:
+                self._add_arc((node, 'in'), (node, 'out'))
+        for u, v in G.edges():
+            self._add_arc((u, 'out'), (v, 'in'))
+            if not G.is_directed():
+                self._add_arc((v, 'out'), (u, 'in'))
+
+    def _add_arc(self, u, v):
+        residual = self.residual
+        if u not in residual:
+            residual[u] = {}
+        if v not in residual:
+            residual[v] = {}
+        residual[u][v] = residual[u].get(v, 0) + 1
+        if u not in residual[v]:
+            residual[v][u] = 0  # reverse arc, used to cancel flow
+
+    # find a path with residual capacity from the source to sink, returns its arcs, or None if there is none
+    def _find_augmenting_path(self, sink):
+        residual = self.residual
+        start = (self.source, 'out')
+        pred = {start: None}
+        queue = [start]
+        i = 0
+        while i < len(queue):
+            u = queue[i]
+            i += 1
+            for v, capacity in residual[u].items():
+                if capacity > 0 and v not in pred:
+                    pred[v] = u
+                    if v == sink:
+                        arcs = []
+                        while pred[v] is not None:
+                            arcs.append((pred[v], v))
+                            v = pred[v]
+                        return arcs
+                    queue.append(v)
+        return None
+
+    def count(self, target):
+        if target == self.source:
+            raise ValueError('The target node is the source node')
+        sink = (target, 'in')
+        if sink not in self.residual:
+            raise ValueError('The target node {} is not in the graph'.format(target))
+
+        # every augmenting path carries one unit of flow, a path, along arcs with capacity 1
+        used_arcs = []
+        path_cnt = 0
+        arcs = self._find_augmenting_path(sink)
+        while arcs is not None:
+            for u, v in arcs:
+                self.residual[u][v] -= 1
+                self.residual[v][u] += 1
+            used_arcs.extend(arcs)
+            path_cnt += 1
+            arcs = self._find_augmenting_path(sink)
+
+        # restore the capacities, so that the network can be used for the next target
+        for u, v in used_arcs:
+            self.residual[u][v] += 1
+            self.residual[v][u] -= 1
+
+        return path_cnt
+
+
 # count the number of node-disjoint paths between two nodes
 def count_node_disjoint_paths(G, source, target):
-    paths_cnt = 0
-    temp_G = G.copy()
-    # special case if source and target are linked
-    if temp_G.has_edge(source, target):
-        paths_cnt += 1
-        temp_G.remove_edge(source, target)
-    try:
-        # find path between src_node and dst_node
-        # increment counter
-        # remove all nodes in the path from the graph
-        # restart
-        while True:
-            path = nx.shortest_path(temp_G, source, target)
-            paths_cnt += 1
-            path_nodes = path[1:-1]  # exclude source and target
-            temp_G.remove_nodes_from(path_nodes)
-    except nx.NetworkXNoPath:
-        return paths_cnt
+    return NodeDisjointPathCounter(G, source).count(target)
+
+
+# for each power node, count the node-disjoint paths from the node to each of the controllers supporting it, through
+# the relays it uses to access the communication network
+# power nodes can only be at the end of paths, they do not forward communications
+# returns a dictionary power node -> dictionary controller -> number of node-disjoint paths
+def calc_controller_disjoint_paths(A, B, I):
+    # paths are searched starting from the controllers, so the arcs of B (if directed) are reversed
+    H = nx.DiGraph()
+    H.add_nodes_from(B.nodes())
+    H.add_edges_from((v, u) for u, v in B.edges())
+    if not B.is_directed():
+        H.add_edges_from(B.edges())
+
+    support_ccs_by_node = {}
+    for node_a in A.nodes():
+        H.add_node(node_a)
+        support_ccs_by_node[node_a] = []
+        for node_b in I.successors(node_a):
+            if B.node[node_b]['role'] == 'relay':
+                H.add_edge(node_b, node_a)  # the relay gives node_a access to the communication network
+            elif B.node[node_b]['role'] == 'controller':
+                support_ccs_by_node[node_a].append(node_b)
+            else:
+                raise RuntimeError('Node in B with unrecognized role')
+
+    supported_by_cc = {}
+    for node_a in support_ccs_by_node:
+        for controller in support_ccs_by_node[node_a]:
+            supported_by_cc.setdefault(controller, []).append(node_a)
+
+    path_cnts_by_node = {node_a: {} for node_a in A.nodes()}
+    for controller in supported_by_cc:
+        counter = NodeDisjointPathCounter(H, controller)
+        for node_a in supported_by_cc[controller]:
+            path_cnts_by_node[node_a][controller] = counter.count(node_a)
+
+    return path_cnts_by_node
+
+
+# save the node-disjoint path counts between power nodes and their controllers, and the smallest count of each power
+# node, an indicator of how many relay failures it can survive before losing contact with a controller
+def save_controller_disjoint_paths(A, B, I, file_dir):
+    percentile_pos = [20, 40, 60, 80]
+    path_cnts_by_node = calc_controller_disjoint_paths(A, B, I)
+    min_path_cnt_by_node = {}
+    for node_a in path_cnts_by_node:
+        if len(path_cnts_by_node[node_a]) > 0:
+            min_path_cnt_by_node[node_a] = min(path_cnts_by_node[node_a].values())
+        else:
+            min_path_cnt_by_node[node_a] = 0
+
+    path_info = {}
+    path_info['controller_disjoint_paths'] = path_cnts_by_node
+    path_info['min_controller_disjoint_paths'] = min_path_cnt_by_node
+    min_path_cnts = list(min_path_cnt_by_node.values())
+    path_info['avg_min_controller_disjoint_paths'] = float(sum(min_path_cnts)) / len(min_path_cnts)
+    path_info['min_controller_disjoint_paths_quintiles'] = np.percentile(min_path_cnts, percentile_pos).tolist()
+
+    file_path = os.path.join(file_dir, 'controller_disjoint_paths.json')
+    with open(file_path, 'wb') as paths_file:
+        json.dump(path_info, paths_file)
+
+
+# count the shortest paths from a group of source nodes to target, each source has a weight, the number of paths
+# starting from it is multiplied by it (weight_by_source is a dictionary source -> weight)
+# uses a single breadth-first search from target, accumulating the weights of the sources like in Brandes' algorithm,
+# instead of listing the shortest paths, whose number can grow exponentially
+# returns the weighted number of paths, and a dictionary node -> weighted number of paths passing through the node
+# (the sources at the start of the paths are included, sources that can not reach target are ignored)
+def count_weighted_shortest_paths(G, target, weight_by_source):
+    if G.is_directed():
+        neighbors = G.predecessors_iter  # paths go from the sources to target, so we search backwards
+    else:
+        neighbors = G.neighbors_iter
+
+    dist = {target: 0}
+    path_cnts = {target: 1}  # number of shortest paths between each node and target
+    preds = {target: []}  # neighbors of each node that are one step closer to target
+    visit_order = [target]
+    i = 0
+    while i < len(visit_order):
+        node = visit_order[i]
+        i += 1
+        for other_node in neighbors(node):
+            if other_node not in dist:
+                dist[other_node] = dist[node] + 1
+                path_cnts[other_node] = 0
+                preds[other_node] = []
+                visit_order.append(other_node)
+            if dist[other_node] == dist[node] + 1:
+                path_cnts[other_node] += path_cnts[node]
+                preds[other_node].append(node)
+
+    # weighted number of shortest paths from the sources to each node, going towards target
+    # a shortest path from a source passes through a node as many times as there are shortest paths between the node
+    # and target, so the paths passing through a node are the product of the 2 numbers
+    weighted_cnts = dict.fromkeys(visit_order, 0)
+    total_cnt = 0
+    cnt_by_node = {}
+    for node in reversed(visit_order):
+        if node in weight_by_source:
+            weighted_cnts[node] += weight_by_source[node]
+            total_cnt += weight_by_source[node] * path_cnts[node]
+        for pred in preds[node]:
+            weighted_cnts[pred] += weighted_cnts[node]
+        cnt_by_node[node] = weighted_cnts[node] * path_cnts[node]
+
+    return total_cnt, cnt_by_node
 
 
 def calc_relay_betweenness(A, B, I):
@@ -1037,8 +1776,8 @@ def calc_relay_betweenness(A, B, I):
     for relay in relays:
         hits_by_relay[relay] = 0
 
-    # how many times a node is dependent on the couple (relay, node)
-    relay_controller_dep_cnt = {}
+    # how many times a node is dependent on the couple (relay, controller), grouped by controller
+    controller_relay_dep_cnt = {}
 
     for node_a in A.nodes():
         support_relays = []
@@ -1052,34 +1791,26 @@ def calc_relay_betweenness(A, B, I):
             else:
                 raise RuntimeError('Node in B with unrecognized role')
 
-        for relay in support_relays:
-            if relay not in relay_controller_dep_cnt:
-                relay_controller_dep_cnt[relay] = {}
+        for controller in support_ccs:
+            if controller not in controller_relay_dep_cnt:
+                controller_relay_dep_cnt[controller] = {}
 
-            for controller in support_ccs:
-                if controller not in relay_controller_dep_cnt[relay]:
-                    relay_controller_dep_cnt[relay][controller] = 0
-                relay_controller_dep_cnt[relay][controller] += 1
+            for relay in support_relays:
+                if relay not in controller_relay_dep_cnt[controller]:
+                    controller_relay_dep_cnt[controller][relay] = 0
+                controller_relay_dep_cnt[controller][relay] += 1
 
+    # count the shortest paths between the relays and the control centers, each path counts as many times as the
+    # dependencies on its (relay, controller) couple
     shortest_path_cnt = 0
-    for relay in relay_controller_dep_cnt:
-        # find all shortest paths between this relay and the relevant control centers
-        for controller in relay_controller_dep_cnt[relay]:
-            dep_cnt = relay_controller_dep_cnt[relay][controller]  # dependencies on current (relay, controller) couple
-            try:
-                paths = list(nx.all_shortest_paths(B, relay, controller))
-            except nx.NetworkXNoPath:
-                continue
-
-            shortest_path_cnt += len(paths) * dep_cnt
-
-            for path in paths:
-                for node in path:
-                    if B.node[node]['role'] == 'relay':
-                        hits_by_relay[node] += dep_cnt
+    for controller in controller_relay_dep_cnt:
+        path_cnt, path_cnt_by_node = count_weighted_shortest_paths(B, controller, controller_relay_dep_cnt[controller])
+        shortest_path_cnt += path_cnt
+        for node in path_cnt_by_node:
+            if B.node[node]['role'] == 'relay':
+                hits_by_relay[node] += path_cnt_by_node[node]
 
-    print('hits_by_relay {}'.format(hits_by_relay))
-    print('shortest_path_cnt {}'.format(shortest_path_cnt))
+    logger.debug('relay betweenness, shortest_path_cnt = {}'.format(shortest_path_cnt))
     betw_by_relay = {}
     for relay in relays:
         betw_by_relay[relay] = sf.percent_of_part(hits_by_relay[relay], shortest_path_cnt)
@@ -1128,26 +1859,17 @@ def calc_transm_subst_betweenness(A, B, I):
     for transm_sub in transm_subs:
         hits_by_transm_sub[transm_sub] = 0
 
+    # count the shortest paths between the distribution substations and the generators, each path counts as many times
+    # as the nodes dependent on its distribution substation
     shortest_path_cnt = 0
-    for distr_sub in distr_sub_dep_cnt:
-        dep_cnt = distr_sub_dep_cnt[distr_sub]
-
-        # find all shortest paths between this distribution substation and the generators
-        for generator in generators:
-            try:
-                paths = list(nx.all_shortest_paths(A, distr_sub, generator))
-            except nx.NetworkXNoPath:
-                continue
-
-            shortest_path_cnt += len(paths) * dep_cnt
-
-            for path in paths:
-                for node in path:
-                    if A.node[node]['role'] == 'transmission_substation':
-                        hits_by_transm_sub[node] += dep_cnt
-
-    print('hits_by_transm_sub {}'.format(hits_by_transm_sub))
-    print('shortest_path_cnt {}'.format(shortest_path_cnt))
+    for generator in generators:
+        path_cnt, path_cnt_by_node = count_weighted_shortest_paths(A, generator, distr_sub_dep_cnt)
+        shortest_path_cnt += path_cnt
+        for node in path_cnt_by_node:
+            if A.node[node]['role'] == 'transmission_substation':
+                hits_by_transm_sub[node] += path_cnt_by_node[node]
+
+    logger.debug('transmission substation betweenness, shortest_path_cnt = {}'.format(shortest_path_cnt))
     betw_by_transm_sub = {}
     for transm_sub in transm_subs:
         betw_by_transm_sub[transm_sub] = sf.percent_of_part(hits_by_transm_sub[transm_sub], shortest_path_cnt)
@@ -1164,9 +1886,21 @@ def calc_transm_subst_betweenness(A, B, I):
     return betw_by_node
 
 
-def save_misc_centralities(A, B, I, file_dir):
+# names of the centrality metrics saved in the misc file, they depend on the 3 graphs A, B and I
+misc_centrality_metrics = ['relay_betweenness', 'transm_subst_betweenness']
+
+
+def calc_misc_centrality(A, B, I, metric):
+    if metric == 'relay_betweenness':
+        return calc_relay_betweenness(A, B, I)
+    elif metric == 'transm_subst_betweenness':
+        return calc_transm_subst_betweenness(A, B, I)
+    else:
+        raise ValueError('Invalid misc centrality metric: {}'.format(metric))
+
+
+def build_misc_centrality_info(A, B, centr_by_metric):
     centrality_info = {}
-    percentile_pos = [20, 40, 60, 80]
 
     node_count_by_role = {'generator': 0, 'transmission_substation': 0, 'distribution_substation': 0,
                           'controller': 0, 'relay': 0}
@@ -1181,28 +1915,337 @@ def save_misc_centralities(A, B, I, file_dir):
         node_count = node_count_by_role[node_role]
         centrality_info[node_role + '_count'] = node_count
 
-    centr_by_node = calc_relay_betweenness(A, B, I)
-    centrality_info['relay_betweenness_centrality'] = centr_by_node
-    tot_centr = sum(centr_by_node.values())
-    centrality_info['total_relay_betweenness_centrality'] = tot_centr
-    centr_rank = rank_nodes_by_score(centr_by_node)
-    centrality_info['relay_betweenness_centrality_rank'] = centr_rank
-    centr_quintiles = np.percentile(centr_by_node.values(), percentile_pos)
-    centrality_info['relay_betweenness_centrality_quintiles'] = centr_quintiles.tolist()
+    for metric in misc_centrality_metrics:
+        if metric in centr_by_metric:
+            add_centrality_info(centrality_info, metric + '_centrality', centr_by_metric[metric])
+    return centrality_info
 
-    centr_by_node = calc_transm_subst_betweenness(A, B, I)
-    centrality_info['transm_subst_betweenness_centrality'] = centr_by_node
-    tot_centr = sum(centr_by_node.values())
-    centrality_info['total_transm_subst_betweenness_centrality'] = tot_centr
-    centr_rank = rank_nodes_by_score(centr_by_node)
-    centrality_info['transm_subst_betweenness_centrality_rank'] = centr_rank
-    centr_quintiles = np.percentile(centr_by_node.values(), percentile_pos)
-    centrality_info['transm_subst_betweenness_centrality_quintiles'] = centr_quintiles.tolist()
 
-    file_name = 'node_centrality_misc.json'
-    file_path = os.path.join(file_dir, file_name)
-    with open(file_path, 'wb') as centr_file:
-        json.dump(centrality_info, centr_file)
+def save_misc_centralities(A, B, I, file_dir, plan=None):
+    centr_by_metric = {}
+    for metric in select_planned_metrics(misc_centrality_metrics, plan, 'node_centrality_misc.json'):
+        centr_by_metric[metric] = calc_misc_centrality(A, B, I, metric)
+    centrality_info = build_misc_centrality_info(A, B, centr_by_metric)
+    write_centrality_info(centrality_info, file_dir, 'node_centrality_misc.json')
+
+
+# the graphs used by the processes calculating centralities, set when each process starts
+_centrality_graphs = None
+
+
+def _init_centrality_worker(graphs):
+    global _centrality_graphs
+    _centrality_graphs = graphs
+
+
+# job is a tuple (graph index or 'misc', metric, nodes, betweenness_samples, seed, katz_method)
+# scores are returned as a list of (node, score) pairs, in the order of the dictionary they were calculated in
+def _calc_centrality_job(job):
+    graph_idx, metric, nodes, betweenness_samples, seed, katz_method = job
+    if graph_idx == 'misc':
+        A, B, I = _centrality_graphs['misc']
+        centr_by_node = calc_misc_centrality(A, B, I, metric)
+    else:
+        centr_by_node = calc_graph_centrality(_centrality_graphs[graph_idx], metric, betweenness_samples, seed, nodes,
+                                              katz_method)
+    return graph_idx, metric, list(centr_by_node.items())
+
+
+# same as calling save_graph_centralities for each graph in graphs, and save_misc_centralities if misc_graphs is a
+# tuple (A, B, I), but the (graph, metric) pairs are calculated in a pool of processes, and closeness, whose score
+# is independent for each node, is also split by source node among the processes
+# betweenness is not split, because summing partial scores would change the rounding of the results
+# the saved files are the same as the ones saved calculating metrics one after another, json files list scores in
+# the order of the dictionaries they are calculated in, so scores are kept in ordered dictionaries, and closeness
+# scores calculated in parts are put in a dictionary in the same order networkx would use
+# if plan is specified, only the metrics it lists are calculated
+def save_centralities_parallel(graphs, file_dir, misc_graphs=None, processes=0, betweenness_samples=None,
+                               betweenness_error=None, seed=None, katz_method='numpy', plan=None):
+    if processes < 0:
+        raise ValueError('processes is not a positive number')
+    elif processes == 0:
+        processes = multiprocessing.cpu_count()
+
+    worker_graphs = dict(enumerate(graphs))
+    if misc_graphs is not None:
+        worker_graphs['misc'] = misc_graphs
+
+    samples_by_graph = {}
+    jobs = []
+    for graph_idx, G in enumerate(graphs):
+        samples_by_graph[graph_idx] = resolve_betweenness_samples(G.number_of_nodes(), betweenness_samples,
+                                                                  betweenness_error)
+        centr_fname = 'node_centrality_{}.json'.format(G.graph['name'])
+        for metric in select_planned_metrics(list_graph_centrality_metrics(G), plan, centr_fname):
+            if metric == 'closeness' and processes > 1:
+                nodes = G.nodes()
+                chunk_size = int(math.ceil(1.0 * len(nodes) / processes))
+                for i in range(0, len(nodes), chunk_size):
+                    jobs.append((graph_idx, metric, nodes[i:i + chunk_size], None, seed, katz_method))
+            else:
+                jobs.append((graph_idx, metric, None, samples_by_graph[graph_idx], seed, katz_method))
+    if misc_graphs is not None:
+        for metric in select_planned_metrics(misc_centrality_metrics, plan, 'node_centrality_misc.json'):
+            jobs.append(('misc', metric, None, None, seed, katz_method))
+
+    # start with the slowest jobs, so that processes are not left waiting for a single long job at the end
+    job_costs = {'betweenness': 0, 'relay_betweenness': 0, 'transm_subst_betweenness': 0, 'closeness': 1, 'katz': 2}
+    jobs.sort(key=lambda job: job_costs.get(job[1], 3))
+
+    centr_by_metric_by_graph = {}
+    if processes == 1:
+        _init_centrality_worker(worker_graphs)
+        try:
+            results = [_calc_centrality_job(job) for job in jobs]
+        finally:
+            _init_centrality_worker(None)
+    else:
+        pool = multiprocessing.Pool(processes, _init_centrality_worker, (worker_graphs,))
+        try:
+            results = pool.map(_calc_centrality_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    closeness_parts = {}
+    for graph_idx, metric, centr_items in results:
+        centr_by_metric = centr_by_metric_by_graph.setdefault(graph_idx, {})
+        if metric == 'closeness' and processes > 1:
+            closeness_parts.setdefault(graph_idx, {}).update(centr_items)
+        else:
+            centr_by_metric[metric] = OrderedDict(centr_items)
+    for graph_idx in closeness_parts:
+        centr_by_node = {}
+        for node in graphs[graph_idx].nodes():
+            centr_by_node[node] = closeness_parts[graph_idx][node]
+        centr_by_metric_by_graph[graph_idx]['closeness'] = centr_by_node
+
+    for graph_idx, G in enumerate(graphs):
+        centrality_info = build_graph_centrality_info(G, centr_by_metric_by_graph.get(graph_idx, {}),
+                                                      samples_by_graph[graph_idx], seed, katz_method)
+        write_centrality_info(centrality_info, file_dir, 'node_centrality_{}.json'.format(G.graph['name']))
+    if misc_graphs is not None:
+        centrality_info = build_misc_centrality_info(misc_graphs[0], misc_graphs[1],
+                                                     centr_by_metric_by_graph.get('misc', {}))
+        write_centrality_info(centrality_info, file_dir, 'node_centrality_misc.json')
+
+
+# algorithms used to find the maximum matching of the inter graph
+# blossom works on any graph, hopcroft_karp only on bipartite graphs, like the inter graph, but it is much faster
+max_matching_algorithms = ['blossom', 'hopcroft_karp']
+
+
+# find a maximum cardinality matching of the bipartite graph G, with the Hopcroft-Karp algorithm, O(E * sqrt(V))
+# left_nodes are the nodes of one of the 2 sides of the graph, no link must connect 2 of them
+# each phase finds, with a breadth-first search from the unmatched left nodes, the length of the shortest augmenting
+# paths, then augments the matching along a maximal set of disjoint paths of that length, found with depth-first
+# searches, the searches are iterative to avoid recursion limits on large graphs
+# returns a dictionary with an entry for each matched node, mapping it to its mate, like nx.max_weight_matching
+def hopcroft_karp_matching(G, left_nodes):
+    left_nodes = list(left_nodes)
+    mate = {}
+    while True:
+        # label the left nodes with their distance from an unmatched left node, alternating unmatched and matched links
+        dist = {}
+        queue = []
+        for node in left_nodes:
+            if node not in mate:
+                dist[node] = 0
+                queue.append(node)
+        path_len = None  # number of left nodes in the shortest augmenting paths
+        i = 0
+        while i < len(queue):
+            node = queue[i]
+            i += 1
+            if path_len is not None and dist[node] >= path_len:
+                break
+            for neighbor in G.neighbors_iter(node):
+                neighbor_mate = mate.get(neighbor)
+                if neighbor_mate is None:
+                    if path_len is None:
+                        path_len = dist[node] + 1
+                elif neighbor_mate not in dist:
+                    dist[neighbor_mate] = dist[node] + 1
+                    queue.append(neighbor_mate)
+        if path_len is None:
+            break
+
+        # follow the labels to find augmenting paths, nodes that lead to no unmatched node are marked as dead (-1)
+        for root in left_nodes:
+            if root in mate or dist.get(root) != 0:
+                continue
+            stack = [root]
+            right_path = []  # the right node chosen for each left node in the stack
+            neighbor_iters = {root: G.neighbors_iter(root)}
+            while len(stack) > 0:
+                node = stack[-1]
+                next_node = None
+                for neighbor in neighbor_iters[node]:
+                    neighbor_mate = mate.get(neighbor)
+                    if neighbor_mate is None:
+                        if dist[node] + 1 == path_len:
+                            right_path.append(neighbor)
+                            break
+                    elif dist.get(neighbor_mate) == dist[node] + 1:
+                        next_node = neighbor_mate
+                        right_path.append(neighbor)
+                        break
+                else:
+                    dist[node] = -1
+                    stack.pop()
+                    if len(right_path) > 0:
+                        right_path.pop()
+                    continue
+                if next_node is None:  # found an unmatched right node, flip the links along the path
+                    for left_node, right_node in zip(stack, right_path):
+                        mate[left_node] = right_node
+                        mate[right_node] = left_node
+                    break
+                stack.append(next_node)
+                neighbor_iters[next_node] = G.neighbors_iter(next_node)
+
+    return mate
+
+
+# a GraphMLReader that returns graphs as they are read from the file, as multigraphs
+# GraphMLReader sets its multigraph attribute if it finds parallel edges, and converts graphs without them to simple
+# graphs, here the attribute always reads True, so graphs are not converted, and the value set is kept aside
+class RawGraphMLReader(GraphMLReader):
+    @property
+    def multigraph(self):
+        return True
+
+    @multigraph.setter
+    def multigraph(self, value):
+        self.parallel_edges = value
+
+
+# keeps the user defined graphs read from GraphML files, so that instances sharing the same base graphs read each file
+# only once, the graphs kept are never modified, each request gets a new graph
+# graphs are kept before being converted to simple graphs, and converted for each request, exactly like
+# nx.read_graphml does, so the graphs returned are the same as the ones read from the files, node order included
+# if stream is True, files are read with the streaming reader, and the graphs kept are the ones it returns
+class UserGraphCache(object):
+    def __init__(self):
+        self.parsed_by_fpath = {}  # file path -> (graph as read from the file, True if it has to be copied as it is)
+
+    def read_graphml(self, fpath, stream=False):
+        fpath = os.path.abspath(fpath)
+        if fpath not in self.parsed_by_fpath and stream is True:
+            self.parsed_by_fpath[fpath] = (gs.read_graphml(fpath, node_type=str), True)
+        elif fpath not in self.parsed_by_fpath:
+            reader = RawGraphMLReader(node_type=str)
+            G = list(reader(path=fpath))[0]
+            self.parsed_by_fpath[fpath] = (G, reader.parallel_edges)
+
+        G, copy_as_is = self.parsed_by_fpath[fpath]
+        if copy_as_is is True:
+            return G.copy()
+        elif G.is_directed():
+            return nx.DiGraph(G)
+        else:
+            return nx.Graph(G)
+
+
+# read a user defined graph, from the cache, if one is given
+# if stream is True, the file is read with the streaming reader of graphml_stream, it needs much less memory
+def read_user_graph(fpath, user_graphs=None, stream=False):
+    if user_graphs is not None:
+        return user_graphs.read_graphml(fpath, stream)
+    elif stream is True:
+        return gs.read_graphml(fpath, node_type=str)
+    else:
+        return nx.read_graphml(fpath, node_type=str)
+
+
+# export a graph of the instance, if stream is True, the file is written with the streaming writer of graphml_stream,
+# the file is the same, but the writer needs no memory besides the graph
+def write_graph(G, fpath, stream=False):
+    if stream is True:
+        gs.write_graphml(G, fpath)
+    else:
+        nx.write_graphml(G, fpath)
+
+
+# options that do not change the files of an instance, they are not part of its hash
+instance_hash_excluded_opts = {'misc': ['instance_cache_dir', 'stream_graphml', 'layout_cache_dir']}
+
+
+# the source files of the modules used to create instances
+def list_creator_source_fpaths():
+    fpaths = []
+    for module in [sys.modules[__name__], sf, si, uv, gs, nr, lc]:
+        fpaths.append(os.path.splitext(os.path.abspath(module.__file__))[0] + '.py')
+    return fpaths
+
+
+# a hash of everything that determines the files of an instance: its build options, the files they refer to (user
+# defined graphs, preassigned roles, etc.) and the code creating it, the paths section is not part of it
+def calc_instance_hash(config):
+    sha1 = hashlib.sha1()
+    for section in ['build_a', 'build_b', 'build_inter', 'misc']:
+        if not config.has_section(section):
+            continue
+        excluded_opts = instance_hash_excluded_opts.get(section, [])
+        for opt_name in sorted(config.options(section)):
+            if opt_name in excluded_opts:
+                continue
+            value = config.get(section, opt_name)
+            sha1.update('{}.{}={}\n'.format(section, opt_name, value).encode('utf-8'))
+            if opt_name.endswith('_fpath') and os.path.isfile(value):
+                sha1.update(sf.hash_file(value).encode('utf-8'))
+    for fpath in list_creator_source_fpaths():
+        sha1.update(sf.hash_file(fpath).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def read_instance_hash(conf_fpath):
+    config = ConfigParser()
+    config.read(conf_fpath)
+    return calc_instance_hash(config)
+
+
+# hard link the files of src_dir into dst_dir, or copy them if they can't be linked (e.g. on different file systems)
+def link_files(src_dir, dst_dir):
+    for fname in os.listdir(src_dir):
+        src_fpath = os.path.join(src_dir, fname)
+        if os.path.isfile(src_fpath):
+            dst_fpath = os.path.join(dst_dir, fname)
+            try:
+                os.link(src_fpath, dst_fpath)
+            except (AttributeError, OSError):  # os.link is not available on Windows with Python 2
+                shutil.copy2(src_fpath, dst_fpath)
+
+
+# if the cache has a complete instance with the given hash, link its files into output_dir and return True
+def fetch_cached_instance(cache_dir, instance_hash, output_dir):
+    cached_dir = os.path.join(cache_dir, instance_hash)
+    if not sf.check_manifest(cached_dir, {'instance_hash': instance_hash}):
+        return False
+    link_files(cached_dir, output_dir)
+    return True
+
+
+# add the instance in output_dir, with its manifest, to the cache, replacing a cached instance that was damaged
+# the instance is first linked into a temporary directory, so other processes never see incomplete instances
+def store_cached_instance(cache_dir, instance_hash, output_dir):
+    sf.ensure_dir_exists(cache_dir)
+    cached_dir = os.path.join(cache_dir, instance_hash)
+    if os.path.exists(cached_dir):
+        if sf.check_manifest(cached_dir, {'instance_hash': instance_hash}):
+            return
+        shutil.rmtree(cached_dir)
+    temp_dir = '{}.tmp_{}'.format(cached_dir, os.getpid())
+    sf.makedirs_clean(temp_dir, True, False)
+    link_files(output_dir, temp_dir)
+    try:
+        os.rename(temp_dir, cached_dir)
+    except OSError:  # another process cached the same instance in the meantime
+        shutil.rmtree(temp_dir)
+
+
+# renderers used to draw the networks of an instance, networkx draws through networkx (slow on large instances),
+# fast draws each layer as a single matplotlib collection (see netw_renderer)
+graph_renderers = ['networkx', 'fast']
 
 
 def all_positions_defined(G, excluded=[]):
@@ -1218,7 +2261,9 @@ def all_positions_defined(G, excluded=[]):
     return not undefined_pos_found
 
 
-def run(conf_fpath):
+# ask_confirmation is used when the output directory is not empty, set it to False when running unattended
+# user_graphs is an optional UserGraphCache, used to share user defined graphs among instances
+def run(conf_fpath, ask_confirmation=True, user_graphs=None):
     global logger
     logger.info('conf_fpath = ' + conf_fpath)
 
@@ -1249,7 +2294,32 @@ def run(conf_fpath):
     logger.info('output_dir = {}'.format(output_dir))
 
     # create directory if it does not exist, otherwise ask the user whether to empty it or not
-    sf.makedirs_clean(output_dir, True, True)
+    sf.makedirs_clean(output_dir, True, ask_confirmation)
+
+    # instances are stamped with a hash of their configuration and of the code creating them, in their manifest
+    # if a cache of instances is used, an instance with the same hash is reused, instead of being created again
+    instance_hash = calc_instance_hash(config)
+    if config.has_option('misc', 'instance_cache_dir'):
+        instance_cache_dir = os.path.abspath(os.path.normpath(config.get('misc', 'instance_cache_dir')))
+        if fetch_cached_instance(instance_cache_dir, instance_hash, output_dir) is True:
+            logger.info('Instance {} found in cache, its files were linked to the output directory'.format(
+                instance_hash))
+            return
+    else:
+        instance_cache_dir = None
+
+    # spring layouts are saved in this directory, and reused by instances with graphs of the same structure
+    if config.has_option('misc', 'layout_cache_dir'):
+        layout_cache_dir = os.path.abspath(os.path.normpath(config.get('misc', 'layout_cache_dir')))
+    else:
+        layout_cache_dir = None
+
+    # user defined graphs can be read, and the graphs of the instance written, streaming their files, it takes much
+    # less memory on large graphs
+    if config.has_option('misc', 'stream_graphml'):
+        stream_graphml = config.getboolean('misc', 'stream_graphml')
+    else:
+        stream_graphml = False
 
     # create the power network
 
@@ -1298,13 +2368,22 @@ def run(conf_fpath):
             subnet_cnt = config.getint('build_a', 'subnets')
         else:
             subnet_cnt = None
-        A = RT_nested_Smallworld(node_cnt, avg_k, d_0, alpha, beta, q_rw, subnet_cnt, seed=netw_a_seed)
+        if config.has_option('build_a', 'vectorized'):
+            vectorized = config.getboolean('build_a', 'vectorized')
+        else:
+            vectorized = False
+        if config.has_option('build_a', 'processes'):
+            processes = config.getint('build_a', 'processes')
+        else:
+            processes = None
+        A = RT_nested_Smallworld(node_cnt, avg_k, d_0, alpha, beta, q_rw, subnet_cnt, seed=netw_a_seed,
+                                 vectorized=vectorized, processes=processes)
     elif netw_a_model == 'user_defined_graph':
         user_graph_fpath_a = config.get('build_a', 'user_graph_fpath')
         if os.path.isabs(user_graph_fpath_a) is False:
             user_graph_fpath_a = os.path.abspath(user_graph_fpath_a)
         if os.path.splitext(user_graph_fpath_a)[1].lower() == '.graphml':
-            A = nx.read_graphml(user_graph_fpath_a, node_type=str)
+            A = read_user_graph(user_graph_fpath_a, user_graphs, stream_graphml)
         else:
             raise ValueError('Unsupported file format for "user_graph_fpath" of network A, unsupported format')
     else:
@@ -1348,7 +2427,7 @@ def run(conf_fpath):
     if config.has_option('build_a', 'layout'):
         if netw_a_model == 'user_defined_graph':
             logger.warning('Specifying a graph layout will override node positions specified in user defined graph A')
-        arrange_nodes(A, config, 'build_a')
+        arrange_nodes(A, config, 'build_a', seed, layout_cache_dir)
 
     # create the communication network
 
@@ -1386,7 +2465,7 @@ def run(conf_fpath):
         if os.path.isabs(user_graph_fpath_b) is False:
             user_graph_fpath_b = os.path.abspath(user_graph_fpath_b)
         if os.path.splitext(user_graph_fpath_b)[1].lower() == '.graphml':
-            B = nx.read_graphml(user_graph_fpath_b, node_type=str)
+            B = read_user_graph(user_graph_fpath_b, user_graphs, stream_graphml)
         else:
             raise ValueError('Invalid value for parameter "user_graph_fpath" of network B, unsupported format')
     else:
@@ -1479,7 +2558,7 @@ def run(conf_fpath):
     if config.has_option('build_b', 'layout'):
         if netw_b_model == 'user_defined_graph':
             logger.warning('Specifying a graph layout will override node positions specified in user defined graph B')
-        arrange_nodes(B, config, 'build_b')
+        arrange_nodes(B, config, 'build_b', seed, layout_cache_dir)
 
     if roles_b == 'relay_attached_controllers':
         # if we need to assign a position to controllers, we need to know the perimeter of the network
@@ -1532,16 +2611,9 @@ def run(conf_fpath):
             for controller in controllers:
                 B.add_edge(controller, my_random.choice(relays))
         elif controller_attachment == 'prefer_nearest':
+            relay_index = si.GridIndex.from_graph(B, relays)
             for controller in controllers:
-                closest = relays[0]
-                shortest_dist = math.hypot(B.node[controller]['x'] - B.node[closest]['x'],
-                                           B.node[controller]['y'] - B.node[closest]['y'])
-                for relay in relays:
-                    dist = math.hypot(B.node[controller]['x'] - B.node[relay]['x'],
-                                      B.node[controller]['y'] - B.node[relay]['y'])
-                    if dist < shortest_dist:
-                        shortest_dist = dist
-                        closest = relay
+                closest = relay_index.nearest(B.node[controller]['x'], B.node[controller]['y'])
                 B.add_edge(controller, closest)
 
     # create the interdependency network
@@ -1556,15 +2628,21 @@ def run(conf_fpath):
     if prefer_nearest is True and dep_model not in ['k-to-n', 'k_to_n', 'kton', 'k-n']:
         raise ValueError('The option prefer_nearest is currently only available for the k-n model')
 
+    # how random dependency links are picked, see sampling_methods
+    if config.has_option('build_inter', 'sampling'):
+        sampling = config.get('build_inter', 'sampling')
+    else:
+        sampling = 'sequential'
+
     if dep_model in ['1-to-1', '1_to_1', '1to1']:
-        I = create_n_to_n_dep(A, B, 1, seed=seed)
+        I = create_n_to_n_dep(A, B, 1, seed=seed, sampling=sampling)
     elif dep_model in ['n-to-n', 'n_to_n', 'nton']:
         n = config.getint('build_inter', 'n')
-        I = create_n_to_n_dep(A, B, n, seed=seed)
+        I = create_n_to_n_dep(A, B, n, seed=seed, sampling=sampling)
     elif dep_model in ['m-to-n', 'm_to_n', 'mton']:
         m = config.getint('build_inter', 'm')
         n = config.getint('build_inter', 'n')
-        I = create_m_to_n_dep(A, B, m, n, seed=seed)
+        I = create_m_to_n_dep(A, B, m, n, seed=seed, sampling=sampling)
         for node in A.nodes():
             A.node[node]['role'] = 'power'
     elif dep_model in ['k-to-n', 'k_to_n', 'kton', 'k-n']:
@@ -1580,10 +2658,10 @@ def run(conf_fpath):
             com_access_points = 1
         if roles_a != 'same':
             I = create_k_to_n_dep(A, B, k, n, prefer_nearest=prefer_nearest, power_roles=True,
-                                  com_access_pts=com_access_points, seed=seed)
+                                  com_access_pts=com_access_points, seed=seed, sampling=sampling)
         else:
             I = create_k_to_n_dep(A, B, k, n, prefer_nearest=prefer_nearest, power_roles=False,
-                                  com_access_pts=com_access_points, seed=seed)
+                                  com_access_pts=com_access_points, seed=seed, sampling=sampling)
     elif dep_model == 'ranged':
         radius = config.getfloat('build_inter', 'radius')
         I = create_ranged_dep(A, B, radius)
@@ -1601,9 +2679,9 @@ def run(conf_fpath):
 
     # export network graphs
 
-    nx.write_graphml(A, os.path.join(output_dir, netw_a_name + '.graphml'))
-    nx.write_graphml(B, os.path.join(output_dir, netw_b_name + '.graphml'))
-    nx.write_graphml(I, os.path.join(output_dir, netw_inter_name + '.graphml'))
+    write_graph(A, os.path.join(output_dir, netw_a_name + '.graphml'), stream_graphml)
+    write_graph(B, os.path.join(output_dir, netw_b_name + '.graphml'), stream_graphml)
+    write_graph(I, os.path.join(output_dir, netw_inter_name + '.graphml'), stream_graphml)
 
     # produce and export additional network graphs (maximum matching, union, etc.)
 
@@ -1620,17 +2698,38 @@ def run(conf_fpath):
             mm_I.add_node(node, {'network': A.graph['name']})
         for node in B.nodes():
             mm_I.add_node(node, {'network': B.graph['name']})
-        matching_edge_dict = nx.max_weight_matching(I.to_undirected())
+        if config.has_option('build_inter', 'max_matching_algorithm'):
+            max_matching_algorithm = config.get('build_inter', 'max_matching_algorithm')
+        else:
+            max_matching_algorithm = 'blossom'
+        if max_matching_algorithm == 'blossom':
+            matching_edge_dict = nx.max_weight_matching(I.to_undirected())
+        elif max_matching_algorithm == 'hopcroft_karp':
+            matching_edge_dict = hopcroft_karp_matching(I.to_undirected(), A.nodes())
+        else:
+            raise ValueError('Invalid value for parameter "max_matching_algorithm" of build_inter: {}, '
+                             'valid values are {}'.format(max_matching_algorithm, max_matching_algorithms))
         matching_adjlist = list(matching_edge_dict.items())
         mm_I.add_edges_from(matching_adjlist)
-        nx.write_graphml(mm_I, os.path.join(output_dir, max_matching_name + '.graphml'))
+        write_graph(mm_I, os.path.join(output_dir, max_matching_name + '.graphml'), stream_graphml)
 
     if config.has_option('misc', 'produce_ab_union'):
         produce_union = config.getboolean('misc', 'produce_ab_union')
     else:
         produce_union = False
 
-    if produce_union is True:
+    # a virtual union graph is not saved, it's only used to calculate centralities, simulations can recreate it
+    # (the centralities are the same, but random choices on the nodes of the union are not, see union_view)
+    if config.has_option('misc', 'ab_union_mode'):
+        ab_union_mode = config.get('misc', 'ab_union_mode')
+        if ab_union_mode not in ['graph', 'virtual']:
+            raise ValueError('Invalid value for parameter "ab_union_mode" of misc: {}'.format(ab_union_mode))
+    else:
+        ab_union_mode = 'graph'
+
+    if produce_union is True and ab_union_mode == 'virtual':
+        ab_union = uv.UnionView(A, B, I, config.get('misc', 'ab_union_name'))
+    elif produce_union is True:
         ab_union_name = config.get('misc', 'ab_union_name')
         # create directed copies of A, B and I, add their edges to an empty directed graph,
         # do not use the nx.compose function to create this graph, it's bugged!
@@ -1644,7 +2743,7 @@ def run(conf_fpath):
             ab_union.node[node]['network'] = A.graph['name']
         for node in B.nodes():
             ab_union.node[node]['network'] = B.graph['name']
-        nx.write_graphml(ab_union, os.path.join(output_dir, ab_union_name + '.graphml'))
+        write_graph(ab_union, os.path.join(output_dir, ab_union_name + '.graphml'), stream_graphml)
 
     # precalculate various centrality metrics for nodes in the graph
 
@@ -1659,22 +2758,104 @@ def run(conf_fpath):
     else:
         calc_node_centrality = False
 
-    if calc_node_centrality is True:
-        save_graph_centralities(A, output_dir)
-        save_graph_centralities(B, output_dir)
-        save_graph_centralities(I, output_dir)
+    # betweenness can be estimated by sampling, either with a number of pivots or with an acceptable error
+    if config.has_option('misc', 'betweenness_samples'):
+        betweenness_samples = config.getint('misc', 'betweenness_samples')
+    else:
+        betweenness_samples = None
+    if config.has_option('misc', 'betweenness_error'):
+        betweenness_error = config.getfloat('misc', 'betweenness_error')
+    else:
+        betweenness_error = None
+
+    # katz centrality can be calculated with a sparse iterative solver, needed for large directed graphs
+    if config.has_option('misc', 'katz_method'):
+        katz_method = config.get('misc', 'katz_method')
+        if katz_method not in katz_methods:
+            raise ValueError('Invalid value for parameter "katz_method" of misc: {}, valid values are {}'.format(
+                katz_method, katz_methods))
+    else:
+        katz_method = 'numpy'
+
+    # only the centralities listed in a plan can be calculated, the others are calculated by simulations if needed
+    if config.has_option('misc', 'centrality_plan_fpath'):
+        with open(config.get('misc', 'centrality_plan_fpath'), 'r') as plan_file:
+            centrality_plan = json.load(plan_file)
+    else:
+        centrality_plan = None
+    centr_kwargs = {'betweenness_samples': betweenness_samples, 'betweenness_error': betweenness_error, 'seed': seed,
+                    'katz_method': katz_method, 'plan': centrality_plan}
+
+    # centralities can be calculated in a pool of processes, 0 means one for each CPU
+    if config.has_option('misc', 'centrality_processes'):
+        centrality_processes = config.getint('misc', 'centrality_processes')
+    else:
+        centrality_processes = None
+
+    if calc_node_centrality is True and centrality_processes is not None:
+        centr_graphs = [A, B, I]
+        if produce_max_matching is True:
+            centr_graphs.append(mm_I)
+        if produce_union is True:
+            centr_graphs.append(ab_union)
         if calc_misc_centralities is True:
-            save_misc_centralities(A, B, I, output_dir)
+            misc_graphs = (A, B, I)
+        else:
+            misc_graphs = None
+            logger.info('Only basic centrality metrics were calculated')
+        save_centralities_parallel(centr_graphs, output_dir, misc_graphs, centrality_processes, **centr_kwargs)
+    elif calc_node_centrality is True:
+        save_graph_centralities(A, output_dir, **centr_kwargs)
+        save_graph_centralities(B, output_dir, **centr_kwargs)
+        save_graph_centralities(I, output_dir, **centr_kwargs)
+        if calc_misc_centralities is True:
+            save_misc_centralities(A, B, I, output_dir, centrality_plan)
         else:
             logger.info('Only basic centrality metrics were calculated')
         if produce_max_matching is True:
-            save_graph_centralities(mm_I, output_dir)
+            save_graph_centralities(mm_I, output_dir, **centr_kwargs)
         if produce_union is True:
-            save_graph_centralities(ab_union, output_dir)
+            save_graph_centralities(ab_union, output_dir, **centr_kwargs)
+
+    # count the node-disjoint paths between each power node and the controllers supporting it
+    if config.has_option('misc', 'calc_controller_disjoint_paths'):
+        calc_controller_paths = config.getboolean('misc', 'calc_controller_disjoint_paths')
+        if calc_controller_paths is True and (roles_a == 'same' or roles_b == 'same'):
+            logger.warning('Cannot count disjoint paths to controllers if a graph has parameter "roles" set to "same".')
+            calc_controller_paths = False
+    else:
+        calc_controller_paths = False
+
+    if calc_controller_paths is True:
+        save_controller_disjoint_paths(A, B, I, output_dir)
 
     # draw networks
 
-    if not all_positions_defined(A) or not all_positions_defined(B):
+    if config.has_option('misc', 'draw_graphs'):
+        draw_graphs = config.getboolean('misc', 'draw_graphs')
+    else:
+        draw_graphs = True
+
+    if config.has_option('misc', 'graph_renderer'):
+        graph_renderer = config.get('misc', 'graph_renderer')
+        if graph_renderer not in graph_renderers:
+            raise ValueError('Invalid value for parameter "graph_renderer" of misc: {}, valid values are {}'.format(
+                graph_renderer, graph_renderers))
+    else:
+        graph_renderer = 'networkx'
+
+    # drawing can be left to a separate job, running netw_renderer on the instance once it's created
+    if config.has_option('misc', 'defer_drawing'):
+        defer_drawing = config.getboolean('misc', 'defer_drawing')
+    else:
+        defer_drawing = False
+
+    if draw_graphs is False:
+        logger.info('Graphs will not be drawn')
+    elif defer_drawing is True:
+        logger.info('Graphs will not be drawn now, to draw them run\npython netw_renderer.py {} {} {} {}'.format(
+            output_dir, netw_a_name, netw_b_name, netw_inter_name))
+    elif not all_positions_defined(A) or not all_positions_defined(B):
         logger.warning('Some nodes do not have an assigned position. Graph will not be draw')
     else:
         # shifts used to position the drawings of the network graphs respective to the plot
@@ -1697,11 +2878,30 @@ def run(conf_fpath):
         # values for the named parameters of networkx.networkx_draw_labels
         draw_labels_kwargs = {'font_size': 4}
 
-        sf.paint_netw_graphs(A, B, I, node_col_by_role, 'r', 'b', x_shift_a, y_shift_a, x_shift_b, y_shift_b, stretch,
-                             False, draw_nodes_kwargs, draw_edges_kwargs, draw_labels_kwargs)
-
-        plt.axis('off')
-        netw_plot_fpath = os.path.join(output_dir, '_full.pdf')
-        plt.savefig(netw_plot_fpath, bbox_inches="tight")
+        if graph_renderer == 'fast':
+            # layers with more items than this are rasterized, and edges above draw_max_edges are sampled
+            if config.has_option('misc', 'draw_rasterize_above'):
+                rasterize_above = config.getint('misc', 'draw_rasterize_above')
+            else:
+                rasterize_above = 10000
+            if config.has_option('misc', 'draw_max_edges'):
+                max_edges = config.getint('misc', 'draw_max_edges')
+            else:
+                max_edges = None
+            nr.render_netw_graphs(A, B, I, node_col_by_role, 'r', 'b', x_shift_a, y_shift_a, x_shift_b, y_shift_b,
+                                  stretch, draw_nodes_kwargs['node_size'], draw_edges_kwargs['width'],
+                                  draw_edges_kwargs['alpha'], rasterize_above, max_edges, seed)
+            netw_plot_fpath = os.path.join(output_dir, '_full.pdf')
+            nr.save_plot(netw_plot_fpath)
+        else:
+            sf.paint_netw_graphs(A, B, I, node_col_by_role, 'r', 'b', x_shift_a, y_shift_a, x_shift_b, y_shift_b,
+                                 stretch, False, draw_nodes_kwargs, draw_edges_kwargs, draw_labels_kwargs)
+            plt.axis('off')
+            netw_plot_fpath = os.path.join(output_dir, '_full.pdf')
+            plt.savefig(netw_plot_fpath, bbox_inches="tight")
         logger.info('Network plot saved here\n{}'.format(netw_plot_fpath))
         plt.close()  # free memory
+
+    sf.write_manifest(output_dir, {'instance_hash': instance_hash})
+    if instance_cache_dir is not None:
+        store_cached_instance(instance_cache_dir, instance_hash, output_dir)
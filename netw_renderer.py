@@ -0,0 +1,179 @@
+import os
+import sys
+import random
+import logging
+import numpy as np
+import matplotlib.pyplot as plt
+import graphml_stream as gs
+import layout_cache as lc
+from matplotlib.collections import LineCollection
+
+__author__ = 'Agostino Sturaro'
+
+# Draws the networks of an instance like shared_functions.paint_netw_graphs, but each layer (the edges of a graph, the
+# inter edges towards nodes with the same role, the nodes of a graph) becomes a single matplotlib collection, built
+# from arrays of coordinates, instead of going through the networkx drawing functions.
+# Layers with many items can be rasterized, so that PDFs of large instances stay small and quick to open, and edges
+# can be sampled when a layer has too many of them to be readable anyway.
+# Arrows are not drawn, inter edges are still told apart by the color of the role of their target node.
+# Instances can also be drawn after being created, e.g. by a background job, running this module as a script
+# Usage: python netw_renderer.py netw_dir netw_a_name netw_b_name netw_inter_name [max_edges]
+
+logger = logging.getLogger(__name__)
+
+default_node_col_by_role = {'power': 'r', 'generator': 'r', 'transmission_substation': 'plum',
+                            'distribution_substation': 'magenta', 'communication': 'dodgerblue', 'controller': 'c',
+                            'relay': 'dodgerblue'}
+
+
+# the indices of max_items items picked at random out of item_cnt, in ascending order, or None if there are not more
+# than max_items items
+def sample_items(item_cnt, max_items, seed=None):
+    if max_items is None or item_cnt <= max_items:
+        return None
+    my_random = random.Random(seed)
+    return np.array(sorted(my_random.sample(range(item_cnt), max_items)), dtype=np.int64)
+
+
+# at most max_edges edges picked at random out of the given list, in the same order
+def sample_edges(edges, max_edges, seed=None):
+    picked = sample_items(len(edges), max_edges, seed)
+    if picked is None:
+        return edges
+    logger.info('Drawing {} edges out of {}'.format(max_edges, len(edges)))
+    return [edges[i] for i in picked]
+
+
+# draw segments from (xs_src[i], ys_src[i]) to (xs_dst[i], ys_dst[i]) as a single collection
+def draw_edge_layer(ax, xs_src, ys_src, xs_dst, ys_dst, color, width=1.0, alpha=0.7, rasterize_above=None):
+    segments = np.empty((len(xs_src), 2, 2))
+    segments[:, 0, 0] = xs_src
+    segments[:, 0, 1] = ys_src
+    segments[:, 1, 0] = xs_dst
+    segments[:, 1, 1] = ys_dst
+    edge_collection = LineCollection(segments, colors=color, linewidths=width, alpha=alpha, zorder=1)
+    if rasterize_above is not None and len(segments) > rasterize_above:
+        edge_collection.set_rasterized(True)
+    ax.add_collection(edge_collection)
+    return edge_collection
+
+
+# draw a marker at each position (xs[i], ys[i]) as a single collection, colors is a color or a list of colors
+def draw_node_layer(ax, xs, ys, colors, size=5, alpha=0.7, rasterize_above=None):
+    node_collection = ax.scatter(xs, ys, s=size, c=colors, alpha=alpha, linewidths=0.0, zorder=2)
+    if rasterize_above is not None and len(xs) > rasterize_above:
+        node_collection.set_rasterized(True)
+    return node_collection
+
+
+# arrays of the coordinates of the ends of the edges, positions is a dictionary node -> (x, y)
+def edge_coordinates(edges, positions):
+    edge_cnt = len(edges)
+    xs_src = np.fromiter((positions[u][0] for u, v in edges), dtype=np.float64, count=edge_cnt)
+    ys_src = np.fromiter((positions[u][1] for u, v in edges), dtype=np.float64, count=edge_cnt)
+    xs_dst = np.fromiter((positions[v][0] for u, v in edges), dtype=np.float64, count=edge_cnt)
+    ys_dst = np.fromiter((positions[v][1] for u, v in edges), dtype=np.float64, count=edge_cnt)
+    return xs_src, ys_src, xs_dst, ys_dst
+
+
+# same drawing as shared_functions.paint_netw_graphs, on the current axes, node and edge options are explicit
+# layers with more than rasterize_above items are rasterized, layers with more than max_edges edges are sampled
+# returns the layers drawn, as two lists, one of tuples (collection, edges, color) for the edge layers, one of tuples
+# (collection, nodes, colors) for the node layers, items are in the same order as in their collection
+def render_netw_graphs(A, B, Inter, node_col_by_role, edges_a_col, edges_b_col, x_shift_a=0.0, y_shift_a=0.0,
+                       x_shift_b=0.0, y_shift_b=0.0, stretch=1.0, node_size=5, edge_width=1.0, alpha=0.7,
+                       rasterize_above=10000, max_edges=None, seed=None):
+    ax = plt.gca()
+
+    positions = {}
+    for G, x_shift, y_shift in [(A, x_shift_a, y_shift_a), (B, x_shift_b, y_shift_b)]:
+        for node, node_data in G.nodes_iter(data=True):
+            positions[node] = ((node_data['x'] + x_shift) * stretch, (node_data['y'] + y_shift) * stretch)
+
+    edge_kwargs = {'width': edge_width, 'alpha': alpha, 'rasterize_above': rasterize_above}
+    edge_layers = []
+    node_layers = []
+
+    # draw intra edges
+    for G, edge_col in [(A, edges_a_col), (B, edges_b_col)]:
+        edges = sample_edges(G.edges(), max_edges, seed)
+        edge_collection = draw_edge_layer(ax, *edge_coordinates(edges, positions), color=edge_col, **edge_kwargs)
+        edge_layers.append((edge_collection, edges, edge_col))
+
+    # draw inter edges, their role is determined by the role of their target node
+    inter_edges_by_role = {}
+    for edge in Inter.edges_iter():
+        target_node = edge[1]
+        if Inter.node[target_node]['network'] == A.graph['name']:
+            target_node_role = A.node[target_node]['role']
+        else:
+            target_node_role = B.node[target_node]['role']
+        inter_edges_by_role.setdefault(target_node_role, []).append(edge)
+    for edge_role in sorted(inter_edges_by_role):
+        edges = sample_edges(inter_edges_by_role[edge_role], max_edges, seed)
+        edge_col = node_col_by_role[edge_role]
+        edge_collection = draw_edge_layer(ax, *edge_coordinates(edges, positions), color=edge_col, **edge_kwargs)
+        edge_layers.append((edge_collection, edges, edge_col))
+
+    # draw nodes
+    for G in [A, B]:
+        nodes = G.nodes()
+        xs = np.fromiter((positions[node][0] for node in nodes), dtype=np.float64, count=len(nodes))
+        ys = np.fromiter((positions[node][1] for node in nodes), dtype=np.float64, count=len(nodes))
+        colors = [node_col_by_role[G.node[node]['role']] for node in nodes]
+        node_collection = draw_node_layer(ax, xs, ys, colors, node_size, alpha, rasterize_above)
+        node_layers.append((node_collection, nodes, colors))
+
+    return edge_layers, node_layers
+
+
+# stretch the axes of the current figure over the whole figure, and limit them to the items drawn
+# this replaces savefig with bbox_inches='tight', that draws the whole figure once more just to find its bounding box
+def fit_plot(margin=0.02):
+    fig = plt.gcf()
+    ax = plt.gca()
+    ax.set_axis_off()
+    fig.subplots_adjust(left=0.0, right=1.0, bottom=0.0, top=1.0)
+    ax.margins(margin)
+    ax.autoscale_view()
+
+
+# save the current figure, dpi is the resolution of the rasterized layers, the others are saved as vector graphics
+def save_plot(fpath, dpi=150, margin=0.02):
+    fit_plot(margin)
+    plt.gcf().savefig(fpath, dpi=dpi)
+
+
+# draw the networks of an instance and save the plot in fpath, by default netw_dir/_full.pdf
+# graphs are read from the graphml files in netw_dir, so this can be run at any time after the instance is created
+def render_instance(netw_dir, netw_a_name, netw_b_name, netw_inter_name, fpath=None, dpi=150, **render_kwargs):
+    A = gs.read_graphml(os.path.join(netw_dir, netw_a_name + '.graphml'))
+    B = gs.read_graphml(os.path.join(netw_dir, netw_b_name + '.graphml'))
+    I = gs.read_graphml(os.path.join(netw_dir, netw_inter_name + '.graphml'))
+    # graphs without positions are arranged with a spring layout, saved in the instance to be reused
+    for G in [A, B]:
+        lc.ensure_positions(G, cache_dir=os.path.join(netw_dir, lc.layouts_dirname))
+    if fpath is None:
+        fpath = os.path.join(netw_dir, '_full.pdf')
+
+    plt.figure()
+    try:
+        render_netw_graphs(A, B, I, default_node_col_by_role, 'r', 'b', **render_kwargs)
+        save_plot(fpath, dpi)
+    finally:
+        plt.close()  # free memory
+    logger.info('Network plot saved here\n{}'.format(fpath))
+    return fpath
+
+
+def main(argv):
+    if len(argv) not in [5, 6]:
+        print('Usage: python netw_renderer.py netw_dir netw_a_name netw_b_name netw_inter_name [max_edges]')
+        return 1
+    max_edges = int(argv[5]) if len(argv) == 6 else None
+    print(render_instance(argv[1], argv[2], argv[3], argv[4], max_edges=max_edges))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,5 +1,8 @@
 __author__ = 'Agostino Sturaro'
 
+# draws the steps of a run from the snapshots saved by cascades_sim.save_state, see cascade_renderer to draw them from
+# the events of the run, without snapshots
+
 import os
 import numpy as np
 import networkx as nx
@@ -0,0 +1,142 @@
+import os
+import csv
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+__author__ = 'Agostino Sturaro'
+
+logger = logging.getLogger(__name__)
+
+# sections of a simulation run whose wall time is measured, in the order their columns appear in metrics files
+run_sections = ['parse_conf', 'fetch_graphs', 'choose_safe_nodes', 'choose_attacks', 'centr_stats', 'stability_check',
+                'inter_a', 'intra_a', 'inter_b', 'intra_b', 'write_results']
+
+# counters of a simulation run, in the order their columns appear in metrics files
+# iterations is the number of times the four phase checks were executed, the others count the nodes removed by phase
+run_counters = ['iterations', 'dead_atk_a', 'dead_atk_b', 'dead_inter_a', 'dead_intra_a', 'dead_inter_b',
+                'dead_intra_b']
+
+# columns used to identify a simulation run, they are not aggregated
+id_columns = ['batch_conf_fpath', 'sim_group', 'instance', 'run']
+
+
+# collects the wall time and the number of calls of each section of a simulation run, plus some counters
+# when it's not enabled, timing and counting do nothing, so the instrumentation can be left in place
+class RunMetrics(object):
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.times = OrderedDict((section, 0.0) for section in run_sections)
+        self.calls = OrderedDict((section, 0) for section in run_sections)
+        self.counters = OrderedDict((name, 0) for name in run_counters)
+        self.started = {}  # section -> time it was started
+
+    # start and stop measure a section, so that the code between them does not need to be indented in a with block
+    def start(self, section):
+        if self.enabled is False:
+            return
+        self.started[section] = default_timer()
+
+    def stop(self, section):
+        if self.enabled is False:
+            return
+        self.add_time(section, default_timer() - self.started.pop(section))
+
+    @contextmanager
+    def timed(self, section):
+        if self.enabled is False:
+            yield
+            return
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.add_time(section, default_timer() - start)
+
+    # sections that are not in run_sections are accepted, their columns go after the standard ones
+    def add_time(self, section, seconds):
+        if self.enabled is False:
+            return
+        if section not in self.times:
+            self.times[section] = 0.0
+            self.calls[section] = 0
+        self.times[section] += seconds
+        self.calls[section] += 1
+
+    def count(self, name, amount=1):
+        if self.enabled is False:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_row(self):
+        row = OrderedDict()
+        row['total_time'] = '{:.6f}'.format(sum(self.times.values()))
+        for section in self.times:
+            row['t_' + section] = '{:.6f}'.format(self.times[section])
+            row['n_' + section] = self.calls[section]
+        row.update(self.counters)
+        return row
+
+    # append a line to the TSV file at fpath, run_id is a dictionary with the values of id_columns
+    def write_row(self, fpath, run_id):
+        if self.enabled is False:
+            return
+        row = OrderedDict((col, run_id.get(col, '')) for col in id_columns)
+        row.update(self.to_row())
+        file_existed = os.path.isfile(fpath)
+        with open(fpath, 'ab') as metrics_file:
+            writer = csv.DictWriter(metrics_file, list(row.keys()), delimiter='\t', quoting=csv.QUOTE_MINIMAL)
+            if file_existed is False:
+                writer.writeheader()
+            writer.writerow(row)
+
+
+# read the metrics files written by the simulations and aggregate each column over all the runs
+# returns an ordered dictionary column -> dictionary with keys count, total, mean, max
+def summarize_metrics(metrics_fpaths):
+    summary = OrderedDict()
+    for fpath in metrics_fpaths:
+        if not os.path.isfile(fpath):
+            logger.warning('Metrics file {} not found, skipping it'.format(fpath))
+            continue
+        with open(fpath, 'rb') as metrics_file:
+            reader = csv.DictReader(metrics_file, delimiter='\t')
+            for row in reader:
+                for col in reader.fieldnames:
+                    if col in id_columns:
+                        continue
+                    value = float(row[col])
+                    if col not in summary:
+                        summary[col] = {'count': 0, 'total': 0.0, 'mean': 0.0, 'max': value}
+                    col_stats = summary[col]
+                    col_stats['count'] += 1
+                    col_stats['total'] += value
+                    col_stats['max'] = max(col_stats['max'], value)
+
+    for col_stats in summary.values():
+        col_stats['mean'] = col_stats['total'] / col_stats['count']
+
+    return summary
+
+
+# aggregate the metrics files and write the result to a TSV file, with a line for each column of the metrics files
+def write_metrics_summary(metrics_fpaths, summary_fpath):
+    summary = summarize_metrics(metrics_fpaths)
+    with open(summary_fpath, 'wb') as summary_file:
+        writer = csv.writer(summary_file, delimiter='\t', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(['metric', 'count', 'total', 'mean', 'max'])
+        for col, col_stats in summary.items():
+            writer.writerow([col, col_stats['count'], '{:.6f}'.format(col_stats['total']),
+                             '{:.6f}'.format(col_stats['mean']), '{:.6f}'.format(col_stats['max'])])
+    return summary
+
+
+# list the metrics files a batch writes, one for each simulation group, as named by batch_sim_runner_2
+def list_batch_metrics_fpaths(batch_conf, batch_no):
+    metrics_fpaths = []
+    for sim_group, base_config in enumerate(batch_conf['base_configs']):
+        group_results_dir = os.path.normpath(base_config['paths']['results_dir'])
+        metrics_fpaths.append(os.path.join(group_results_dir,
+                                           'batch_no_{}_sim_group_{}_metrics.tsv'.format(batch_no, sim_group)))
+    return metrics_fpaths
@@ -4,6 +4,8 @@ import re
 import sys
 import shutil
 import json
+import time
+import hashlib
 import logging.config
 import networkx as nx
 import matplotlib.pyplot as plt
@@ -647,6 +649,112 @@ def ensure_dir_exists(path):
         os.makedirs(path)
 
 
+# sha1 of the contents of a file, as a hex string, the file is read in blocks to limit memory usage
+def hash_file(fpath, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(fpath, 'rb') as in_file:
+        block = in_file.read(block_size)
+        while len(block) > 0:
+            sha1.update(block)
+            block = in_file.read(block_size)
+    return sha1.hexdigest()
+
+
+# name of the file listing the files of a directory and their hashes, used to tell if the directory is complete
+manifest_fname = 'manifest.json'
+
+
+# list the files in dir_path (not in its subdirectories) and their hashes in a manifest, in the same directory
+# extra is a dictionary of additional information that must match when the manifest is checked (e.g. a config hash)
+def write_manifest(dir_path, extra=None):
+    hash_by_fname = {}
+    for fname in sorted(os.listdir(dir_path)):
+        fpath = os.path.join(dir_path, fname)
+        if fname != manifest_fname and os.path.isfile(fpath):
+            hash_by_fname[fname] = hash_file(fpath)
+    manifest = {'files': hash_by_fname, 'extra': extra if extra is not None else {}}
+    _replace_manifest(manifest, os.path.join(dir_path, manifest_fname))
+
+
+# write the manifest in a temporary file and rename it, so that it's never read half written, and manifests
+# hard-linked from a cache of instances (shared by other instances) are replaced, not changed
+def _replace_manifest(manifest, manifest_fpath):
+    tmp_fpath = '{}.{}.tmp'.format(manifest_fpath, os.getpid())
+    with open(tmp_fpath, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+    if os.name == 'nt' and os.path.exists(manifest_fpath):
+        os.remove(manifest_fpath)
+    os.rename(tmp_fpath, manifest_fpath)
+
+
+# check that dir_path has a manifest with the given extra information, and that the files it lists have not changed
+def check_manifest(dir_path, extra=None):
+    manifest_fpath = os.path.join(dir_path, manifest_fname)
+    if not os.path.isfile(manifest_fpath):
+        return False
+    try:
+        with open(manifest_fpath, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except ValueError:  # a manifest that was not completely written
+        return False
+
+    if manifest.get('extra') != (extra if extra is not None else {}):
+        return False
+    for fname, file_hash in manifest['files'].items():
+        fpath = os.path.join(dir_path, fname)
+        if not os.path.isfile(fpath) or hash_file(fpath) != file_hash:
+            return False
+    return True
+
+
+# update the hashes of the given files in the manifest of dir_path, if there is one, after they were changed on purpose
+# processes updating the same manifest (e.g. simulations on the same instance) take turns, holding a lock file, so
+# that no update is lost, a lock older than lock_timeout seconds is considered abandoned and removed
+def update_manifest(dir_path, fnames, lock_timeout=60.0):
+    manifest_fpath = os.path.join(dir_path, manifest_fname)
+    if not os.path.isfile(manifest_fpath):
+        return
+    lock_fpath = manifest_fpath + '.lock'
+    while True:
+        try:
+            os.close(os.open(lock_fpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except OSError:
+            try:
+                if time.time() - os.path.getmtime(lock_fpath) > lock_timeout:
+                    os.remove(lock_fpath)
+            except OSError:  # the lock was released in the meantime
+                pass
+            time.sleep(0.05)
+    try:
+        with open(manifest_fpath, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        for fname in fnames:
+            manifest['files'][fname] = hash_file(os.path.join(dir_path, fname))
+        _replace_manifest(manifest, manifest_fpath)
+    finally:
+        os.remove(lock_fpath)
+
+
+# values of an option of a batch configuration, either a range or the specified value(s)
+def pick_conf_values(config, opt_name):
+    values = None
+    if config[opt_name]['pick'] == 'range':
+        start = config[opt_name]['start']
+        stop = config[opt_name]['stop']
+        if 'step' in config[opt_name]:
+            step = config[opt_name]['step']
+        else:
+            step = 1
+        values = range(start, stop, step)
+    elif config[opt_name]['pick'] == 'specified':
+        if 'single_value' in config[opt_name]:
+            values = [config[opt_name]['single_value']]
+        elif 'list_of_values' in config[opt_name]:
+            values = config[opt_name]['list_of_values']
+    return values
+
+
 def save_centralities_from_json_to_tsv(input_dir, netw_a_name, netw_b_name, netw_inter_name, out_fpath):
     input_dir = os.path.normpath(input_dir)
     centr_a_fpath = os.path.join(input_dir, 'node_centrality_{}.json'.format(netw_a_name))
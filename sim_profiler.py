@@ -0,0 +1,220 @@
+import os
+import sys
+import glob
+import heapq
+import pstats
+import cProfile
+import logging
+import threading
+from timeit import default_timer
+
+__author__ = 'Agostino Sturaro'
+
+# This module profiles selected simulations of a batch, either with cProfile or with a sampling profiler.
+# Selection and output are controlled by the "profile" entry of a batch configuration, for example
+# "profile": {"method": "sampling", "every_nth": 10, "slowest": 5, "output_dir": "../Simulations/profiles"}
+# - method: "cprofile" (deterministic, higher overhead) or "sampling" (low overhead, default)
+# - every_nth: profile a simulation every n (default 1, all of them)
+# - slowest: if set, only keep the profiles of the n slowest profiled simulations
+# - sampling_interval: seconds between two samples of the sampling profiler (default 0.005)
+# cProfile dumps are saved as .prof files, sampling profiles as collapsed stacks (.collapsed files), a format
+# understood by flamegraph.pl and speedscope. Profiles of different batches can be merged with merge_profiles.
+# The profiles left in output_dir by a previous execution of a batch are removed when the batch starts profiling, so
+# that they are not merged with the new ones.
+
+logger = logging.getLogger(__name__)
+
+profile_methods = ['cprofile', 'sampling']
+
+
+# a low overhead profiler that periodically records the stack of the thread that started it
+# stack_counts maps each collapsed stack ("file:function;file:function;...", outermost first) to its sample count
+class SamplingProfiler(object):
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stack_counts = {}
+        self._target_id = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        self._target_id = threading.current_thread().ident
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._sample_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _sample_loop(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._target_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if len(stack) > 0:
+                stack_key = ';'.join(reversed(stack))
+                self.stack_counts[stack_key] = self.stack_counts.get(stack_key, 0) + 1
+
+    def runcall(self, func, *args, **kwargs):
+        self.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.stop()
+
+
+def write_collapsed(stack_counts, fpath):
+    with open(fpath, 'w') as collapsed_file:
+        for stack_key in sorted(stack_counts):
+            collapsed_file.write('{} {}\n'.format(stack_key, stack_counts[stack_key]))
+
+
+def read_collapsed(fpath, stack_counts=None):
+    if stack_counts is None:
+        stack_counts = {}
+    with open(fpath, 'r') as collapsed_file:
+        for line in collapsed_file:
+            stack_key, count = line.rstrip('\n').rsplit(' ', 1)
+            stack_counts[stack_key] = stack_counts.get(stack_key, 0) + int(count)
+    return stack_counts
+
+
+# wraps the simulations of a batch, profiling the ones selected by the configuration
+# name_prefix is used to name the profile files, so that profiles of different batches do not overwrite each other
+class SimProfiler(object):
+    def __init__(self, profile_conf, name_prefix):
+        self.method = profile_conf.get('method', 'sampling')
+        if self.method not in profile_methods:
+            raise ValueError('Invalid value for parameter "method" of profile: {}, valid values are {}'.format(
+                self.method, profile_methods))
+        self.every_nth = profile_conf.get('every_nth', 1)
+        if self.every_nth < 1:
+            raise ValueError('Parameter "every_nth" of profile must be a positive integer')
+        self.slowest = profile_conf.get('slowest', None)
+        self.interval = profile_conf.get('sampling_interval', 0.005)
+        self.output_dir = os.path.normpath(profile_conf['output_dir'])
+        self.name_prefix = name_prefix
+        self.kept = []  # heap of (elapsed time, profile file path), only used when slowest is set
+        self.profiled = []  # (task name, elapsed time) of each profiled simulation
+        self.saved_fpaths = []  # paths of the profiles saved, and not discarded, by this object
+
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        for fpath in list_profiles(self.output_dir, '{}_*'.format(self.name_prefix)):
+            os.remove(fpath)
+
+    def should_profile(self, task_num):
+        return task_num % self.every_nth == 0
+
+    # call func with the given arguments, profiling it if the task is selected
+    def run(self, task_name, task_num, func, *args, **kwargs):
+        if not self.should_profile(task_num):
+            return func(*args, **kwargs)
+
+        if self.method == 'cprofile':
+            profiler = cProfile.Profile()
+            profile_fpath = os.path.join(self.output_dir, '{}_{}.prof'.format(self.name_prefix, task_name))
+        else:
+            profiler = SamplingProfiler(self.interval)
+            profile_fpath = os.path.join(self.output_dir, '{}_{}.collapsed'.format(self.name_prefix, task_name))
+
+        start = default_timer()
+        result = profiler.runcall(func, *args, **kwargs)
+        elapsed = default_timer() - start
+        self.profiled.append((task_name, elapsed))
+
+        # when we only want the slowest simulations, do not even save profiles that would be discarded
+        if self.slowest is not None and len(self.kept) >= self.slowest and elapsed <= self.kept[0][0]:
+            return result
+
+        if self.method == 'cprofile':
+            profiler.dump_stats(profile_fpath)
+        else:
+            write_collapsed(profiler.stack_counts, profile_fpath)
+        self.saved_fpaths.append(profile_fpath)
+
+        if self.slowest is not None:
+            heapq.heappush(self.kept, (elapsed, profile_fpath))
+            if len(self.kept) > self.slowest:
+                discarded_fpath = heapq.heappop(self.kept)[1]
+                os.remove(discarded_fpath)
+                self.saved_fpaths.remove(discarded_fpath)
+
+        return result
+
+    # merge the profiles saved by this object
+    def merge(self):
+        out_fpath_base = os.path.join(self.output_dir, 'merged_{}'.format(self.name_prefix))
+        return merge_profiles(self.saved_fpaths, out_fpath_base, self.profiled)
+
+
+# the profiles in profile_dir whose names match the pattern (without extension), merged profiles excluded
+def list_profiles(profile_dir, pattern):
+    fpaths = glob.glob(os.path.join(profile_dir, pattern + '.prof'))
+    fpaths.extend(glob.glob(os.path.join(profile_dir, pattern + '.collapsed')))
+    return sorted(fpath for fpath in fpaths if not os.path.basename(fpath).startswith('merged_'))
+
+
+# merge the given profiles into an aggregate report
+# cProfile dumps are merged into out_fpath_base.prof, collapsed stacks are summed into out_fpath_base.collapsed
+# profiled is an optional list of (task name, elapsed time) pairs to list in the report
+# returns the path of the report, or None if no profile was given
+def merge_profiles(profile_fpaths, out_fpath_base, profiled=None):
+    prof_fpaths = sorted(fpath for fpath in profile_fpaths if fpath.endswith('.prof'))
+    collapsed_fpaths = sorted(fpath for fpath in profile_fpaths if fpath.endswith('.collapsed'))
+    if len(prof_fpaths) == 0 and len(collapsed_fpaths) == 0:
+        logger.warning('No profiles to merge into {}'.format(out_fpath_base))
+        return None
+
+    report_fpath = out_fpath_base + '_report.txt'
+    with open(report_fpath, 'w') as report_file:
+        if profiled is not None and len(profiled) > 0:
+            report_file.write('Profiled simulations, slowest first\n')
+            for task_name, elapsed in sorted(profiled, key=lambda item: item[1], reverse=True):
+                report_file.write('{}\t{:.3f}s\n'.format(task_name, elapsed))
+            report_file.write('\n')
+
+        if len(prof_fpaths) > 0:
+            stats = pstats.Stats(prof_fpaths[0], stream=report_file)
+            for fpath in prof_fpaths[1:]:
+                stats.add(fpath)
+            stats.dump_stats(out_fpath_base + '.prof')
+            report_file.write('cProfile, {} profiles merged\n'.format(len(prof_fpaths)))
+            stats.sort_stats('cumulative').print_stats(50)
+
+        if len(collapsed_fpaths) > 0:
+            stack_counts = {}
+            for fpath in collapsed_fpaths:
+                read_collapsed(fpath, stack_counts)
+            write_collapsed(stack_counts, out_fpath_base + '.collapsed')
+            report_file.write('Sampling, {} profiles merged\n'.format(len(collapsed_fpaths)))
+            write_sampling_summary(stack_counts, report_file, 50)
+
+    return report_fpath
+
+
+# write the functions with the most samples, counting both the samples where they were running (self)
+# and the samples where they were on the stack (total)
+def write_sampling_summary(stack_counts, out_file, limit):
+    sample_cnt = sum(stack_counts.values())
+    self_counts = {}
+    total_counts = {}
+    for stack_key, count in stack_counts.items():
+        frames = stack_key.split(';')
+        self_counts[frames[-1]] = self_counts.get(frames[-1], 0) + count
+        for frame in set(frames):  # count recursive functions once per sample
+            total_counts[frame] = total_counts.get(frame, 0) + count
+
+    out_file.write('{} samples\n'.format(sample_cnt))
+    out_file.write('{:>8} {:>8} {:>8} {:>8}  function\n'.format('self', 'self%', 'total', 'total%'))
+    ranked = sorted(total_counts, key=lambda frame: (-total_counts[frame], frame))
+    for frame in ranked[:limit]:
+        self_cnt = self_counts.get(frame, 0)
+        out_file.write('{:>8} {:>7.1f}% {:>8} {:>7.1f}%  {}\n'.format(
+            self_cnt, 100.0 * self_cnt / sample_cnt, total_counts[frame], 100.0 * total_counts[frame] / sample_cnt,
+            frame))
@@ -0,0 +1,247 @@
+import math
+import heapq
+
+__author__ = 'Agostino Sturaro'
+
+# A spatial index over the positions of the nodes of a graph, used to find nearest nodes without computing the
+# distances between all the pairs of nodes.
+# Nodes are put in the cells of a uniform grid. Queries visit the cells in rings of increasing size around the query
+# point, and stop as soon as no unvisited cell can contain a closer node.
+# Distances are computed with math.hypot, exactly like the code that scans all the nodes. Ties are broken by insertion
+# order, the node inserted first wins, just like a linear scan that only replaces the current best on a strictly
+# smaller distance. So, inserting nodes in the same order used by a linear scan gives the same results.
+
+
+class GridIndex(object):
+    # items is a list of hashable objects (e.g. node ids), xs and ys are the lists of their coordinates
+    # cell_size is the side of the cells of the grid, by default it's picked to have about 2 items per cell
+    def __init__(self, items, xs, ys, cell_size=None):
+        if not len(items) == len(xs) == len(ys):
+            raise ValueError('items, xs and ys must have the same length')
+
+        self.items = list(items)
+        self.xs = [float(x) for x in xs]
+        self.ys = [float(y) for y in ys]
+        self.index_of = {}  # item -> position in self.items
+        for i, item in enumerate(self.items):
+            if item in self.index_of:
+                raise ValueError('Duplicate item {}'.format(item))
+            self.index_of[item] = i
+
+        if len(self.items) > 0:
+            self.x_min = min(self.xs)
+            self.y_min = min(self.ys)
+            width = max(self.xs) - self.x_min
+            height = max(self.ys) - self.y_min
+        else:
+            self.x_min = self.y_min = 0.0
+            width = height = 0.0
+
+        if cell_size is None:
+            item_cnt = max(len(self.items), 1)
+            if width > 0 and height > 0:
+                cell_size = math.sqrt(2.0 * width * height / item_cnt)
+            elif width > 0 or height > 0:  # all the items are on a line
+                cell_size = 2.0 * max(width, height) / item_cnt
+            else:
+                cell_size = 1.0
+        elif cell_size <= 0:
+            raise ValueError('cell_size is not a number larger than 0')
+        self.cell_size = float(cell_size)
+
+        self.col_cnt = int(width / self.cell_size) + 1
+        self.row_cnt = int(height / self.cell_size) + 1
+
+        # tolerance for rounding errors, when checking if a point can be in a cell that was not visited yet
+        self.margin = 1e-9 * (abs(self.x_min) + abs(self.y_min) + width + height + self.cell_size)
+
+        # only non empty cells are stored, each one is a list of item positions in ascending order
+        self.cells = {}
+        cells = self.cells
+        for i in range(0, len(self.items)):
+            cell = self._cell_of_item(i)
+            cell_items = cells.get(cell)
+            if cell_items is None:
+                cells[cell] = [i]
+            else:
+                cell_items.append(i)
+        self.size = len(self.items)
+
+    # build an index over the given nodes of G, using the values of their "x" and "y" attributes
+    @classmethod
+    def from_graph(cls, G, nodes=None, cell_size=None):
+        if nodes is None:
+            nodes = G.nodes()
+        xs = [G.node[node]['x'] for node in nodes]
+        ys = [G.node[node]['y'] for node in nodes]
+        return cls(nodes, xs, ys, cell_size)
+
+    def _cell_of_point(self, x, y):
+        return (int(math.floor((x - self.x_min) / self.cell_size)),
+                int(math.floor((y - self.y_min) / self.cell_size)))
+
+    def _cell_of_item(self, i):
+        col = int((self.xs[i] - self.x_min) / self.cell_size)  # never negative, so int() is the same as floor()
+        row = int((self.ys[i] - self.y_min) / self.cell_size)
+        if col >= self.col_cnt:
+            col = self.col_cnt - 1
+        if row >= self.row_cnt:
+            row = self.row_cnt - 1
+        return col, row
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, item):
+        return item in self.index_of and self.index_of[item] is not None
+
+    def position(self, item):
+        i = self.index_of[item]
+        return self.xs[i], self.ys[i]
+
+    # remove an item from the index, it will not be returned by queries anymore
+    def remove(self, item):
+        i = self.index_of[item]
+        if i is None:
+            raise KeyError(item)
+        self.cells[self._cell_of_item(i)].remove(i)
+        self.index_of[item] = None
+        self.size -= 1
+
+    # cells at Chebyshev distance ring from the cell (col, row), limited to the cells of the grid
+    def _ring_cells(self, col, row, ring):
+        if ring == 0:
+            if 0 <= col < self.col_cnt and 0 <= row < self.row_cnt:
+                yield col, row
+            return
+        col_lo = max(col - ring, 0)
+        col_hi = min(col + ring, self.col_cnt - 1)
+        for ring_row in (row - ring, row + ring):
+            if 0 <= ring_row < self.row_cnt:
+                for ring_col in range(col_lo, col_hi + 1):
+                    yield ring_col, ring_row
+        row_lo = max(row - ring + 1, 0)
+        row_hi = min(row + ring - 1, self.row_cnt - 1)
+        for ring_col in (col - ring, col + ring):
+            if 0 <= ring_col < self.col_cnt:
+                for ring_row in range(row_lo, row_hi + 1):
+                    yield ring_col, ring_row
+
+    # first and last rings around the cell (col, row) that intersect the grid
+    def _ring_range(self, col, row):
+        first_ring = max(0 - col, col - (self.col_cnt - 1), 0 - row, row - (self.row_cnt - 1), 0)
+        last_ring = max(col, self.col_cnt - 1 - col, row, self.row_cnt - 1 - row, first_ring)
+        return first_ring, last_ring
+
+    # smallest distance from (x, y) to an item in a cell outside the square of rings around (col, row) visited so far
+    def _unvisited_bound(self, x, y, col, row, visited_rings):
+        left = self.x_min + (col - visited_rings + 1) * self.cell_size
+        right = self.x_min + (col + visited_rings) * self.cell_size
+        bottom = self.y_min + (row - visited_rings + 1) * self.cell_size
+        top = self.y_min + (row + visited_rings) * self.cell_size
+        return min(x - left, right - x, y - bottom, top - y) - self.margin
+
+    # find the k items nearest to the point (x, y), sorted by distance and then by insertion order
+    # accept is an optional function, items for which it returns False are ignored
+    # returns a list of (item, distance) pairs, shorter than k if there are not enough acceptable items
+    def k_nearest(self, x, y, k, accept=None):
+        if k <= 0 or self.size == 0:
+            return []
+        col, row = self._cell_of_point(x, y)
+        first_ring, last_ring = self._ring_range(col, row)
+        cells = self.cells
+        items = self.items
+        xs = self.xs
+        ys = self.ys
+        hypot = math.hypot
+
+        best = []  # heap of the k best (distance, position) pairs, stored negated so the worst one is on top
+        for ring in range(first_ring, last_ring + 1):
+            # stop when the items in the cells we did not visit yet are all farther than the k-th best item
+            if len(best) == k and -best[0][0] < self._unvisited_bound(x, y, col, row, ring):
+                break
+            for cell in self._ring_cells(col, row, ring):
+                cell_items = cells.get(cell)
+                if cell_items is None:
+                    continue
+                for i in cell_items:
+                    if accept is not None and not accept(items[i]):
+                        continue
+                    dist = hypot(x - xs[i], y - ys[i])
+                    if len(best) < k:
+                        heapq.heappush(best, (-dist, -i))
+                    elif dist < -best[0][0] or (dist == -best[0][0] and i < -best[0][1]):
+                        heapq.heapreplace(best, (-dist, -i))
+
+        best = sorted((-neg_dist, -neg_i) for neg_dist, neg_i in best)
+        return [(items[i], dist) for dist, i in best]
+
+    # find the item nearest to the point (x, y), or None if there is no acceptable item
+    # same as k_nearest with k = 1, but faster
+    def nearest(self, x, y, accept=None):
+        if self.size == 0:
+            return None
+        col, row = self._cell_of_point(x, y)
+        first_ring, last_ring = self._ring_range(col, row)
+        cells = self.cells
+        items = self.items
+        xs = self.xs
+        ys = self.ys
+        hypot = math.hypot
+
+        best_i = None
+        best_dist = None
+        for ring in range(first_ring, last_ring + 1):
+            if best_i is not None and best_dist < self._unvisited_bound(x, y, col, row, ring):
+                break
+            for cell in self._ring_cells(col, row, ring):
+                cell_items = cells.get(cell)
+                if cell_items is None:
+                    continue
+                for i in cell_items:
+                    if accept is not None and not accept(items[i]):
+                        continue
+                    dist = hypot(x - xs[i], y - ys[i])
+                    if best_i is None or dist < best_dist or (dist == best_dist and i < best_i):
+                        best_i = i
+                        best_dist = dist
+
+        if best_i is None:
+            return None
+        return items[best_i]
+
+    # find the items at a distance strictly smaller than radius from the point (x, y)
+    # accept is an optional function, items for which it returns False are ignored
+    # returns a list of (item, distance) pairs, sorted by insertion order
+    def within_radius(self, x, y, radius, accept=None):
+        if self.size == 0 or radius <= 0:
+            return []
+        s = self.cell_size
+        # one more cell on each side covers items assigned to a neighbouring cell because of rounding errors
+        col_lo = max(int(math.floor((x - radius - self.x_min) / s)) - 1, 0)
+        col_hi = min(int(math.floor((x + radius - self.x_min) / s)) + 1, self.col_cnt - 1)
+        row_lo = max(int(math.floor((y - radius - self.y_min) / s)) - 1, 0)
+        row_hi = min(int(math.floor((y + radius - self.y_min) / s)) + 1, self.row_cnt - 1)
+        cells = self.cells
+        xs = self.xs
+        ys = self.ys
+        hypot = math.hypot
+
+        found = []
+        if (col_hi - col_lo + 1) * (row_hi - row_lo + 1) <= len(cells):
+            cell_lists = [cells.get((col, row)) for col in range(col_lo, col_hi + 1)
+                          for row in range(row_lo, row_hi + 1)]
+        else:  # the radius is so large that it's faster to go through the non empty cells
+            cell_lists = [cell_items for (col, row), cell_items in cells.items()
+                          if col_lo <= col <= col_hi and row_lo <= row <= row_hi]
+        for cell_items in cell_lists:
+            if cell_items is None:
+                continue
+            for i in cell_items:
+                dist = hypot(x - xs[i], y - ys[i])
+                if dist < radius and (accept is None or accept(self.items[i])):
+                    found.append((i, dist))
+
+        found.sort()
+        return [(self.items[i], dist) for i, dist in found]
+
@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+import pytest
+import batch_netw_creator as bnc
+import netw_creator as nc
+import shared_functions as sf
+
+__author__ = 'Agostino Sturaro'
+
+a_opts = {'name': 'A', 'model': 'random_regular', 'nodes': 20, 'degree': 3, 'roles': 'random_gen_transm_distr',
+          'generators': 4, 'transmission_substations': 6, 'distribution_substations': 10, 'layout': 'uar'}
+b_opts = {'name': 'B', 'model': 'barabasi_albert', 'm': 2, 'roles': 'relay_attached_controllers', 'controllers': 1,
+          'relays': 19, 'layout': 'uar', 'controller_placement': 'random', 'controller_attachment': 'random'}
+inter_opts = {'name': 'Inter', 'dependency_model': 'k-to-n', 'k': 1, 'n': 20, 'com_access_points': 1}
+misc_opts = {'draw_graphs': False}
+
+
+def make_tasks(base_dir, seeds):
+    tasks = []
+    for instance_num, seed in enumerate(seeds):
+        instance_dir = os.path.join(base_dir, 'instance_{}'.format(instance_num))
+        conf_fpath = os.path.join(base_dir, 'config_{}.ini'.format(instance_num))
+        misc_opts['seed'] = seed
+        bnc.write_conf(instance_dir, conf_fpath, a_opts, b_opts, inter_opts, misc_opts)
+        tasks.append((conf_fpath, instance_dir, seed))
+    return tasks
+
+
+def test_manifest():
+    dir_path = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(dir_path, 'a.txt'), 'w') as out_file:
+            out_file.write('a')
+        assert sf.check_manifest(dir_path) is False
+        sf.write_manifest(dir_path, {'conf_sha1': 'x'})
+        assert sf.check_manifest(dir_path, {'conf_sha1': 'x'}) is True
+        assert sf.check_manifest(dir_path, {'conf_sha1': 'y'}) is False
+        with open(os.path.join(dir_path, 'a.txt'), 'w') as out_file:
+            out_file.write('b')
+        assert sf.check_manifest(dir_path, {'conf_sha1': 'x'}) is False
+    finally:
+        shutil.rmtree(dir_path)
+
+
+def test_create_instances_resumes():
+    base_dir = tempfile.mkdtemp()
+    try:
+        tasks = make_tasks(base_dir, [0, 1])
+        bnc.create_instances(tasks, 1)
+        for conf_fpath, instance_dir, seed in tasks:
+            assert sf.check_manifest(instance_dir, {'instance_hash': nc.read_instance_hash(conf_fpath)}) is True
+        mtime_0 = os.path.getmtime(os.path.join(tasks[0][1], 'A.graphml'))
+        with open(os.path.join(tasks[1][1], 'A.graphml'), 'w') as out_file:
+            out_file.write('damaged')
+
+        # only the damaged instance is created again, and a third one is added
+        tasks = make_tasks(base_dir, [0, 1, 2])
+        bnc.create_instances(tasks, 2)
+        assert os.path.getmtime(os.path.join(tasks[0][1], 'A.graphml')) == mtime_0
+        for conf_fpath, instance_dir, seed in tasks:
+            assert sf.check_manifest(instance_dir, {'instance_hash': nc.read_instance_hash(conf_fpath)}) is True
+    finally:
+        shutil.rmtree(base_dir)
+
+
+def test_create_instances_nested_pool():
+    base_dir = tempfile.mkdtemp()
+    try:
+        misc_opts['centrality_processes'] = 2
+        tasks = make_tasks(base_dir, [0, 1])
+        assert bnc.find_nested_pool_opts(tasks[0][0]) == ['misc.centrality_processes']
+        with pytest.raises(ValueError) as exc_info:
+            bnc.create_instances(tasks, 2)
+        assert 'misc.centrality_processes' in str(exc_info.value)
+        assert not os.path.exists(tasks[0][1])
+
+        misc_opts['centrality_processes'] = 1
+        tasks = make_tasks(base_dir, [0, 1])
+        assert bnc.find_nested_pool_opts(tasks[0][0]) == []
+    finally:
+        del misc_opts['centrality_processes']
+        shutil.rmtree(base_dir)
+
+
+def test_instance_cache():
+    base_dir = tempfile.mkdtemp()
+    try:
+        misc_opts['instance_cache_dir'] = os.path.join(base_dir, 'cache')
+        tasks = make_tasks(base_dir, [5])
+        bnc.create_instance(tasks[0])
+        instance_hash = nc.read_instance_hash(tasks[0][0])
+        assert sf.check_manifest(os.path.join(base_dir, 'cache', instance_hash), {'instance_hash': instance_hash})
+
+        # same options and seed, but a different output directory, the cached instance is reused
+        other_dir = os.path.join(base_dir, 'other')
+        conf_fpath = os.path.join(base_dir, 'other.ini')
+        misc_opts['seed'] = 5
+        bnc.write_conf(other_dir, conf_fpath, a_opts, b_opts, inter_opts, misc_opts)
+        assert nc.read_instance_hash(conf_fpath) == instance_hash
+        nc.run(conf_fpath, False)
+        for fname in os.listdir(tasks[0][1]):
+            assert os.path.samefile(os.path.join(tasks[0][1], fname), os.path.join(other_dir, fname))
+
+        misc_opts['seed'] = 6
+        bnc.write_conf(other_dir, conf_fpath, a_opts, b_opts, inter_opts, misc_opts)
+        assert nc.read_instance_hash(conf_fpath) != instance_hash
+    finally:
+        del misc_opts['instance_cache_dir']
+        shutil.rmtree(base_dir)
+
+
+# the positions of the uar layout are not seeded, so the networks are arranged on a circle
+def test_instance_stream_graphml():
+    base_dir = tempfile.mkdtemp()
+    circ_a_opts = dict(a_opts, layout='circular')
+    circ_b_opts = dict(b_opts, layout='circular')
+    try:
+        instance_dirs = []
+        for stream_graphml in [False, True]:
+            instance_dir = os.path.join(base_dir, 'instance_{}'.format(stream_graphml))
+            conf_fpath = os.path.join(base_dir, 'config_{}.ini'.format(stream_graphml))
+            misc_opts['seed'] = 3
+            misc_opts['stream_graphml'] = stream_graphml
+            bnc.write_conf(instance_dir, conf_fpath, circ_a_opts, circ_b_opts, inter_opts, misc_opts)
+            bnc.create_instance((conf_fpath, instance_dir, 3))
+            instance_dirs.append(instance_dir)
+
+        # streaming the graphs to their files writes the same files
+        fnames = [fname for fname in os.listdir(instance_dirs[0]) if fname.endswith('.graphml')]
+        assert len(fnames) >= 3
+        for fname in fnames:
+            with open(os.path.join(instance_dirs[0], fname), 'rb') as nx_file:
+                with open(os.path.join(instance_dirs[1], fname), 'rb') as gs_file:
+                    assert gs_file.read() == nx_file.read()
+    finally:
+        del misc_opts['stream_graphml']
+        shutil.rmtree(base_dir)
@@ -0,0 +1,76 @@
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+import cascade_renderer as cr
+import cascades_sim as cs
+import file_loader as fl
+import graphml_stream as gs
+
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import ConfigParser  # ver. < 3.0
+
+__author__ = 'Agostino Sturaro'
+
+this_dir = os.path.normpath(os.path.dirname(__file__))
+
+plt.switch_backend('Agg')  # no display needed
+
+
+def test_render_cascade():
+    # given
+    exp_death_times = {'D3': 1, 'R6': 4, 'T2': 6, 'D2': 7, 'R4': 8, 'R5': 8, 'G2': 10}
+    netw_dir = os.path.join(this_dir, 'test_sets', 'ex_3_full')
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        os.chdir(this_dir)
+        config = ConfigParser()
+        config.read(os.path.join(netw_dir, 'run_realistic.ini'))
+        config.set('paths', 'results_dir', tmp_dir)
+        config.set('paths', 'end_stats_fpath', os.path.join(tmp_dir, 'end_stats.tsv'))
+        config.set('paths', 'events_fname', 'events.jsonl')
+        sim_conf_fpath = os.path.join(tmp_dir, 'run.ini')
+        with open(sim_conf_fpath, 'w') as conf_file:
+            config.write(conf_file)
+        cs.run(sim_conf_fpath, fl.FileLoader())
+
+        # when
+        death_times = cr.read_death_times(os.path.join(tmp_dir, 'events.jsonl'))
+        stats_death_times = cr.read_death_times(os.path.join(tmp_dir, 'run_realistic_stats.tsv'))
+
+        # then
+        assert death_times == exp_death_times
+        assert stats_death_times == exp_death_times
+        assert cr.list_steps(death_times) == [0, 1, 4, 6, 7, 8, 10]
+
+        # only colors change between steps
+        A = gs.read_graphml(os.path.join(netw_dir, 'A.graphml'))
+        B = gs.read_graphml(os.path.join(netw_dir, 'B.graphml'))
+        I = gs.read_graphml(os.path.join(netw_dir, 'Inter.graphml'))
+        plt.figure()
+        try:
+            cascade_plot = cr.CascadePlot(A, B, I, death_times)
+            node_collection_a = plt.gca().collections[-2]
+            nodes_a = A.nodes()
+            dead_rgba = mcolors.to_rgba(cr.dead_col)
+            cascade_plot.show_step(0)
+            assert not any(np.allclose(col, dead_rgba) for col in node_collection_a.get_facecolors())
+            collection_cnt = len(plt.gca().collections)
+            cascade_plot.show_step(7)
+            assert len(plt.gca().collections) == collection_cnt
+            for node, col in zip(nodes_a, node_collection_a.get_facecolors()):
+                assert np.allclose(col[:3], dead_rgba[:3]) == (node in ['D3', 'T2', 'D2'])
+        finally:
+            plt.close()
+
+        out_fpath = os.path.join(tmp_dir, 'cascade.pdf')
+        cr.render_cascade(netw_dir, 'A', 'B', 'Inter', os.path.join(tmp_dir, 'events.jsonl'), out_fpath)
+        with open(out_fpath, 'rb') as pdf_file:
+            assert len(re.findall(b'/Type /Page\\b', pdf_file.read())) == 7  # a page for each step
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -1,10 +1,18 @@
 import os
+import csv
+import json
 import shutil
 import file_loader as fl
 import cascades_sim as cs
+import run_metrics as rm
 import shared_functions as sf
 import networkx as nx
 
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import ConfigParser  # ver. < 3.0
+
 __author__ = 'Agostino Sturaro'
 
 this_dir = os.path.normpath(os.path.dirname(__file__))
@@ -472,6 +480,84 @@ def test_run_ex_3_realistic():
     os.remove(os.path.join(this_dir, os.path.normpath('test_sets/useless/useless_3.tsv')))
 
 
+def test_run_ex_3_realistic_events():
+    # given
+    global this_dir, logging_conf_fpath
+    base_conf_fpath = 'test_sets/ex_3_full/run_realistic.ini'
+    sim_conf_fpath = 'test_sets/useless/run_realistic_events.ini'
+    exp_events = [
+        {'time': 1, 'network': 'A', 'cause': 'attack', 'nodes': ['D3']},
+        {'time': 4, 'network': 'B', 'cause': 'inter', 'nodes': ['R6']},
+        {'time': 6, 'network': 'A', 'cause': 'inter', 'nodes': ['T2']},
+        {'time': 7, 'network': 'A', 'cause': 'intra', 'nodes': ['D2']},
+        {'time': 8, 'network': 'B', 'cause': 'inter', 'nodes': ['R4', 'R5']},
+        {'time': 10, 'network': 'A', 'cause': 'inter', 'nodes': ['G2']}
+    ]
+    floader = fl.FileLoader()
+
+    os.chdir(this_dir)
+    config = ConfigParser()
+    config.read(base_conf_fpath)
+    config.set('paths', 'events_fname', 'events.jsonl')
+    with open(sim_conf_fpath, 'w') as conf_file:
+        config.write(conf_file)
+
+    # when
+    sf.setup_logging(logging_conf_fpath)
+    cs.run(sim_conf_fpath, floader)
+
+    # then
+    with open(os.path.normpath('test_sets/ex_3_full/res_realistic/events.jsonl'), 'rb') as events_file:
+        events = [json.loads(line.decode('utf-8')) for line in events_file]
+    assert events == exp_events
+
+    # tear down
+    shutil.rmtree(os.path.join(this_dir, os.path.normpath('test_sets/ex_3_full/res_realistic')))
+    os.remove(os.path.join(this_dir, os.path.normpath('test_sets/useless/useless_3.tsv')))
+    os.remove(os.path.join(this_dir, os.path.normpath(sim_conf_fpath)))
+
+
+def test_run_ex_3_realistic_metrics():
+    # given
+    global this_dir, logging_conf_fpath
+    base_conf_fpath = 'test_sets/ex_3_full/run_realistic.ini'
+    sim_conf_fpath = 'test_sets/useless/run_realistic_metrics.ini'
+    metrics_fpath = os.path.normpath('test_sets/useless/metrics_3.tsv')
+    exp_counters = {'iterations': '4', 'dead_atk_a': '1', 'dead_atk_b': '0', 'dead_inter_a': '2',
+                    'dead_intra_a': '1', 'dead_inter_b': '3', 'dead_intra_b': '0'}
+    floader = fl.FileLoader()
+
+    os.chdir(this_dir)
+    config = ConfigParser()
+    config.read(base_conf_fpath)
+    config.set('paths', 'metrics_fpath', metrics_fpath)
+    with open(sim_conf_fpath, 'w') as conf_file:
+        config.write(conf_file)
+
+    # when
+    sf.setup_logging(logging_conf_fpath)
+    cs.run(sim_conf_fpath, floader)
+    summary = rm.summarize_metrics([metrics_fpath])
+
+    # then
+    with open(metrics_fpath, 'rb') as metrics_file:
+        rows = list(csv.DictReader(metrics_file, delimiter='\t'))
+    assert len(rows) == 1
+    for counter in exp_counters:
+        assert rows[0][counter] == exp_counters[counter]
+    assert rows[0]['n_inter_a'] == rows[0]['n_intra_b'] == '4'
+    assert rows[0]['n_centr_stats'] == '0'
+    assert rows[0]['n_choose_safe_nodes'] == rows[0]['n_choose_attacks'] == '1'
+    assert 't_choose_nodes' not in rows[0]
+    assert summary['iterations']['count'] == 1 and summary['iterations']['total'] == 4.0
+
+    # tear down
+    shutil.rmtree(os.path.join(this_dir, os.path.normpath('test_sets/ex_3_full/res_realistic')))
+    os.remove(os.path.join(this_dir, os.path.normpath('test_sets/useless/useless_3.tsv')))
+    os.remove(os.path.join(this_dir, metrics_fpath))
+    os.remove(os.path.join(this_dir, os.path.normpath(sim_conf_fpath)))
+
+
 def test_run_ex_3_kngc():
     # given
     global this_dir, logging_conf_fpath
@@ -0,0 +1,145 @@
+import os
+import json
+import shutil
+import tempfile
+import networkx as nx
+import batch_netw_creator as bnc
+import centrality_planner as cp
+import file_loader as fl
+import netw_creator as nc
+import shared_functions as sf
+import test_batch_netw_creator as tbnc
+
+__author__ = 'Agostino Sturaro'
+
+
+def make_batch_conf():
+    paths = {'netw_a_fname': 'A.graphml', 'netw_b_fname': 'B.graphml', 'netw_inter_fname': 'Inter.graphml',
+             'netw_union_fname': 'UnionAB.graphml'}
+    run_opts = {'attacked_netw': 'both', 'attack_tactic': 'centrality_rank_from_top',
+                'centrality_fname': 'node_centrality_UnionAB.json', 'centrality_name': 'betweenness', 'attacks': 5}
+    random_run_opts = {'attacked_netw': 'A', 'attack_tactic': 'random', 'attacks': 5}
+    safe_nodes_opts = {'from_netw': 'B', 'selection_tactic': 'centrality_rank_from_bottom',
+                       'centrality_fname': 'node_centrality_B.json', 'centrality_name': 'closeness', 'node_count': 2}
+    return {'indep_var_name': 'centrality_name',
+            'indep_var_vals': {'pick': 'specified', 'list_of_values': ['betweenness', 'degree']},
+            'base_configs': [{'paths': paths, 'run_opts': run_opts, 'misc': {}},
+                             {'paths': paths, 'run_opts': random_run_opts, 'misc': {},
+                              'safe_nodes_opts': safe_nodes_opts}]}
+
+
+def test_plan_batch_centralities():
+    batch_conf = make_batch_conf()
+    plan = cp.plan_batch_centralities(batch_conf)
+    assert plan == {'node_centrality_UnionAB.json': ['betweenness', 'degree'], 'node_centrality_B.json': ['closeness']}
+
+    batch_conf['base_configs'][1]['paths'] = dict(batch_conf['base_configs'][1]['paths'], ml_stats_fpath='ml.tsv')
+    plan = cp.plan_batch_centralities(batch_conf)
+    assert plan['node_centrality_A.json'] == ['betweenness', 'closeness', 'degree']
+    assert plan['node_centrality_B.json'] == ['closeness', 'betweenness', 'degree']
+    assert plan['node_centrality_Inter.json'] == ['betweenness', 'closeness', 'indegree', 'katz']
+    assert plan['node_centrality_UnionAB.json'] == ['betweenness', 'degree', 'closeness', 'indegree', 'katz']
+    assert plan['node_centrality_misc.json'] == nc.misc_centrality_metrics
+
+
+def test_save_planned_centralities():
+    netw_dir = tempfile.mkdtemp()
+    try:
+        G = nx.barabasi_albert_graph(30, 2, seed=1)
+        G.graph['name'] = 'A'
+        H = nx.gnm_random_graph(20, 40, seed=1, directed=True)
+        H.graph['name'] = 'Inter'
+        plan = {'node_centrality_A.json': ['closeness', 'katz'], 'node_centrality_Inter.json': ['indegree']}
+        nc.save_graph_centralities(G, netw_dir, plan=plan)
+        nc.save_graph_centralities(H, netw_dir, plan=plan)
+        fpath_a = os.path.join(netw_dir, 'node_centrality_A.json')
+        with open(fpath_a, 'r') as centr_file:
+            centr_info_a = json.load(centr_file)
+        assert centr_info_a['node_count'] == 30
+        assert 'closeness_centrality_rank' in centr_info_a
+        assert 'katz_centrality' not in centr_info_a  # not calculated for undirected graphs
+        assert 'betweenness_centrality' not in centr_info_a
+
+        # parallel calculation follows the plan too, and saves the same files
+        shutil.copy(fpath_a, fpath_a + '.bak')
+        nc.save_centralities_parallel([G, H], netw_dir, processes=2, plan=plan)
+        assert sf.compare_files_by_line(fpath_a, fpath_a + '.bak')
+
+        # a missing metric is calculated when it's fetched, and saved with the others
+        floader = fl.FileLoader()
+        graphs = {'A': G, 'Inter': H}
+        centr_info_a = cp.fetch_centrality_info(floader, netw_dir, 'node_centrality_A.json', ['betweenness'], graphs)
+        exp_info = {}
+        nc.add_centrality_info(exp_info, 'betweenness_centrality', nx.betweenness_centrality(G))
+        assert centr_info_a['betweenness_centrality_rank'] == exp_info['betweenness_centrality_rank']
+        assert 'closeness_centrality_rank' in centr_info_a
+        with open(fpath_a, 'r') as centr_file:
+            assert json.load(centr_file) == centr_info_a
+
+        # so is a whole missing file
+        os.remove(os.path.join(netw_dir, 'node_centrality_Inter.json'))
+        centr_info_i = cp.fetch_centrality_info(floader, netw_dir, 'node_centrality_Inter.json', ['indegree'], graphs)
+        assert centr_info_i['node_count'] == 20
+        assert centr_info_i['indegree_centrality'] == {str(node): score for node, score in
+                                                       nx.in_degree_centrality(H).items()}
+    finally:
+        shutil.rmtree(netw_dir)
+
+
+def test_fetch_centrality_of_cached_instance():
+    base_dir = tempfile.mkdtemp()
+    try:
+        plan_fpath = os.path.join(base_dir, 'plan.json')
+        cp.write_plan({'node_centrality_A.json': ['degree']}, plan_fpath)
+        misc_opts = dict(tbnc.misc_opts, instance_cache_dir=os.path.join(base_dir, 'cache'),
+                         calc_node_centrality=True, centrality_plan_fpath=plan_fpath, seed=5)
+        instance_dirs = []
+        for instance_name in ['first', 'second']:
+            instance_dir = os.path.join(base_dir, instance_name)
+            conf_fpath = os.path.join(base_dir, instance_name + '.ini')
+            bnc.write_conf(instance_dir, conf_fpath, tbnc.a_opts, tbnc.b_opts, tbnc.inter_opts, misc_opts)
+            nc.run(conf_fpath, False)
+            instance_dirs.append(instance_dir)
+        instance_hash = nc.read_instance_hash(conf_fpath)
+        cached_dir = os.path.join(base_dir, 'cache', instance_hash)
+        fpath_a = os.path.join(instance_dirs[1], 'node_centrality_A.json')
+        assert os.path.samefile(fpath_a, os.path.join(cached_dir, 'node_centrality_A.json'))
+
+        # calculating a missing metric on the second instance leaves the cache and the first instance as they were
+        A = nx.read_graphml(os.path.join(instance_dirs[1], 'A.graphml'), node_type=str)
+        centr_info_a = cp.fetch_centrality_info(fl.FileLoader(), instance_dirs[1], 'node_centrality_A.json',
+                                                ['closeness'], {'A': A})
+        assert 'closeness_centrality' in centr_info_a
+        with open(os.path.join(instance_dirs[0], 'node_centrality_A.json'), 'r') as centr_file:
+            assert 'closeness_centrality' not in json.load(centr_file)
+        assert not os.path.exists(os.path.join(instance_dirs[1], sf.manifest_fname + '.lock'))
+        for dir_path in [cached_dir] + instance_dirs:
+            assert sf.check_manifest(dir_path, {'instance_hash': instance_hash}) is True
+    finally:
+        shutil.rmtree(base_dir)
+
+
+def test_fetch_centrality_reproducible():
+    netw_dir = tempfile.mkdtemp()
+    try:
+        G = nx.barabasi_albert_graph(60, 2, seed=2)
+        G.graph['name'] = 'A'
+        graphs = {'A': G}
+        floader = fl.FileLoader()
+        fpath_a = os.path.join(netw_dir, 'node_centrality_A.json')
+
+        # files written before the betweenness mode and the seed were saved
+        with open(fpath_a, 'w') as centr_file:
+            json.dump({'node_count': 60, 'betweenness_centrality': {str(node): 0.0 for node in G.nodes()}}, centr_file)
+        centr_info_a = cp.fetch_centrality_info(floader, netw_dir, 'node_centrality_A.json', ['closeness'], graphs)
+        assert 'closeness_centrality_rank' in centr_info_a
+
+        # sampled betweenness calculated later is the same one netw_creator would have calculated
+        nc.save_graph_centralities(G, netw_dir, betweenness_samples=20, seed=7, plan={'node_centrality_A.json': []})
+        floader.discard(fpath_a)
+        centr_info_a = cp.fetch_centrality_info(floader, netw_dir, 'node_centrality_A.json', ['betweenness'], graphs)
+        exp_info = {}
+        nc.add_centrality_info(exp_info, 'betweenness_centrality', nc.calc_graph_centrality(G, 'betweenness', 20, 7))
+        assert centr_info_a['betweenness_centrality'] == json.loads(json.dumps(exp_info['betweenness_centrality']))
+    finally:
+        shutil.rmtree(netw_dir)
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import pytest
+import engine_harness as eh
+import file_loader as fl
+import cascades_sim as cs
+import shared_functions as sf
+
+__author__ = 'Agostino Sturaro'
+
+this_dir = os.path.normpath(os.path.dirname(__file__))
+test_sets_dir = os.path.join(this_dir, 'test_sets')
+
+
+def test_find_scenarios():
+    scenarios = eh.find_scenarios(test_sets_dir)
+    names = [scenario['name'] for scenario in scenarios]
+    assert 'ex_1_full/realistic' in names
+    assert 'ex_unstable_2/uniform' in names
+    assert len(names) == 22
+
+    ex_3_realistic = scenarios[names.index('ex_3_full/realistic')]
+    assert ex_3_realistic['exp_end_stats_fpath'].endswith('exp_end_stats_realistic.tsv')
+
+
+def test_run_harness():
+    report = eh.run_harness(test_sets_dir, timing_runs=1)
+
+    assert len(report) == 22 * len(cs.sim_engines)
+    for entry in report:
+        assert entry['diffs'] == []
+        assert len(entry['times']) == 2
+
+
+def test_run_unknown_engine():
+    os.chdir(this_dir)
+    sf.setup_logging(os.path.join(this_dir, 'logging_base_conf.json'))
+    work_dir = tempfile.mkdtemp()
+    try:
+        conf_fpath = eh.write_engine_conf(os.path.join(test_sets_dir, 'ex_1_full', 'run_realistic.ini'), this_dir,
+                                          work_dir, 'unknown')
+        with pytest.raises(ValueError):
+            cs.run(conf_fpath, fl.FileLoader())
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,170 @@
+import os
+import glob
+import random
+import shutil
+import tempfile
+import numpy as np
+import networkx as nx
+import cascades_sim as cs
+import file_loader as fl
+import graphml_stream as gs
+
+__author__ = 'Agostino Sturaro'
+
+this_dir = os.path.normpath(os.path.dirname(__file__))
+
+
+def sorted_edges(G):
+    if G.is_multigraph():
+        edges = G.edges(keys=True, data=True)
+    else:
+        edges = G.edges(data=True)
+    if not G.is_directed():
+        edges = [tuple(sorted(edge[:2])) + tuple(edge[2:]) for edge in edges]
+    return sorted(edges)
+
+
+def assert_same_graph(G1, G2):
+    assert type(G1) == type(G2)
+    assert G1.graph == G2.graph
+    assert sorted(G1.nodes(data=True)) == sorted(G2.nodes(data=True))
+    for node in G1.nodes_iter():
+        for attr_name in G1.node[node]:
+            assert type(G1.node[node][attr_name]) == type(G2.node[node][attr_name])
+    assert sorted_edges(G1) == sorted_edges(G2)
+
+
+def test_read_graphml():
+    fpaths = glob.glob(os.path.join(this_dir, 'test_sets', 'ex_*', '*.graphml'))
+    assert len(fpaths) > 0
+    for fpath in fpaths:
+        assert_same_graph(gs.read_graphml(fpath), nx.read_graphml(fpath, node_type=str))
+
+    floader = fl.FileLoader(stream_graphml=True)
+    assert_same_graph(floader.fetch_graphml(fpaths[0], str), nx.read_graphml(fpaths[0], node_type=str))
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        G = nx.MultiGraph()
+        G.add_edge('a', 'b', weight=1)
+        G.add_edge('a', 'b', weight=2)
+        G.add_node('c', x=1.5, active=True)
+        G.graph['name'] = 'M'
+        fpath = os.path.join(tmp_dir, 'multi.graphml')
+        nx.write_graphml(G, fpath)
+        assert_same_graph(gs.read_graphml(fpath), nx.read_graphml(fpath))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def assert_same_order(G1, G2):
+    assert G1.nodes() == G2.nodes()
+    assert list(G1.node) == list(G2.node)
+    assert G1.edges() == G2.edges()
+    for node in G1.nodes_iter():
+        assert list(G1.adj[node]) == list(G2.adj[node])
+    if G1.is_directed():
+        for node in G1.nodes_iter():
+            assert list(G1.pred[node]) == list(G2.pred[node])
+
+
+# random choices made on the graphs depend on the order of their nodes and edges
+def test_read_graphml_order():
+    fpaths = glob.glob(os.path.join(this_dir, 'test_sets', '*', '*.graphml'))
+    assert len(fpaths) > 0
+    for fpath in fpaths:
+        assert_same_order(gs.read_graphml(fpath), nx.read_graphml(fpath, node_type=str))
+
+    # larger graphs, whose dictionaries are resized while they are read
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for directed in [False, True]:
+            G = nx.gnm_random_graph(3000, 12000, seed=2, directed=directed)
+            G = nx.relabel_nodes(G, {node: 'N{}'.format(node) for node in G.nodes()})
+            for node in G.nodes():
+                G.node[node]['x'] = 0.5
+            fpath = os.path.join(tmp_dir, 'G.graphml')
+            nx.write_graphml(G, fpath)
+            assert_same_order(gs.read_graphml(fpath), nx.read_graphml(fpath))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    fpath = os.path.join(this_dir, 'test_sets', 'ex_1_full', 'Inter.graphml')
+    assert cs.choose_random_nodes(gs.read_graphml(fpath), 4, 3) == ['T3', 'G2', 'R3', 'R1']
+    I = fl.FileLoader(stream_graphml=True).fetch_graphml(fpath, str)
+    nx_I = fl.FileLoader().fetch_graphml(fpath, str)
+    assert cs.choose_random_nodes(I, 4, 3) == cs.choose_random_nodes(nx_I, 4, 3)
+
+
+# the streamed file is the same, byte for byte, as the one written by networkx
+def test_write_graphml():
+    fpaths = glob.glob(os.path.join(this_dir, 'test_sets', '*', '*.graphml'))
+    assert len(fpaths) > 0
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        gs_fpath = os.path.join(tmp_dir, 'gs.graphml')
+        nx_fpath = os.path.join(tmp_dir, 'nx.graphml')
+        for fpath in fpaths:
+            G = nx.read_graphml(fpath, node_type=str)
+            gs.write_graphml(G, gs_fpath)
+            nx.write_graphml(G, nx_fpath)
+            with open(gs_fpath, 'rb') as gs_file, open(nx_fpath, 'rb') as nx_file:
+                assert gs_file.read() == nx_file.read()
+
+        G = nx.MultiGraph()
+        G.add_edge('a', 'b', weight=1)
+        G.add_edge('a', 'b', weight=2.5, label=u'\xe8 <&>')
+        G.add_node('c', x=1.5, active=True)
+        G.graph['name'] = 'M'
+        G.graph['id'] = 'M1'
+        G.graph['node_default'] = {'x': 0.0}
+        G.graph['edge_default'] = {'weight': 0}
+        # networkx pops the id of the graph while writing it
+        gs.write_graphml(G, gs_fpath)
+        nx.write_graphml(G, nx_fpath)
+        with open(gs_fpath, 'rb') as gs_file, open(nx_fpath, 'rb') as nx_file:
+            assert gs_file.read() == nx_file.read()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_graphml_arrays():
+    my_random = random.Random(4)
+    G = nx.gnm_random_graph(50, 150, seed=4, directed=True)
+    G = nx.relabel_nodes(G, {node: 'N{}'.format(node) for node in G.nodes()})
+    for node in G.nodes():
+        G.node[node]['x'] = my_random.random() * 1000
+        G.node[node]['y'] = my_random.random()
+        G.node[node]['role'] = my_random.choice(['relay', 'controller'])
+    del G.node['N0']['role']
+    G.graph['name'] = 'B <&>'
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        fpath = os.path.join(tmp_dir, 'B.graphml')
+        nx.write_graphml(G, fpath)
+        arrays = gs.read_graphml_arrays(fpath)
+        assert arrays.name == 'B <&>'
+        assert arrays.directed is True
+        assert arrays.number_of_nodes() == 50
+        assert arrays.number_of_edges() == 150
+        assert arrays.roles[arrays.nodes.index('N0')] is None
+        assert sorted_edges(arrays.to_networkx()) == sorted_edges(nx.read_graphml(fpath))
+
+        # positions are written exactly, the graph read back is the same one
+        G = arrays.to_networkx()
+        arrays = gs.GraphArrays.from_graph(G)
+        out_fpath = os.path.join(tmp_dir, 'B_out.graphml')
+        gs.write_graphml_arrays(arrays, out_fpath)
+        arrays_out = gs.read_graphml_arrays(out_fpath)
+        assert arrays_out.nodes == arrays.nodes
+        assert np.array_equal(arrays_out.xs, arrays.xs)
+        assert np.array_equal(arrays_out.ys, arrays.ys)
+        assert arrays_out.roles == arrays.roles
+        assert np.array_equal(arrays_out.sources, arrays.sources)
+        assert np.array_equal(arrays_out.targets, arrays.targets)
+        G_out = nx.read_graphml(out_fpath)
+        assert sorted(G_out.nodes(data=True)) == sorted(G.nodes(data=True))
+        assert sorted_edges(G_out) == sorted_edges(G)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import networkx as nx
+import layout_cache as lc
+import netw_creator as nc
+
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import ConfigParser  # ver. < 3.0
+
+__author__ = 'Agostino Sturaro'
+
+
+def test_hash_graph_structure():
+    G = nx.Graph()
+    G.add_edges_from([('a', 'b'), ('b', 'c')])
+    H = nx.Graph()
+    H.add_edges_from([('c', 'b'), ('b', 'a')])
+    assert lc.hash_graph_structure(G) == lc.hash_graph_structure(H)
+    H.add_edge('a', 'c')
+    assert lc.hash_graph_structure(G) != lc.hash_graph_structure(H)
+    assert lc.hash_graph_structure(G) != lc.hash_graph_structure(G.to_directed())
+
+
+def test_layouts():
+    G = nx.grid_2d_graph(12, 12)
+    G = nx.relabel_nodes(G, {node: '{}_{}'.format(*node) for node in G.nodes()})
+    for layout in lc.layouts:
+        pos_by_node = lc.calc_layout(G, layout, span=2.0, seed=3)
+        assert sorted(pos_by_node) == sorted(G.nodes())
+        positions = np.array(list(pos_by_node.values()))
+        assert positions.min() >= 0.0
+        assert np.isclose(positions.max(), 2.0)
+
+        # layouts are deterministic
+        other_pos_by_node = lc.calc_layout(G, layout, span=2.0, seed=3)
+        for node in G.nodes():
+            assert np.array_equal(pos_by_node[node], other_pos_by_node[node])
+
+        # linked nodes end up much closer than random pairs
+        edge_dist = np.mean([np.linalg.norm(pos_by_node[u] - pos_by_node[v]) for u, v in G.edges()])
+        nodes = G.nodes()
+        pair_dist = np.mean([np.linalg.norm(pos_by_node[u] - pos_by_node[v]) for u in nodes for v in nodes])
+        assert edge_dist < pair_dist / 3
+
+
+def test_get_layout():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        G = nx.barabasi_albert_graph(60, 2, seed=1)
+        G.graph['name'] = 'A'
+        pos_by_node = lc.get_layout(G, 'spring', cache_dir, seed=1)
+        assert len(os.listdir(cache_dir)) == 1
+
+        # the layout saved is read back exactly
+        cached_pos_by_node = lc.get_layout(G, 'spring', cache_dir, seed=1)
+        assert len(os.listdir(cache_dir)) == 1
+        for node in G.nodes():
+            assert np.array_equal(pos_by_node[node], cached_pos_by_node[node])
+
+        lc.get_layout(G, 'spring', cache_dir, seed=2)
+        lc.get_layout(G, 'fast_spring', cache_dir, seed=1)
+        assert len(os.listdir(cache_dir)) == 3
+
+        assert lc.ensure_positions(G, cache_dir=cache_dir, seed=1) is True
+        assert len(os.listdir(cache_dir)) == 3
+        assert G.node[0]['x'] == pos_by_node[0][0]
+        assert lc.ensure_positions(G, cache_dir=cache_dir) is False
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_arrange_nodes_spring():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        config = ConfigParser()
+        config.add_section('build_a')
+        config.set('build_a', 'layout', 'spring')
+        G = nx.barabasi_albert_graph(30, 2, seed=1)
+        G.graph['name'] = 'A'
+        nc.arrange_nodes(G, config, 'build_a', 5, cache_dir)
+        H = G.copy()
+        nc.arrange_nodes(H, config, 'build_a', 5)
+        assert G.nodes(data=True) == H.nodes(data=True)
+    finally:
+        shutil.rmtree(cache_dir)
@@ -1,8 +1,14 @@
 import os
+import json
+import random
+import shutil
+import tempfile
+import pytest
 import networkx as nx
 from collections import defaultdict
 import netw_creator as nc
 import shared_functions as sf
+import union_view as uv
 
 __author__ = 'Agostino Sturaro'
 
@@ -216,6 +222,150 @@ def test_create_k_to_n_dep():
     assert sum(I_0.in_degree(['C0', 'C1']).values()) == 8
     assert sorted(I_0.edges()) == sorted(I_1.edges())
 
+    I_0 = nc.create_k_to_n_dep(A, B_2cc, 1, 4, seed=128, sampling='stub_matching')
+    I_1 = nc.create_k_to_n_dep(A, B_2cc, 1, 4, seed=128, sampling='stub_matching')
+    wanted_out_degrees = {'a0': 2, 'a1': 2, 'a2': 2, 'a3': 2, 'C0': 1, 'R0': 1, 'R1': 1, 'R2': 1}
+    assert I_0.out_degree(['a0', 'a1', 'a2', 'a3', 'C0', 'R0', 'R1', 'R2']) == wanted_out_degrees
+    assert I_0.in_degree('C0') == 4
+    assert sorted(I_0.edges()) == sorted(I_1.edges())
+
+
+def test_match_stubs():
+    left_nodes = ['L{}'.format(i) for i in range(0, 60)]
+    right_nodes = ['R{}'.format(i) for i in range(0, 40)]
+    links = nc.match_stubs(left_nodes, 4, right_nodes, 6, random.Random(128))
+    assert len(links) == 240
+    assert len(set(links)) == 240  # no duplicate links
+    degrees = defaultdict(int)
+    for node_l, node_r in links:
+        degrees[node_l] += 1
+        degrees[node_r] += 1
+    assert all(degrees[node] == 4 for node in left_nodes)
+    assert all(degrees[node] == 6 for node in right_nodes)
+    assert nc.match_stubs(left_nodes, 4, right_nodes, 6, random.Random(128)) == links
+
+    # every left node must be linked to every right node, this is only possible without duplicates
+    links = nc.match_stubs(left_nodes[:5], 3, right_nodes[:3], 5, random.Random(128))
+    assert sorted(links) == sorted((node_l, node_r) for node_l in left_nodes[:5] for node_r in right_nodes[:3])
+
+
+def test_create_dep_stub_matching():
+    A = nx.Graph()
+    A.add_nodes_from(['a{}'.format(i) for i in range(0, 30)])
+    B = nx.Graph()
+    B.add_nodes_from(['b{}'.format(i) for i in range(0, 30)])
+
+    I_0 = nc.create_n_to_n_dep(A, B, 3, seed=128, sampling='stub_matching')
+    I_1 = nc.create_n_to_n_dep(A, B, 3, seed=128, sampling='stub_matching')
+    assert all(degree == 3 for degree in I_0.degree().values())
+    assert all(not (A.has_node(u) and A.has_node(v)) for u, v in I_0.edges())
+    assert sorted(I_0.edges()) == sorted(I_1.edges())
+
+    I_0 = nc.create_m_to_n_dep(A, B, 2, 3, seed=128, sampling='stub_matching')
+    I_1 = nc.create_m_to_n_dep(A, B, 2, 3, seed=128, sampling='stub_matching')
+    # arcs are reversed, so 2 nodes of B depend from each node of A, and 3 nodes of A depend from each node of B
+    assert all(I_0.in_degree(node) == 2 for node in A.nodes())
+    assert all(I_0.in_degree(node) == 3 for node in B.nodes())
+    assert sorted(I_0.edges()) == sorted(I_1.edges())
+
+    # each node of B needs n distinct partners in A, that has none
+    with pytest.raises(ValueError):
+        nc.create_m_to_n_dep(nx.Graph(), B, 3, 2, seed=128, sampling='stub_matching')
+
+
+def test_RT_nested_Smallworld_processes():
+    G_0 = nc.RT_nested_Smallworld(300, 4, 8, 0.2, 0.2, 0.5, subnet_cnt=6, seed=128, processes=1)
+    G_1 = nc.RT_nested_Smallworld(300, 4, 8, 0.2, 0.2, 0.5, subnet_cnt=6, seed=128, processes=2)
+    assert sorted(G_0.nodes(data=True)) == sorted(G_1.nodes(data=True))
+    assert sorted(G_0.edges()) == sorted(G_1.edges())
+
+
+def test_RT_nested_Smallworld_vectorized():
+    G_0 = nc.RT_nested_Smallworld(500, 4, 8, 0.2, 0.2, 0.5, subnet_cnt=10, seed=128, vectorized=True)
+    G_1 = nc.RT_nested_Smallworld(500, 4, 8, 0.2, 0.2, 0.5, subnet_cnt=10, seed=128, vectorized=True)
+    assert sorted(G_0.nodes()) == list(range(0, 500))
+    assert sorted(G_0.edges()) == sorted(G_1.edges())
+    assert G_0.number_of_selfloops() == 0
+    assert nx.is_connected(G_0)
+
+    subnets = defaultdict(list)
+    for node in G_0.nodes():
+        subnets[G_0.node[node]['subnet']].append(node)
+    assert sorted(subnets.keys()) == list(range(0, 10))
+    for subnet in subnets.values():
+        assert sorted(subnet) == list(range(min(subnet), min(subnet) + 50))
+        assert nx.is_connected(G_0.subgraph(subnet))
+
+    # subnets are linked in a ring, with 4 links between each subnet and the previous one
+    links_between_subnets = [(u, v) for u, v in G_0.edges() if G_0.node[u]['subnet'] != G_0.node[v]['subnet']]
+    assert len(links_between_subnets) == 40
+
+
+def test_create_ranged_dep():
+    A = nx.Graph()
+    A.add_nodes_from([('A0', {'x': 0.0, 'y': 0.0}), ('A1', {'x': 4.0, 'y': 0.0}), ('A2', {'x': 10.0, 'y': 0.0})])
+    B = nx.Graph()
+    B.add_nodes_from([('B0', {'x': 0.5, 'y': 0.0}), ('B1', {'x': 1.5, 'y': 0.0}), ('B2', {'x': 3.0, 'y': 0.0}),
+                      ('B3', {'x': 7.0, 'y': 0.0}), ('B4', {'x': 2.0, 'y': 5.0})])
+
+    I = nc.create_ranged_dep(A, B, 2.0)
+
+    # A0 reaches B0 and B1, A1 reaches B2, A2 reaches nothing and links to B3, the nearest node
+    # B4 is not in range of any node, so it links to the nearest node, A0 and A1 are tied and A0 wins
+    exp_edges = [('A0', 'B0'), ('A0', 'B1'), ('A1', 'B2'), ('A2', 'B3'), ('A0', 'B4')]
+    assert sorted(tuple(sorted(edge)) for edge in I.edges()) == sorted(exp_edges)
+    assert I.number_of_nodes() == 8
+
+
+def test_save_graph_centralities_sampled():
+    G = nx.barabasi_albert_graph(200, 2, seed=128)
+    G.graph['name'] = 'G'
+    out_dir = tempfile.mkdtemp()
+    try:
+        nc.save_graph_centralities(G, out_dir)
+        with open(os.path.join(out_dir, 'node_centrality_G.json'), 'r') as centr_file:
+            centr_info = json.load(centr_file)
+        assert centr_info['betweenness_centrality_mode'] == 'exact'
+        assert centr_info['betweenness_centrality_samples'] == 200
+        exact_centr = centr_info['betweenness_centrality']
+
+        random.seed(64)
+        random_state = random.getstate()
+        nc.save_graph_centralities(G, out_dir, betweenness_samples=100, seed=128)
+        assert random.getstate() == random_state  # the global generator is not touched
+        with open(os.path.join(out_dir, 'node_centrality_G.json'), 'r') as centr_file:
+            centr_info = json.load(centr_file)
+        assert centr_info['betweenness_centrality_mode'] == 'sampled'
+        assert centr_info['betweenness_centrality_samples'] == 100
+        sampled_centr = centr_info['betweenness_centrality']
+        assert max(abs(sampled_centr[node] - exact_centr[node]) for node in exact_centr) < 0.1
+
+        # an error target too strict for the size of the graph falls back to the exact computation
+        assert nc.betweenness_samples_for_error(200, 0.01) == 200
+        assert nc.betweenness_samples_for_error(10 ** 6, 0.05) == 3363
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_save_centralities_parallel():
+    G = nx.barabasi_albert_graph(100, 2, seed=128)
+    G.graph['name'] = 'G'
+    D = nx.gnp_random_graph(100, 0.05, seed=128, directed=True)
+    D.graph['name'] = 'D'
+    seq_dir = tempfile.mkdtemp()
+    par_dir = tempfile.mkdtemp()
+    try:
+        nc.save_graph_centralities(G, seq_dir)
+        nc.save_graph_centralities(D, seq_dir)
+        nc.save_centralities_parallel([G, D], par_dir, processes=2)
+        for file_name in ['node_centrality_G.json', 'node_centrality_D.json']:
+            with open(os.path.join(seq_dir, file_name), 'r') as seq_file:
+                with open(os.path.join(par_dir, file_name), 'r') as par_file:
+                    assert seq_file.read() == par_file.read()
+    finally:
+        shutil.rmtree(seq_dir)
+        shutil.rmtree(par_dir)
+
 
 def test_count_node_disjoint_paths():
     edges = [(1, 2), (2, 3), (3, 4), (4, 5), (5, 6), (6, 1), (3, 5), (3, 6)]
@@ -225,6 +375,43 @@ def test_count_node_disjoint_paths():
     path_cnt = nc.count_node_disjoint_paths(G, 4, 6)
     assert path_cnt == 2
 
+    # removing the shortest path 0-1-2-9 would leave no other path, but there are 2 disjoint ones
+    edges = [(0, 1), (1, 2), (2, 9), (1, 5), (5, 6), (6, 9), (0, 7), (7, 8), (8, 2)]
+    G = nx.Graph(edges)
+    assert nc.count_node_disjoint_paths(G, 0, 9) == 2
+
+    # the same flow network is used for all the targets, results must not depend on the order of the queries
+    G = nx.DiGraph(edges)
+    counter = nc.NodeDisjointPathCounter(G, 0)
+    assert [counter.count(node) for node in [9, 2, 6, 9]] == [2, 2, 1, 2]
+    assert counter.count(5) == 1
+
+
+def test_calc_controller_disjoint_paths():
+    A = nx.Graph()
+    A.add_nodes_from([0, 1])
+    B = nx.Graph([(2, 3), (3, 5), (2, 4), (4, 5), (2, 6), (6, 7)])
+    for node in B.nodes():
+        B.node[node]['role'] = 'relay'
+    B.node[5]['role'] = 'controller'
+    B.node[7]['role'] = 'controller'
+    I = nx.DiGraph([(0, 2), (0, 5), (0, 7), (1, 3), (1, 4), (1, 6), (1, 5)])
+    path_cnts_by_node = nc.calc_controller_disjoint_paths(A, B, I)
+    assert path_cnts_by_node == {0: {5: 1, 7: 1}, 1: {5: 2}}
+
+
+def test_count_weighted_shortest_paths():
+    # a chain of 20 diamonds, there are 2^20 shortest paths between its ends
+    G = nx.Graph()
+    for i in range(0, 20):
+        G.add_edges_from([(i * 3, i * 3 + 1), (i * 3, i * 3 + 2), (i * 3 + 1, i * 3 + 3), (i * 3 + 2, i * 3 + 3)])
+    path_cnt, path_cnt_by_node = nc.count_weighted_shortest_paths(G, 60, {0: 3, 57: 1})
+    assert path_cnt == 3 * 2 ** 20 + 2
+    assert path_cnt_by_node[0] == 3 * 2 ** 20
+    assert path_cnt_by_node[1] == 3 * 2 ** 19
+    assert path_cnt_by_node[57] == 3 * 2 ** 20 + 2  # all the paths pass through it
+    assert path_cnt_by_node[58] == 3 * 2 ** 19 + 1
+
 
 def test_calc_relay_betweenness():
     A = nx.Graph()
@@ -898,3 +1085,82 @@ def test_compare_links_between_pos():
     G2.add_edge(1, 2, {'color': 'black'})
     assert sf.compare_links_between_pos(G1, G2, data=False) == ''
     assert sf.compare_links_between_pos(G1, G2, data=True) == ''
+
+
+def test_sparse_katz_centrality():
+    G = nx.gnp_random_graph(200, 0.02, seed=5, directed=True)
+    exp_centr = nx.katz_centrality_numpy(G)
+    centr = nc.sparse_katz_centrality(G)
+    assert sorted(centr.keys()) == sorted(exp_centr.keys())
+    for node in G.nodes():
+        assert abs(centr[node] - exp_centr[node]) < 1e-8
+
+
+def test_hopcroft_karp_matching():
+    my_random = random.Random(3)
+    for i in range(0, 20):
+        G = nx.Graph()
+        G.add_nodes_from(range(0, 30))
+        G.add_nodes_from(range(100, 125))
+        for node_a in range(0, 30):
+            for node_b in my_random.sample(range(100, 125), my_random.randint(0, 3)):
+                G.add_edge(node_a, node_b)
+        mate = nc.hopcroft_karp_matching(G, range(0, 30))
+        assert len(mate) == len(nx.max_weight_matching(G))
+        for node, node_mate in mate.items():
+            assert mate[node_mate] == node
+            assert G.has_edge(node, node_mate)
+
+
+def test_calc_union_centrality():
+    A = nx.relabel_nodes(nx.barabasi_albert_graph(40, 2, seed=2), lambda node: 'A{}'.format(node))
+    A.graph['name'] = 'A'
+    B = nx.relabel_nodes(nx.barabasi_albert_graph(30, 2, seed=3), lambda node: 'B{}'.format(node))
+    B.graph['name'] = 'B'
+    I = nx.DiGraph([('A{}'.format(i), 'B{}'.format(i % 30)) for i in range(0, 40)])
+    U = uv.UnionView(A, B, I, 'UnionAB')
+    ab_union = U.to_networkx()
+    for metric in nc.list_graph_centrality_metrics(ab_union):
+        exp_centr = nc.calc_graph_centrality(ab_union, metric)
+        centr = nc.calc_graph_centrality(U, metric)
+        assert sorted(centr.keys()) == sorted(exp_centr.keys())
+        for node in exp_centr:
+            assert abs(centr[node] - exp_centr[node]) < 1e-8
+
+    # the sampled betweenness uses the same pivots as the copy of the union graph
+    exp_centr = nc.calc_graph_centrality(ab_union, 'betweenness', 20, 3)
+    centr = nc.calc_graph_centrality(U, 'betweenness', 20, 3)
+    for node in exp_centr:
+        assert abs(centr[node] - exp_centr[node]) < 1e-8
+
+    # katz is calculated with the sparse solver, and the file of the union says so
+    assert nc.calc_graph_centrality(U, 'katz', katz_method='numpy') == nc.calc_graph_centrality(U, 'katz')
+    with pytest.raises(ValueError):
+        nc.calc_graph_centrality(U, 'katz', katz_method='dense')
+    assert nc.build_graph_centrality_info(U, {}, katz_method='numpy')['katz_method'] == 'sparse'
+    assert nc.build_graph_centrality_info(ab_union, {}, katz_method='numpy')['katz_method'] == 'numpy'
+
+
+def test_user_graph_cache():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        G = nx.relabel_nodes(nx.barabasi_albert_graph(2000, 2, seed=1), lambda node: 'n{}'.format(node * 7 % 2000))
+        for node in G.nodes():
+            G.node[node]['x'] = random.random()
+        big_fpath = os.path.join(temp_dir, 'big.graphml')
+        nx.write_graphml(G, big_fpath)
+
+        user_graphs = nc.UserGraphCache()
+        fpaths = [os.path.join(this_dir, 'test_sets', 'ex_1_full', fname) for fname in ['A.graphml', 'Inter.graphml']]
+        fpaths.append(big_fpath)
+        for fpath in fpaths:
+            for i in range(0, 2):
+                exp_G = nx.read_graphml(fpath, node_type=str)
+                G = user_graphs.read_graphml(fpath)
+                assert type(G) == type(exp_G)
+                assert G.graph == exp_G.graph
+                assert G.nodes(data=True) == exp_G.nodes(data=True)  # same order too
+                assert G.edges(data=True) == exp_G.edges(data=True)
+                G.remove_nodes_from(G.nodes()[:10])  # changes must not affect the next graphs
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import matplotlib.pyplot as plt
+import graphml_stream as gs
+import netw_renderer as nr
+from matplotlib.collections import LineCollection
+
+__author__ = 'Agostino Sturaro'
+
+plt.switch_backend('Agg')  # no display needed
+
+this_dir = os.path.normpath(os.path.dirname(__file__))
+ex_dir = os.path.join(this_dir, 'test_sets', 'ex_1_full')
+
+
+def test_sample_items():
+    assert nr.sample_items(10, None) is None
+    assert nr.sample_items(10, 10) is None
+    picked = nr.sample_items(100, 10, seed=3)
+    assert len(picked) == 10
+    assert len(set(picked)) == 10
+    assert list(picked) == sorted(picked)
+    assert np.array_equal(picked, nr.sample_items(100, 10, seed=3))
+
+
+def test_render_netw_graphs():
+    A = gs.read_graphml(os.path.join(ex_dir, 'A.graphml'))
+    B = gs.read_graphml(os.path.join(ex_dir, 'B.graphml'))
+    I = gs.read_graphml(os.path.join(ex_dir, 'Inter.graphml'))
+
+    plt.figure()
+    try:
+        nr.render_netw_graphs(A, B, I, nr.default_node_col_by_role, 'r', 'b', rasterize_above=A.number_of_edges() - 1,
+                              max_edges=None)
+        ax = plt.gca()
+        edge_layers = [coll for coll in ax.collections if isinstance(coll, LineCollection)]
+        node_layers = [coll for coll in ax.collections if not isinstance(coll, LineCollection)]
+        assert sum(len(layer.get_segments()) for layer in edge_layers) == \
+            A.number_of_edges() + B.number_of_edges() + I.number_of_edges()
+        assert [len(layer.get_offsets()) for layer in node_layers] == [A.number_of_nodes(), B.number_of_nodes()]
+        assert edge_layers[0].get_rasterized() is True  # edges of A
+    finally:
+        plt.close()
+
+    # edges are sampled
+    plt.figure()
+    try:
+        nr.render_netw_graphs(A, B, I, nr.default_node_col_by_role, 'r', 'b', max_edges=2, seed=1)
+        edge_layers = [coll for coll in plt.gca().collections if isinstance(coll, LineCollection)]
+        assert max(len(layer.get_segments()) for layer in edge_layers) == 2
+    finally:
+        plt.close()
+
+
+def test_render_instance():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for fname in ['A.graphml', 'B.graphml', 'Inter.graphml']:
+            shutil.copy(os.path.join(ex_dir, fname), tmp_dir)
+        fpath = nr.render_instance(tmp_dir, 'A', 'B', 'Inter')
+        assert fpath == os.path.join(tmp_dir, '_full.pdf')
+        assert os.path.getsize(fpath) > 0
+    finally:
+        shutil.rmtree(tmp_dir)
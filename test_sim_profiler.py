@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import sim_profiler as sp
+
+__author__ = 'Agostino Sturaro'
+
+
+def busy_loop(iterations):
+    total = 0
+    for i in range(0, iterations):
+        total += i % 7
+    return total
+
+
+def test_sampling_profiler():
+    profiler = sp.SamplingProfiler(interval=0.001)
+
+    result = profiler.runcall(busy_loop, 2000000)
+
+    assert result == busy_loop(2000000)
+    assert sum(profiler.stack_counts.values()) > 0
+    assert any(stack_key.endswith('test_sim_profiler.py:busy_loop') for stack_key in profiler.stack_counts)
+
+
+def test_sim_profiler_slowest():
+    output_dir = tempfile.mkdtemp()
+    try:
+        # profiles left by a previous execution of this batch are removed, the ones of other batches are kept
+        for fname in ['batch_0_sim_9.prof', 'batch_0_sim_3.collapsed', 'batch_10_sim_0.collapsed']:
+            open(os.path.join(output_dir, fname), 'w').close()
+        profile_conf = {'method': 'cprofile', 'every_nth': 2, 'slowest': 2, 'output_dir': output_dir}
+        profiler = sp.SimProfiler(profile_conf, 'batch_0')
+        assert os.listdir(output_dir) == ['batch_10_sim_0.collapsed']
+        os.remove(os.path.join(output_dir, 'batch_10_sim_0.collapsed'))
+        iterations = [1000, 1000, 300000, 1000, 10, 1000, 200000, 1000]
+        for task_num, iteration_cnt in enumerate(iterations):
+            profiler.run('sim_{}'.format(task_num), task_num, busy_loop, iteration_cnt)
+
+        # only even tasks are profiled, and only the profiles of the 2 slowest ones are kept
+        assert [task_name for task_name, elapsed in profiler.profiled] == ['sim_0', 'sim_2', 'sim_4', 'sim_6']
+        assert sorted(os.listdir(output_dir)) == ['batch_0_sim_2.prof', 'batch_0_sim_6.prof']
+
+        report_fpath = profiler.merge()
+        assert os.path.isfile(report_fpath)
+        assert os.path.isfile(os.path.join(output_dir, 'merged_batch_0.prof'))
+        assert not os.path.exists(os.path.join(output_dir, 'merged_batch_0.collapsed'))
+        with open(report_fpath, 'r') as report_file:
+            assert 'cProfile, 2 profiles merged' in report_file.read()
+    finally:
+        shutil.rmtree(output_dir)
+
+
+def test_merge_collapsed():
+    output_dir = tempfile.mkdtemp()
+    try:
+        sp.write_collapsed({'a.py:main;a.py:f': 3, 'a.py:main': 1}, os.path.join(output_dir, 'batch_0_sim_0.collapsed'))
+        sp.write_collapsed({'a.py:main;a.py:f': 2}, os.path.join(output_dir, 'batch_1_sim_0.collapsed'))
+        sp.write_collapsed({'a.py:main;a.py:f': 7}, os.path.join(output_dir, 'batch_2_sim_0.collapsed'))
+
+        # only the batches that were run are merged
+        profile_fpaths = sp.list_profiles(output_dir, 'batch_0_*') + sp.list_profiles(output_dir, 'batch_1_*')
+        sp.merge_profiles(profile_fpaths, os.path.join(output_dir, 'merged_all_batches'))
+
+        stack_counts = sp.read_collapsed(os.path.join(output_dir, 'merged_all_batches.collapsed'))
+        assert stack_counts == {'a.py:main;a.py:f': 5, 'a.py:main': 1}
+    finally:
+        shutil.rmtree(output_dir)
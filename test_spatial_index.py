@@ -0,0 +1,105 @@
+import math
+import random
+import pytest
+import networkx as nx
+import spatial_index as si
+
+__author__ = 'Agostino Sturaro'
+
+
+# the results expected from a linear scan, sorted by distance and then by insertion order
+def brute_force_k_nearest(items, xs, ys, x, y, k, accept=None):
+    candidates = []
+    for i, item in enumerate(items):
+        if accept is None or accept(item):
+            candidates.append((math.hypot(x - xs[i], y - ys[i]), i))
+    candidates.sort()
+    return [(items[i], dist) for dist, i in candidates[:k]]
+
+
+def test_nearest():
+    index = si.GridIndex(['a', 'b', 'c', 'd'], [0.0, 1.0, 1.0, 5.0], [0.0, 0.0, 1.0, 5.0])
+
+    assert index.nearest(0.1, 0.1) == 'a'
+    assert index.nearest(4.0, 4.0) == 'd'
+    assert index.nearest(0.5, 0.0) == 'a'  # tie between a and b, the first inserted wins
+    assert index.nearest(0.1, 0.1, accept=lambda item: item != 'a') == 'b'
+    assert index.nearest(0.1, 0.1, accept=lambda item: False) is None
+    assert index.k_nearest(1.0, 0.5, 3) == [('b', 0.5), ('c', 0.5), ('a', math.hypot(1.0, 0.5))]
+
+
+def test_remove():
+    index = si.GridIndex(['a', 'b', 'c'], [0.0, 1.0, 2.0], [0.0, 0.0, 0.0])
+
+    index.remove('a')
+
+    assert len(index) == 2
+    assert 'a' not in index
+    assert index.nearest(0.0, 0.0) == 'b'
+    with pytest.raises(KeyError):
+        index.remove('a')
+
+
+def test_k_nearest_matches_linear_scan():
+    my_random = random.Random(128)
+    for point_cnt in [1, 2, 10, 100, 500]:
+        items = list(range(0, point_cnt))
+        # integer coordinates produce many ties, a few points are far away from the others
+        xs = [my_random.randint(0, 20) for i in items]
+        ys = [my_random.randint(0, 20) for i in items]
+        xs[0] = 1000
+        index = si.GridIndex(items, xs, ys)
+        removed = set(my_random.sample(items, point_cnt // 3))
+        for item in removed:
+            index.remove(item)
+
+        for query_num in range(0, 50):
+            x = my_random.uniform(-50, 70)
+            y = my_random.randint(-10, 30)
+            k = my_random.randint(1, point_cnt + 1)
+            accept = None
+            if query_num % 2 == 0:
+                accept = lambda item: item % 3 != 0
+            exp = brute_force_k_nearest(items, xs, ys, x, y, k,
+                                        lambda item: item not in removed and (accept is None or accept(item)))
+            assert index.k_nearest(x, y, k, accept) == exp
+
+
+def test_within_radius_matches_linear_scan():
+    my_random = random.Random(64)
+    items = list(range(0, 300))
+    xs = [my_random.randint(0, 30) for i in items]
+    ys = [my_random.uniform(0, 30) for i in items]
+    index = si.GridIndex(items, xs, ys)
+
+    for query_num in range(0, 100):
+        x = my_random.randint(-5, 35)
+        y = my_random.uniform(-5, 35)
+        radius = my_random.choice([0.5, 1.0, 3.0, 10.0, 100.0])
+        exp = [(i, math.hypot(x - xs[i], y - ys[i])) for i in items if math.hypot(x - xs[i], y - ys[i]) < radius]
+        assert index.within_radius(x, y, radius) == exp
+
+    # the distance must be strictly smaller than the radius
+    index = si.GridIndex(['a', 'b'], [0.0, 1.0], [0.0, 0.0])
+    assert index.within_radius(0.0, 0.0, 1.0) == [('a', 0.0)]
+    assert index.within_radius(0.0, 0.0, 1.0, accept=lambda item: item != 'a') == []
+
+
+def test_collinear_and_coincident_points():
+    index = si.GridIndex([3, 2, 1], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0])
+    assert index.k_nearest(1.0, 1.0, 2) == [(3, math.sqrt(2.0)), (2, math.sqrt(2.0))]
+
+    index = si.GridIndex([0, 1, 2, 3], [0.0, 1.0, 2.0, 3.0], [0.0, 0.0, 0.0, 0.0])
+    assert index.nearest(2.4, 7.0) == 2
+
+
+def test_from_graph():
+    G = nx.Graph()
+    G.add_node('A1', {'x': 0.0, 'y': 0.0})
+    G.add_node('A2', {'x': 2.0, 'y': 2.0})
+    G.add_node('A3', {'x': 3.0, 'y': 3.0})
+
+    index = si.GridIndex.from_graph(G, ['A1', 'A2'])
+
+    assert index.nearest(2.9, 2.9) == 'A2'
+    assert index.position('A1') == (0.0, 0.0)
@@ -0,0 +1,98 @@
+import os
+import random
+import networkx as nx
+import cascades_sim as cs
+import file_loader as fl
+import union_view as uv
+
+__author__ = 'Agostino Sturaro'
+
+this_dir = os.path.normpath(os.path.dirname(__file__))
+
+
+# A and B undirected, I directed from A to B, like the graphs created by netw_creator
+def make_graphs(seed):
+    my_random = random.Random(seed)
+    A = nx.relabel_nodes(nx.gnm_random_graph(30, 50, seed=seed), lambda node: 'A{}'.format(node))
+    A.graph['name'] = 'A'
+    B = nx.relabel_nodes(nx.barabasi_albert_graph(20, 2, seed=seed), lambda node: 'B{}'.format(node))
+    B.graph['name'] = 'B'
+    I = nx.DiGraph()
+    I.graph['name'] = 'Inter'
+    for node_a in A.nodes():
+        for node_b in my_random.sample(B.nodes(), 2):
+            I.add_edge(node_a, node_b)
+    return A, B, I
+
+
+# the union graph, built like netw_creator does
+def make_union(A, B, I):
+    ab_union = nx.DiGraph()
+    ab_union.add_edges_from(A.to_directed().edges())
+    ab_union.add_edges_from(B.to_directed().edges())
+    ab_union.add_edges_from(I.to_directed().edges())
+    return ab_union
+
+
+def test_union_view_adjacency():
+    A, B, I = make_graphs(7)
+    ab_union = make_union(A, B, I)
+    U = uv.UnionView(A, B, I, 'UnionAB')
+
+    assert U.graph['name'] == 'UnionAB'
+    assert sorted(U.nodes()) == sorted(ab_union.nodes())
+    assert U.number_of_nodes() == ab_union.number_of_nodes()
+    assert sorted(U.edges()) == sorted(ab_union.edges())
+    assert U.number_of_edges() == ab_union.number_of_edges()
+    for node in ab_union.nodes():
+        assert sorted(U.successors(node)) == sorted(ab_union.successors(node))
+        assert sorted(U.predecessors(node)) == sorted(ab_union.predecessors(node))
+        assert U.in_degree(node) == ab_union.in_degree(node)
+        assert U.degree(node) == ab_union.degree(node)
+    assert U.node['A0']['network'] == 'A'
+    assert U.node['B0']['network'] == 'B'
+
+    nodes, adj = U.to_csr()
+    assert adj.nnz == ab_union.number_of_edges()
+    for i, j in zip(*adj.nonzero()):
+        assert ab_union.has_edge(nodes[i], nodes[j])
+
+
+# nodes are listed in a fixed order, A then B, that is not the order of the union graph
+def test_union_view_node_order():
+    A, B, I = make_graphs(5)
+    ab_union = make_union(A, B, I)
+    U = uv.UnionView(A, B, I, 'UnionAB')
+    assert U.nodes() == A.nodes() + B.nodes()
+    assert list(U.nodes_iter()) == U.nodes()
+    assert sorted(U.nodes()) == sorted(ab_union.nodes())
+
+    # random choices on the view are reproducible, between simulations reading the same files
+    netw_dir = os.path.join(this_dir, 'test_sets', 'ex_1_full')
+    chosen_nodes = []
+    for floader in [fl.FileLoader(), fl.FileLoader()]:
+        A, B, I = [floader.fetch_graphml(os.path.join(netw_dir, name + '.graphml'), str)
+                   for name in ['A', 'B', 'Inter']]
+        chosen_nodes.append(cs.choose_random_nodes(uv.UnionView(A, B, I, 'UnionAB'), 5, 3))
+    assert chosen_nodes[0] == chosen_nodes[1]
+
+
+def test_union_view_centralities():
+    A, B, I = make_graphs(3)
+    ab_union = make_union(A, B, I)
+    U = uv.UnionView(A, B, I, 'UnionAB')
+
+    assert U.degree_centrality() == nx.degree_centrality(ab_union)
+    assert U.in_degree_centrality() == nx.in_degree_centrality(ab_union)
+    assert U.closeness_centrality(chunk_size=7) == nx.closeness_centrality(ab_union)
+    assert U.closeness_centrality(['A1', 'B2']) == {node: nx.closeness_centrality(ab_union, u=node)
+                                                    for node in ['A1', 'B2']}
+
+    # betweenness is calculated on the adjacency matrix, the pivots are the ones picked on the copy of the union
+    ab_union = U.to_networkx()
+    for k in [None, 10]:
+        exp_centr = nx.betweenness_centrality(ab_union, k=k, seed=4)
+        centr = U.betweenness_centrality(k, seed=4)
+        assert list(centr) == list(exp_centr)
+        for node in exp_centr:
+            assert abs(centr[node] - exp_centr[node]) < 1e-12
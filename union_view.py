@@ -0,0 +1,247 @@
+import random
+import numpy as np
+import networkx as nx
+
+__author__ = 'Agostino Sturaro'
+
+# A read-only directed graph made of the nodes of A and B, and of the arcs of A, B and I, the graph of the dependencies
+# between them. It behaves like the union graph created by netw_creator (arcs of undirected graphs are taken in both
+# directions, nodes only have the "network" attribute), but it does not copy the graphs, it looks up their adjacency.
+# Only the methods used to pick nodes and to calculate centralities are implemented.
+# The nodes are listed as the nodes of A followed by the nodes of B, not in the order of the union graph saved by
+# netw_creator (that depends on how its edges were added and on how the file is read back), so random choices made on
+# the view (e.g. random attacks on "both" networks) are reproducible when A and B are read the same way, but they are
+# not the same as the ones made on the saved union graph.
+# The graphs must not change while the view is used, or results will not be consistent.
+
+
+class UnionNodeView(object):
+    def __init__(self, union):
+        self.union = union
+
+    def __getitem__(self, node):
+        return {'network': self.union.network_of(node)}
+
+    def __contains__(self, node):
+        return self.union.has_node(node)
+
+
+class UnionView(object):
+    def __init__(self, A, B, I, name):
+        self.A = A
+        self.B = B
+        self.I = I
+        self.graph = {'name': name}
+        self.node = UnionNodeView(self)
+
+    def network_of(self, node):
+        if self.A.has_node(node):
+            return self.A.graph['name']
+        elif self.B.has_node(node):
+            return self.B.graph['name']
+        else:
+            raise KeyError(node)
+
+    def is_directed(self):
+        return True
+
+    def nodes(self):
+        return self.A.nodes() + self.B.nodes()
+
+    def nodes_iter(self):
+        for node in self.A.nodes_iter():
+            yield node
+        for node in self.B.nodes_iter():
+            yield node
+
+    def __iter__(self):
+        return self.nodes_iter()
+
+    def __len__(self):
+        return self.number_of_nodes()
+
+    def __contains__(self, node):
+        return self.has_node(node)
+
+    def has_node(self, node):
+        return self.A.has_node(node) or self.B.has_node(node)
+
+    def number_of_nodes(self):
+        return self.A.number_of_nodes() + self.B.number_of_nodes()
+
+    # the graphs among A, B and I that contain the node
+    def _parts_of(self, node):
+        if self.A.has_node(node):
+            parts = [self.A]
+        elif self.B.has_node(node):
+            parts = [self.B]
+        else:
+            raise nx.NetworkXError('The node {} is not in the graph.'.format(node))
+        if self.I.has_node(node):
+            parts.append(self.I)
+        return parts
+
+    def successors(self, node):
+        found = []
+        for G in self._parts_of(node):
+            if G.is_directed():
+                found.extend(G.successors(node))
+            else:
+                found.extend(G.neighbors(node))
+        return found
+
+    def predecessors(self, node):
+        found = []
+        for G in self._parts_of(node):
+            if G.is_directed():
+                found.extend(G.predecessors(node))
+            else:
+                found.extend(G.neighbors(node))
+        return found
+
+    def neighbors(self, node):
+        return self.successors(node)
+
+    def out_degree(self, node):
+        return sum(G.out_degree(node) if G.is_directed() else G.degree(node) for G in self._parts_of(node))
+
+    def in_degree(self, node):
+        return sum(G.in_degree(node) if G.is_directed() else G.degree(node) for G in self._parts_of(node))
+
+    def degree(self, node):
+        return self.in_degree(node) + self.out_degree(node)
+
+    def edges_iter(self):
+        for G in [self.A, self.B, self.I]:
+            for u, v in G.edges_iter():
+                yield u, v
+                if not G.is_directed():
+                    yield v, u
+
+    def edges(self):
+        return list(self.edges_iter())
+
+    def number_of_edges(self):
+        return sum(G.number_of_edges() if G.is_directed() else 2 * G.number_of_edges()
+                   for G in [self.A, self.B, self.I])
+
+    # a copy of the union graph as a networkx DiGraph, for the algorithms that need one
+    def to_networkx(self):
+        U = nx.DiGraph()
+        U.graph['name'] = self.graph['name']
+        for node in self.A.nodes_iter():
+            U.add_node(node, {'network': self.A.graph['name']})
+        for node in self.B.nodes_iter():
+            U.add_node(node, {'network': self.B.graph['name']})
+        U.add_edges_from(self.edges_iter())
+        return U
+
+    # the adjacency matrix of the union graph, in CSR format, built from the arcs of each graph without a copy of the
+    # union graph, entry (i, j) is 1 if there is an arc from the i-th node to the j-th node of the returned list
+    def to_csr(self):
+        from scipy.sparse import coo_matrix
+
+        nodes = self.nodes()
+        idx_of = {node: i for i, node in enumerate(nodes)}
+        rows = []
+        cols = []
+        for G in [self.A, self.B, self.I]:
+            src = np.fromiter((idx_of[u] for u, v in G.edges_iter()), dtype=np.int64)
+            dst = np.fromiter((idx_of[v] for u, v in G.edges_iter()), dtype=np.int64)
+            rows.append(src)
+            cols.append(dst)
+            if not G.is_directed():
+                rows.append(dst)
+                cols.append(src)
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        adj = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(nodes), len(nodes))).tocsr()
+        return nodes, adj
+
+    # same as nx.degree_centrality, nx.in_degree_centrality
+    def degree_centrality(self):
+        scale = 1.0 / (self.number_of_nodes() - 1.0)
+        return {node: self.degree(node) * scale for node in self.nodes_iter()}
+
+    def in_degree_centrality(self):
+        scale = 1.0 / (self.number_of_nodes() - 1.0)
+        return {node: self.in_degree(node) * scale for node in self.nodes_iter()}
+
+    # same as nx.closeness_centrality, for all the nodes or only for the given ones, but the distances are calculated
+    # with breadth-first searches on the sparse adjacency matrix, chunk_size sources at a time
+    def closeness_centrality(self, nodes=None, chunk_size=256):
+        from scipy.sparse.csgraph import shortest_path
+
+        all_nodes, adj = self.to_csr()
+        node_cnt = len(all_nodes)
+        if nodes is None:
+            nodes = all_nodes
+        idx_of = {node: i for i, node in enumerate(all_nodes)}
+
+        closeness_by_node = {}
+        for i in range(0, len(nodes), chunk_size):
+            chunk = nodes[i:i + chunk_size]
+            dists = shortest_path(adj, directed=True, unweighted=True, indices=[idx_of[node] for node in chunk])
+            for node, node_dists in zip(chunk, dists):
+                reached_dists = node_dists[np.isfinite(node_dists)]
+                totsp = int(reached_dists.sum())
+                reached_cnt = len(reached_dists)
+                if totsp > 0 and node_cnt > 1:
+                    closeness = (reached_cnt - 1.0) / totsp
+                    closeness *= (reached_cnt - 1.0) / (node_cnt - 1)
+                else:
+                    closeness = 0.0
+                closeness_by_node[node] = closeness
+        return closeness_by_node
+
+    # same as nx.betweenness_centrality (normalized, unweighted), exact or estimated from k random pivots, with the
+    # breadth-first searches and the accumulation of Brandes' algorithm run on the sparse adjacency matrix
+    # the pivots are drawn, and the scores listed, in the order of the nodes of the graph returned by to_networkx, so
+    # the results are the same as the ones calculated on that copy of the union graph
+    def betweenness_centrality(self, k=None, seed=None):
+        all_nodes, adj = self.to_csr()
+        node_cnt = len(all_nodes)
+        idx_of = {node: i for i, node in enumerate(all_nodes)}
+        union_nodes = list(dict.fromkeys(all_nodes))
+        if k is None:
+            sources = union_nodes
+        else:
+            sources = random.Random(seed).sample(union_nodes, k)
+
+        betweenness = [0.0] * node_cnt
+        for source in sources:
+            s = idx_of[source]
+            dists = {s: 0}
+            sigma = {s: 1.0}  # number of shortest paths from the source to each node
+            preds = {s: []}  # neighbors of each node that are one step closer to the source
+            visit_order = [s]
+            i = 0
+            while i < len(visit_order):
+                v = visit_order[i]
+                i += 1
+                dist_w = dists[v] + 1
+                for w in adj.indices[adj.indptr[v]:adj.indptr[v + 1]].tolist():
+                    if w not in dists:
+                        dists[w] = dist_w
+                        sigma[w] = 0.0
+                        preds[w] = []
+                        visit_order.append(w)
+                    if dists[w] == dist_w:
+                        sigma[w] += sigma[v]
+                        preds[w].append(v)
+
+            delta = dict.fromkeys(visit_order, 0)
+            for w in reversed(visit_order):
+                coeff = (1.0 + delta[w]) / sigma[w]
+                for v in preds[w]:
+                    delta[v] += sigma[v] * coeff
+                if w != s:
+                    betweenness[w] += delta[w]
+
+        if node_cnt <= 2:
+            scale = 1.0
+        else:
+            scale = 1.0 / ((node_cnt - 1) * (node_cnt - 2))
+            if k is not None:
+                scale = scale * node_cnt / k
+        return {node: betweenness[idx_of[node]] * scale for node in union_nodes}